@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the rate at which requests move from a feeder process to a
+worker through a ``multiprocessing.Queue``, as a function of the batch
+size used by ``train.transport.BatchingQueue``.  Request keys are sent,
+as with ``train --indexed``, so that the cost measured is that of the
+transport rather than of pickling WSGI environments.
+"""
+
+import argparse
+import multiprocessing
+
+from train import transport
+from train import util
+
+
+def feed(queue, count, size):
+    """
+    Feed ``count`` request keys onto the queue in batches of ``size``.
+    """
+
+    if size > 1:
+        queue = transport.BatchingQueue(queue, size)
+
+    for i in range(count):
+        queue.put((i % 1000, i))
+    transport.flush(queue)
+
+
+def drain(queue, count):
+    """
+    Drain ``count`` requests from the queue, the way
+    ``TrainServer.start()`` does.
+    """
+
+    seen = 0
+    while seen < count:
+        item = queue.get()
+        seen += len(item) if isinstance(item, list) else 1
+
+
+def run(count, size):
+    """
+    Time the transfer of ``count`` requests with the given batch size.
+
+    :returns: The achieved rate, in requests per second.
+    """
+
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=feed, args=(queue, count, size))
+
+    start = util.monotonic()
+    proc.start()
+    drain(queue, count)
+    elapsed = util.monotonic() - start
+    proc.join()
+
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', '-n', type=int, default=200000,
+                        help="Number of requests to send for each batch "
+                        "size.  Default: %(default)s.")
+    parser.add_argument('sizes', type=int, nargs='*',
+                        default=[1, 2, 4, 8, 16, 32, 64, 128, 256],
+                        help="Batch sizes to measure.")
+    args = parser.parse_args()
+
+    print("%10s  %12s" % ("batch size", "requests/s"))
+    for size in args.sizes:
+        print("%10d  %12.0f" % (size, run(args.requests, size)))
+
+
+if __name__ == '__main__':
+    main()
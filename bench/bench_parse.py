@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the speed of the request file parser on a synthetic request
+file.  Lines read from the file are tokenized by examining each
+character in turn, as the parser formerly did, and by
+``request._parse_line()``.  For comparison, the file is also
+tokenized in place in a memory-mapped buffer, creating strings only
+for the fields that are kept.  Each is measured alone, driving a
+state object which ignores the parsed lines, and driving a streaming
+``RequestParseState``, which builds the requests but does not retain
+them.
+"""
+
+import argparse
+import mmap
+import os
+import re
+import tempfile
+import time
+
+from train import request
+
+
+def write_file(f, lines):
+    """
+    Write a synthetic request file of approximately the given number
+    of lines.
+    """
+
+    f.write("# Synthetic request file\n"
+            "x-auth-token: %s\n"
+            "content-type: application/json\n"
+            "   ; charset=utf-8 # continued\n" % ('a' * 32))
+
+    count = 4
+    seq = 0
+    while count < lines:
+        f.write("\n[sequence %d]  # one of many\nx-tenant: tenant%d\n" %
+                (seq, seq))
+        count += 3
+        for i in range(100):
+            f.write("get /v1.1/tenant%d/servers/detail?limit=%d\n"
+                    "x-request-id: req-%d#%d\n"
+                    "+0.%02d\n" % (seq, i, seq, i, i))
+            count += 3
+        f.write("-x-tenant\n!content-type\n")
+        count += 2
+        seq += 1
+
+
+class NullState(object):
+    """
+    A parse state which ignores the parsed lines, so that only the
+    tokenizer is measured.
+    """
+
+    def _ignore(self, *args):
+        pass
+
+    start_sequence = push_gap = start_header = extend_header = _ignore
+    delete_header = reset_header = start_request = finish = _ignore
+
+
+def parse_line_loop(state, fname, line):
+    """
+    Tokenize a line by examining each character in turn.
+    """
+
+    if line[:1] == '#':
+        return
+
+    for idx, char in enumerate(line):
+        if char == '#' and line[idx - 1].isspace():
+            line = line[:idx]
+            break
+
+    header = line[:1].isspace()
+    line = line.strip()
+
+    if not line:
+        return
+
+    if header:
+        state.extend_header(fname, line)
+        return
+    elif line[0] == '[':
+        state.start_sequence(fname, line[1:-1].strip())
+        return
+    elif line[0] == '+':
+        state.push_gap(fname, float(line[1:]))
+        return
+    elif line[0] == '-':
+        state.delete_header(fname, line[1:].strip())
+        return
+    elif line[0] == '!':
+        state.reset_header(fname, line[1:].strip())
+        return
+
+    for idx, char in enumerate(line):
+        if char.isspace():
+            state.start_request(fname, line[:idx], line[idx:].strip())
+            break
+        elif char == ':':
+            state.start_header(fname, line[:idx], line[idx + 1:].strip())
+            break
+
+
+class StreamState(request.RequestParseState):
+    """
+    A streaming parse state which discards the requests as soon as
+    they are complete.
+    """
+
+    def __init__(self):
+        super(StreamState, self).__init__(stream=True)
+
+    def finish_request(self, fname):
+        super(StreamState, self).finish_request(fname)
+        del self.ready[:]
+
+    def push_gap(self, fname, delta):
+        super(StreamState, self).push_gap(fname, delta)
+        del self.ready[:]
+
+
+# Matches a line, including its newline; group 1 is the leading space
+# and group 2 is the body, which excludes in-line comments and
+# trailing space, and is absent for comment lines
+MAPPED_LINE_RE = re.compile(r'([ \t\r\f\v]*)'
+                            r'([^\s#]\S*(?:[ \t\r\f\v]+[^\s#]\S*)*)?'
+                            r'[^\n]*\n?')
+
+
+def parse_mapped(state, fname):
+    """
+    Tokenize the lines of a file in place in a memory-mapped buffer.
+    """
+
+    with open(fname, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for match in MAPPED_LINE_RE.finditer(buf):
+                body, end = match.span(2)
+                if body < 0:
+                    continue
+
+                char = buf[body]
+                if match.end(1) > match.start():
+                    state.extend_header(fname, buf[body:end])
+                elif char == '[':
+                    state.start_sequence(fname, buf[body + 1:end - 1].strip())
+                elif char == '+':
+                    state.push_gap(fname, float(buf[body + 1:end]))
+                elif char == '-':
+                    state.delete_header(fname, buf[body + 1:end].strip())
+                elif char == '!':
+                    state.reset_header(fname, buf[body + 1:end].strip())
+                else:
+                    idx = request._TOKEN_RE.search(buf, body, end).start()
+                    if buf[idx] == ':':
+                        state.start_header(fname, buf[body:idx],
+                                           buf[idx + 1:end].lstrip())
+                    else:
+                        state.start_request(fname, buf[body:idx],
+                                            buf[idx:end].lstrip())
+        finally:
+            buf.close()
+
+    state.finish(fname)
+
+
+def parse_lines(parse_line):
+    """
+    Construct a function to parse a file line by line with the given
+    tokenizer.
+    """
+
+    def parse_file(state, fname):
+        with open(fname) as f:
+            for line in f:
+                parse_line(state, fname, line)
+        state.finish(fname)
+
+    return parse_file
+
+
+def measure(fname, lines, parse_file, state_class, repeat):
+    """
+    Parse the file with the given function.  Returns the best number
+    of lines per second.
+    """
+
+    best = None
+    for i in range(repeat):
+        state = state_class()
+        start = time.time()
+        parse_file(state, fname)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return lines / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', '-n', type=int, default=2000000,
+                        help="Number of lines in the synthetic request "
+                        "file.  Default: %(default)s.")
+    parser.add_argument('--repeat', '-r', type=int, default=1,
+                        help="Number of times to parse the file with each "
+                        "tokenizer; the best time is reported.  Default: "
+                        "%(default)s.")
+    args = parser.parse_args()
+
+    fd, fname = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write_file(f, args.lines)
+
+        with open(fname) as f:
+            lines = sum(1 for line in f)
+
+        print("%6s  %12s  %13s  %12s  %7s" %
+              ("state", "loop lines/s", "regex lines/s", "mmap lines/s",
+               "speedup"))
+        for name, state_class in [('null', NullState),
+                                  ('stream', StreamState)]:
+            loop = measure(fname, lines, parse_lines(parse_line_loop),
+                           state_class, args.repeat)
+            regex = measure(fname, lines, parse_lines(request._parse_line),
+                            state_class, args.repeat)
+            mapped = measure(fname, lines, parse_mapped, state_class,
+                             args.repeat)
+            print("%6s  %12.0f  %13.0f  %12.0f  %6.2fx" %
+                  (name, loop, regex, mapped, regex / loop))
+    finally:
+        os.unlink(fname)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the cost of synthesizing the WSGI environment of a request.
+The environment is synthesized from the template built by
+``Request.fix()``, and, for comparison, by building the whole
+environment from scratch each time, as ``Request.synthesize()``
+formerly did.
+"""
+
+import argparse
+import StringIO
+import timeit
+
+from train import request
+
+
+def make_request(headers):
+    """
+    Construct a fixed request with the given number of headers.
+    """
+
+    seq = request.Sequence('bench', {
+        'X_AUTH_TOKEN': 'a' * 32,
+        'CONTENT_TYPE': 'application/json; charset=utf-8',
+    })
+    req = request.Request(seq, 'get', '/v1.1/tenant/servers/detail?limit=10')
+    for i in range(headers):
+        req.headers['X_HEADER_%d' % i] = 'value %d' % i
+    req.fix()
+
+    return req
+
+
+def from_scratch(req):
+    """
+    Synthesize the environment without the template.
+    """
+
+    environ = req._make_template()
+    environ['wsgi.input'] = StringIO.StringIO('')
+    return environ
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', '-n', type=int, default=200000,
+                        help="Number of environments to synthesize.  "
+                        "Default: %(default)s.")
+    parser.add_argument('headers', type=int, nargs='*',
+                        default=[0, 5, 20],
+                        help="Numbers of extra headers to measure.")
+    args = parser.parse_args()
+
+    print("%7s  %14s  %14s  %7s" %
+          ("headers", "scratch req/s", "template req/s", "speedup"))
+    for headers in args.headers:
+        req = make_request(headers)
+        scratch = min(timeit.repeat(lambda: from_scratch(req),
+                                    number=args.requests, repeat=3))
+        template = min(timeit.repeat(req.synthesize,
+                                     number=args.requests, repeat=3))
+        print("%7d  %14.0f  %14.0f  %6.2fx" %
+              (headers, args.requests / scratch, args.requests / template,
+               scratch / template))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import multiprocessing
+import os
+import Queue
+import signal
+import sys
+import time
+
+import mock
+import unittest2
+
+from train import asynclog
+from train import util
+
+
+def wait_child(pid, timeout=10.0):
+    # Wait for a forked child, killing it if it hangs
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        wpid, status = os.waitpid(pid, os.WNOHANG)
+        if wpid:
+            return status
+        time.sleep(0.01)
+
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return None
+
+
+def make_record(msg='message %s', args=('arg',), exc_info=None, **extra):
+    record = logging.LogRecord('train.test', logging.INFO, 'path', 42, msg,
+                               args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestQueueHandler(unittest2.TestCase):
+    def test_prepare(self):
+        handler = asynclog.QueueHandler('queue')
+        record = make_record()
+
+        result = handler.prepare(record)
+
+        self.assertEqual(result, record)
+        self.assertEqual(record.msg, 'message arg')
+        self.assertEqual(record.message, 'message arg')
+        self.assertEqual(record.args, None)
+        self.assertEqual(record.getMessage(), 'message arg')
+
+    def test_prepare_exc_info(self):
+        handler = asynclog.QueueHandler('queue')
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            record = make_record(exc_info=sys.exc_info())
+
+        handler.prepare(record)
+
+        self.assertEqual(record.exc_info, None)
+        self.assertEqual(record.msg, 'message arg')
+        self.assertTrue(record.exc_text.startswith('Traceback'))
+        self.assertTrue(record.exc_text.endswith('ValueError: oops'))
+
+        # A text formatter on the other side still shows the traceback
+        result = logging.Formatter().format(record)
+        self.assertTrue(result.startswith('message arg\nTraceback'))
+        self.assertTrue(result.endswith('ValueError: oops'))
+
+    def test_emit(self):
+        queue = mock.Mock()
+        handler = asynclog.QueueHandler(queue)
+        record = make_record()
+
+        handler.emit(record)
+
+        queue.put_nowait.assert_called_once_with(record)
+        self.assertEqual(record.args, None)
+
+    @mock.patch.object(asynclog.QueueHandler, 'handleError')
+    def test_emit_error(self, mock_handleError):
+        queue = mock.Mock(**{'put_nowait.side_effect': Queue.Full})
+        handler = asynclog.QueueHandler(queue)
+        record = make_record()
+
+        handler.emit(record)
+
+        mock_handleError.assert_called_once_with(record)
+
+    @mock.patch('logging.Handler.close')
+    def test_close(self, mock_close):
+        queue = mock.Mock()
+        handler = asynclog.QueueHandler(queue)
+
+        handler.close()
+
+        self.assertEqual(queue.method_calls, [
+            mock.call.close(),
+            mock.call.join_thread(),
+        ])
+        mock_close.assert_called_once_with(handler)
+
+    @mock.patch('logging.Handler.close')
+    def test_close_plain_queue(self, mock_close):
+        handler = asynclog.QueueHandler(Queue.Queue())
+
+        handler.close()
+
+        mock_close.assert_called_once_with(handler)
+
+    def test_forked(self):
+        queue = multiprocessing.Queue()
+        handler = asynclog.QueueHandler(queue)
+        root = logging.getLogger()
+        root.addHandler(handler)
+        self.addCleanup(root.removeHandler, handler)
+        log = logging.getLogger('train.test')
+
+        # Logging before the fork starts the queue's feeder thread,
+        # which the child does not inherit
+        log.warning('parent')
+
+        def child():
+            for i in range(20):
+                log.warning('child %d', i)
+
+        pid = util.Launcher(child).start()
+        try:
+            messages = [queue.get(timeout=10).getMessage()
+                        for i in range(21)]
+        finally:
+            status = wait_child(pid)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(sorted(messages),
+                         sorted(['parent'] +
+                                ['child %d' % i for i in range(20)]))
+
+
+class TestQueueListener(unittest2.TestCase):
+    def test_handle(self):
+        handlers = [mock.Mock(level=logging.DEBUG),
+                    mock.Mock(level=logging.WARNING)]
+        listener = asynclog.QueueListener('queue', *handlers)
+        record = make_record()
+
+        listener.handle(record)
+
+        handlers[0].handle.assert_called_once_with(record)
+        self.assertFalse(handlers[1].handle.called)
+
+    def test_start_stop(self):
+        queue = Queue.Queue()
+        handler = mock.Mock(level=logging.DEBUG)
+        listener = asynclog.QueueListener(queue, handler)
+        records = [make_record(), make_record()]
+
+        listener.start()
+        for record in records:
+            queue.put(record)
+        listener.stop()
+
+        handler.handle.assert_has_calls([mock.call(r) for r in records])
+        self.assertEqual(handler.handle.call_count, 2)
+        self.assertEqual(listener._thread, None)
+        self.assertTrue(queue.empty())
+
+
+class TestJSONFormatter(unittest2.TestCase):
+    def test_format(self):
+        formatter = asynclog.JSONFormatter()
+        record = make_record(train=dict(status='200 OK', body_length=12))
+
+        result = json.loads(formatter.format(record))
+
+        self.assertEqual(result, {
+            'time': record.created,
+            'level': 'INFO',
+            'logger': 'train.test',
+            'pid': record.process,
+            'message': 'message arg',
+            'status': '200 OK',
+            'body_length': 12,
+        })
+
+    def test_format_exception(self):
+        formatter = asynclog.JSONFormatter()
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            record = make_record(exc_info=sys.exc_info())
+
+        result = formatter.format(record)
+
+        self.assertEqual(result.count('\n'), 0)
+        self.assertTrue(json.loads(result)['exception'].endswith(
+            'ValueError: oops'))
+
+    def test_format_queued_exception(self):
+        handler = asynclog.QueueHandler('queue')
+        formatter = asynclog.JSONFormatter()
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            record = make_record(exc_info=sys.exc_info())
+
+        result = json.loads(formatter.format(handler.prepare(record)))
+
+        self.assertEqual(result['message'], 'message arg')
+        self.assertTrue(result['exception'].startswith('Traceback'))
+        self.assertTrue(result['exception'].endswith('ValueError: oops'))
+
+
+class TestInstall(unittest2.TestCase):
+    @mock.patch.object(asynclog, 'QueueListener')
+    def test_install(self, mock_QueueListener):
+        logger = logging.getLogger('train.test.install')
+        handlers = [logging.NullHandler(), logging.NullHandler()]
+        for handler in handlers:
+            logger.addHandler(handler)
+
+        result = asynclog.install('queue', logger)
+
+        self.assertEqual(result, mock_QueueListener.return_value)
+        mock_QueueListener.assert_called_once_with('queue', *handlers)
+        result.start.assert_called_once_with()
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], asynclog.QueueHandler)
+        self.assertEqual(logger.handlers[0].queue, 'queue')
+
+    @mock.patch.object(asynclog, 'QueueListener')
+    @mock.patch('logging.getLogger')
+    def test_install_root(self, mock_getLogger, mock_QueueListener):
+        logger = mock_getLogger.return_value
+        logger.handlers = []
+
+        asynclog.install('queue')
+
+        mock_getLogger.assert_called_once_with()
+        self.assertEqual(logger.addHandler.call_count, 1)
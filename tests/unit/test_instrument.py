@@ -0,0 +1,107 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import redis
+import unittest2
+
+from train import instrument
+from train import stats
+
+
+class TestException(Exception):
+    pass
+
+
+class TestTimedCommand(unittest2.TestCase):
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    def test_call(self, mock_monotonic):
+        func = mock.Mock(return_value='result')
+        commands = mock.Mock()
+        timed = instrument.TimedCommand(func, commands)
+
+        result = timed('get', 'key', opt='value')
+
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with('get', 'key', opt='value')
+        commands.record.assert_called_once_with('GET', 0.25)
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    def test_call_exception(self, mock_monotonic):
+        func = mock.Mock(side_effect=TestException)
+        commands = mock.Mock()
+        timed = instrument.TimedCommand(func, commands)
+
+        self.assertRaises(TestException, timed, 'SET', 'key', 'value')
+        commands.record.assert_called_once_with('SET', 0.25)
+
+
+class TestTimedPipeline(unittest2.TestCase):
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    def test_call(self, mock_monotonic):
+        pipe = mock.MagicMock(**{
+            '__len__.return_value': 3,
+            'execute.return_value': ['a', 'b', 'c'],
+        })
+        execute = pipe.execute
+        commands = mock.Mock()
+        timed = instrument.TimedPipeline(pipe, commands)
+
+        result = timed(raise_on_error=False)
+
+        self.assertEqual(result, ['a', 'b', 'c'])
+        execute.assert_called_once_with(raise_on_error=False)
+        commands.record_pipeline.assert_called_once_with(3, 0.25)
+
+
+class TestPipelineFactory(unittest2.TestCase):
+    def test_call(self):
+        pipe = mock.Mock()
+        immediate = pipe.immediate_execute_command
+        execute = pipe.execute
+        func = mock.Mock(return_value=pipe)
+        factory = instrument.PipelineFactory(func, 'commands')
+
+        result = factory(transaction=False)
+
+        self.assertEqual(result, pipe)
+        func.assert_called_once_with(transaction=False)
+        self.assertIsInstance(pipe.immediate_execute_command,
+                              instrument.TimedCommand)
+        self.assertEqual(pipe.immediate_execute_command.func, immediate)
+        self.assertIsInstance(pipe.execute, instrument.TimedPipeline)
+        self.assertEqual(pipe.execute.execute, execute)
+        self.assertEqual(pipe.execute.commands, 'commands')
+
+
+class TestInstrumentRedis(unittest2.TestCase):
+    def test_instrument_redis(self):
+        pool = mock.Mock()
+        pool.get_connection.return_value.read_response.return_value = 'v'
+        client = redis.StrictRedis(connection_pool=pool)
+        commands = stats.Commands()
+
+        result = instrument.instrument_redis(client, commands)
+
+        self.assertEqual(result, client)
+        self.assertEqual(client.get('key'), 'v')
+        self.assertEqual(client.get('key'), 'v')
+        self.assertEqual(commands.commands.keys(), ['GET'])
+        self.assertEqual(commands.commands['GET'].count, 2)
+
+        pipe = client.pipeline()
+        self.assertIsInstance(pipe.execute, instrument.TimedPipeline)
+        pipe.watch('key')
+        self.assertEqual(commands.commands['WATCH'].count, 1)
@@ -0,0 +1,631 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+import mock
+import unittest2
+
+from train import memredis
+
+
+class TestEncode(unittest2.TestCase):
+    def test_status(self):
+        self.assertEqual(memredis.encode(memredis.OK), '+OK\r\n')
+
+    def test_error(self):
+        self.assertEqual(memredis.encode(memredis.Error('ERR oops')),
+                         '-ERR oops\r\n')
+
+    def test_string(self):
+        self.assertEqual(memredis.encode('value'), '$5\r\nvalue\r\n')
+
+    def test_integer(self):
+        self.assertEqual(memredis.encode(42), ':42\r\n')
+        self.assertEqual(memredis.encode(True), ':1\r\n')
+
+    def test_none(self):
+        self.assertEqual(memredis.encode(None), '$-1\r\n')
+
+    def test_null_array(self):
+        self.assertEqual(memredis.encode(memredis.NullArray()), '*-1\r\n')
+
+    def test_list(self):
+        self.assertEqual(memredis.encode(['a', 1, None, ['b']]),
+                         '*4\r\n$1\r\na\r\n:1\r\n$-1\r\n*1\r\n$1\r\nb\r\n')
+
+
+class TestParse(unittest2.TestCase):
+    def test_complete(self):
+        buf = '*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n*1\r\n$4\r\nPING\r\n'
+
+        self.assertEqual(memredis.parse(buf),
+                         ([['GET', 'key'], ['PING']], ''))
+
+    def test_partial(self):
+        buf = '*1\r\n$4\r\nPING\r\n*2\r\n$3\r\nGET\r\n$3\r\nke'
+
+        self.assertEqual(memredis.parse(buf),
+                         ([['PING']], '*2\r\n$3\r\nGET\r\n$3\r\nke'))
+
+    def test_binary(self):
+        buf = '*1\r\n$4\r\na\r\nb\r\n'
+
+        self.assertEqual(memredis.parse(buf), ([['a\r\nb']], ''))
+
+    def test_inline(self):
+        self.assertRaises(memredis.Error, memredis.parse, 'PING\r\n')
+
+
+class TestStore(unittest2.TestCase):
+    def test_get_set(self):
+        store = memredis.Store()
+
+        self.assertEqual(store.cmd_get('key'), None)
+        self.assertEqual(store.cmd_set('key', 'value'), memredis.OK)
+        self.assertEqual(store.cmd_get('key'), 'value')
+        self.assertEqual(store.version('key'), 1)
+
+    def test_set_nx_xx(self):
+        store = memredis.Store()
+
+        self.assertEqual(store.cmd_set('key', 'one', 'xx'), None)
+        self.assertEqual(store.cmd_set('key', 'one', 'NX'), memredis.OK)
+        self.assertEqual(store.cmd_set('key', 'two', 'NX'), None)
+        self.assertEqual(store.cmd_set('key', 'two', 'XX'), memredis.OK)
+        self.assertEqual(store.cmd_get('key'), 'two')
+        self.assertRaises(memredis.Error, store.cmd_set, 'key', 'v', 'XYZ')
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_set_ex(self, mock_time):
+        store = memredis.Store()
+
+        store.cmd_set('key', 'value', 'EX', '10')
+
+        self.assertEqual(store.cmd_ttl('key'), 10)
+        mock_time.return_value = 1010.0
+        self.assertEqual(store.cmd_get('key'), None)
+        self.assertEqual(store.cmd_ttl('key'), -2)
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_expire(self, mock_time):
+        store = memredis.Store()
+        store.cmd_rpush('key', 'a')
+
+        self.assertEqual(store.cmd_expire('missing', '10'), 0)
+        self.assertEqual(store.cmd_ttl('key'), -1)
+        self.assertEqual(store.cmd_expire('key', '10'), 1)
+        self.assertEqual(store.cmd_ttl('key'), 10)
+        self.assertEqual(store.cmd_expireat('key', '1005'), 1)
+        self.assertEqual(store.cmd_ttl('key'), 5)
+        mock_time.return_value = 1004.0
+        self.assertEqual(store.cmd_lrange('key', '0', '-1'), ['a'])
+        mock_time.return_value = 1005.0
+        self.assertEqual(store.cmd_lrange('key', '0', '-1'), [])
+        self.assertEqual(store.data, {})
+        self.assertEqual(store.expires, {})
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_sweep(self, mock_time):
+        store = memredis.Store()
+        store.cmd_set('key1', 'a', 'EX', '10')
+        store.cmd_set('key2', 'b', 'EX', '20')
+        store.cmd_set('key3', 'c')
+
+        store.sweep(1015.0)
+
+        self.assertEqual(store.data, {'key2': 'b', 'key3': 'c'})
+        self.assertEqual(store.expires, {'key2': 1020.0})
+        self.assertEqual(store.versions, {'key1': 2, 'key2': 1, 'key3': 1})
+
+    def test_del_exists(self):
+        store = memredis.Store()
+        store.cmd_set('key1', 'a')
+        store.cmd_sadd('key2', 'b')
+
+        self.assertEqual(store.cmd_exists('key1', 'key2', 'key3'), 2)
+        self.assertEqual(store.cmd_del('key1', 'key3'), 1)
+        self.assertEqual(store.cmd_exists('key1', 'key2', 'key3'), 1)
+
+    def test_wrong_type(self):
+        store = memredis.Store()
+        store.cmd_set('key', 'value')
+
+        self.assertRaises(memredis.Error, store.cmd_rpush, 'key', 'a')
+        self.assertRaises(memredis.Error, store.cmd_zrange, 'key', '0', '-1')
+
+    def test_lists(self):
+        store = memredis.Store()
+
+        self.assertEqual(store.cmd_rpush('key', 'b', 'c'), 2)
+        self.assertEqual(store.cmd_lpush('key', 'x', 'a'), 4)
+        self.assertEqual(store.cmd_linsert('key', 'AFTER', 'c', 'd'), 5)
+        self.assertEqual(store.cmd_linsert('key', 'before', 'x', 'w'), 6)
+        self.assertEqual(store.cmd_linsert('key', 'BEFORE', 'q', 'r'), -1)
+        self.assertEqual(store.cmd_lrange('key', '0', '-1'),
+                         ['a', 'w', 'x', 'b', 'c', 'd'])
+        self.assertEqual(store.cmd_lrange('key', '-2', '10'), ['c', 'd'])
+        self.assertEqual(store.cmd_lrange('key', '3', '1'), [])
+        self.assertEqual(store.cmd_ltrim('key', '1', '-2'), memredis.OK)
+        self.assertEqual(store.cmd_lrange('key', '0', '-1'),
+                         ['w', 'x', 'b', 'c'])
+        self.assertEqual(store.cmd_llen('key'), 4)
+
+    def test_ltrim_empty(self):
+        store = memredis.Store()
+        store.cmd_rpush('key', 'a')
+
+        store.cmd_ltrim('key', '1', '0')
+
+        self.assertEqual(store.data, {})
+
+    def test_sets(self):
+        store = memredis.Store()
+
+        self.assertEqual(store.cmd_sadd('key', 'a', 'b'), 2)
+        self.assertEqual(store.cmd_sadd('key', 'b', 'c'), 1)
+        self.assertEqual(store.cmd_srem('key', 'a', 'd'), 1)
+        self.assertEqual(store.cmd_smembers('key'), ['b', 'c'])
+        self.assertEqual(store.cmd_srem('key', 'b', 'c'), 2)
+        self.assertEqual(store.data, {})
+
+    def test_zadd(self):
+        store = memredis.Store()
+
+        self.assertEqual(store.cmd_zadd('key', '10', 'a', '5.5', 'b'), 2)
+        self.assertEqual(store.cmd_zadd('key', 'NX', '1', 'a', '1', 'c'), 1)
+        self.assertEqual(store.cmd_zadd('key', 'XX', 'CH', '2', 'a',
+                                        '2', 'd'), 1)
+        self.assertEqual(store.cmd_zrange('key', '0', '-1', 'WITHSCORES'),
+                         ['c', '1', 'a', '2', 'b', '5.5'])
+        self.assertEqual(store.cmd_zscore('key', 'b'), '5.5')
+        self.assertEqual(store.cmd_zscore('key', 'd'), None)
+        self.assertEqual(store.cmd_zcard('key'), 3)
+        self.assertRaises(memredis.Error, store.cmd_zadd, 'key', '1')
+        self.assertRaises(memredis.Error, store.cmd_zadd, 'key', 'x', 'a')
+
+    def test_zrangebyscore(self):
+        store = memredis.Store()
+        store.cmd_zadd('key', '1', 'a', '2', 'b', '3', 'c', '4', 'd')
+
+        self.assertEqual(store.cmd_zrangebyscore('key', '-inf', '+inf'),
+                         ['a', 'b', 'c', 'd'])
+        self.assertEqual(store.cmd_zrangebyscore('key', '(1', '3'),
+                         ['b', 'c'])
+        self.assertEqual(store.cmd_zrangebyscore('key', '2', '(4',
+                                                 'withscores'),
+                         ['b', '2', 'c', '3'])
+        self.assertEqual(store.cmd_zrangebyscore('key', '-inf', '+inf',
+                                                 'LIMIT', '1', '2'),
+                         ['b', 'c'])
+        self.assertRaises(memredis.Error, store.cmd_zrangebyscore,
+                          'key', 'x', '1')
+
+    def test_zrem(self):
+        store = memredis.Store()
+        store.cmd_zadd('key', '1', 'a', '2', 'b', '3', 'c', '4', 'd')
+
+        self.assertEqual(store.cmd_zrem('key', 'a', 'x'), 1)
+        self.assertEqual(store.cmd_zremrangebyscore('key', '2', '3'), 2)
+        self.assertEqual(store.cmd_zrange('key', '0', '-1'), ['d'])
+        self.assertEqual(store.cmd_zrem('key', 'd'), 1)
+        self.assertEqual(store.data, {})
+
+
+class TestServer(unittest2.TestCase):
+    def make_client(self):
+        return memredis.Client(mock.Mock(**{
+            'send.side_effect': lambda data: len(data),
+        }))
+
+    def test_execute(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+
+        self.assertEqual(server.execute(client, ['SET', 'key', 'value']),
+                         memredis.OK)
+        self.assertEqual(server.execute(client, ['get', 'key']), 'value')
+
+    def test_execute_errors(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        server.store.cmd_set('key', 'value')
+
+        for args in (['FROB'], ['GET'], ['EXPIRE', 'key', 'x'],
+                     ['RPUSH', 'key', 'a'], ['EXEC'], ['DISCARD'],
+                     ['VERSION', 'key'], ['_get', 'key', 'str']):
+            self.assertIsInstance(server.execute(client, args),
+                                  memredis.Error)
+
+    def test_transaction(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+
+        self.assertEqual(server.execute(client, ['MULTI']), memredis.OK)
+        self.assertIsInstance(server.execute(client, ['MULTI']),
+                              memredis.Error)
+        self.assertEqual(server.execute(client, ['SET', 'key', 'value']),
+                         memredis.QUEUED)
+        self.assertEqual(server.execute(client, ['RPUSH', 'key', 'a']),
+                         memredis.QUEUED)
+        self.assertEqual(server.store.data, {})
+
+        result = server.execute(client, ['EXEC'])
+
+        self.assertEqual(result[0], memredis.OK)
+        self.assertIsInstance(result[1], memredis.Error)
+        self.assertEqual(server.store.data, {'key': 'value'})
+        self.assertEqual(client.queued, None)
+
+    def test_discard(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        server.execute(client, ['WATCH', 'key'])
+        server.execute(client, ['MULTI'])
+        server.execute(client, ['SET', 'key', 'value'])
+
+        self.assertEqual(server.execute(client, ['DISCARD']), memredis.OK)
+        self.assertEqual(server.store.data, {})
+        self.assertEqual(client.queued, None)
+        self.assertEqual(client.watched, {})
+
+    def test_watch(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        other = self.make_client()
+        server.execute(client, ['WATCH', 'key'])
+        server.execute(other, ['SET', 'key', 'other'])
+        server.execute(client, ['MULTI'])
+        server.execute(client, ['SET', 'key', 'value'])
+
+        result = server.execute(client, ['EXEC'])
+
+        self.assertIsInstance(result, memredis.NullArray)
+        self.assertEqual(server.store.data, {'key': 'other'})
+        self.assertEqual(client.watched, {})
+
+    def test_watch_unchanged(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        server.execute(client, ['WATCH', 'key'])
+        server.execute(client, ['GET', 'key'])
+        server.execute(client, ['MULTI'])
+        self.assertIsInstance(server.execute(client, ['WATCH', 'key']),
+                              memredis.Error)
+        server.execute(client, ['SET', 'key', 'value'])
+
+        self.assertEqual(server.execute(client, ['EXEC']), [memredis.OK])
+        self.assertEqual(server.store.data, {'key': 'value'})
+
+    def test_unwatch(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        server.execute(client, ['WATCH', 'key'])
+
+        self.assertEqual(server.execute(client, ['UNWATCH']), memredis.OK)
+        self.assertEqual(client.watched, {})
+
+    def test_subscribe(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+
+        result = server.execute(client, ['SUBSCRIBE', 'one', 'two'])
+
+        self.assertEqual(result, ['subscribe', 'two', 2])
+        self.assertEqual(client.outbuf,
+                         memredis.encode(['subscribe', 'one', 1]))
+        self.assertEqual(client.channels, set(['one', 'two']))
+        self.assertIsInstance(server.execute(client, ['GET', 'key']),
+                              memredis.Error)
+        self.assertEqual(server.execute(client, ['PING']), memredis.PONG)
+
+    def test_unsubscribe(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        client.channels = set(['one', 'two'])
+
+        result = server.execute(client, ['UNSUBSCRIBE'])
+
+        self.assertEqual(result, ['unsubscribe', 'two', 0])
+        self.assertEqual(client.outbuf,
+                         memredis.encode(['unsubscribe', 'one', 1]))
+        self.assertEqual(server.execute(client, ['UNSUBSCRIBE']),
+                         ['unsubscribe', None, 0])
+
+    def test_publish(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        sub1 = self.make_client()
+        sub1.channels = set(['control'])
+        sub2 = self.make_client()
+        sub2.patterns = set(['cont*'])
+        sub3 = self.make_client()
+        sub3.channels = set(['errors'])
+        server.clients = {1: client, 2: sub1, 3: sub2, 4: sub3}
+
+        result = server.execute(client, ['PUBLISH', 'control', 'reload'])
+
+        self.assertEqual(result, 2)
+        sub1.sock.send.assert_called_once_with(
+            memredis.encode(['message', 'control', 'reload']))
+        sub2.sock.send.assert_called_once_with(
+            memredis.encode(['pmessage', 'cont*', 'control', 'reload']))
+        self.assertFalse(sub3.sock.send.called)
+        self.assertEqual(sub1.outbuf, '')
+
+    def test_read(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        client.inbuf = '*2\r\n$3\r\nGET\r\n'
+        client.sock.recv.return_value = '$3\r\nkey\r\n*1\r\n$4\r\nPI'
+        server.clients = {client.sock: client}
+
+        server._read(client)
+
+        client.sock.send.assert_called_once_with('$-1\r\n')
+        self.assertEqual(client.inbuf, '*1\r\n$4\r\nPI')
+        self.assertEqual(client.outbuf, '')
+
+    def test_read_closed(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        client.sock.recv.return_value = ''
+        server.clients = {client.sock: client}
+
+        server._read(client)
+
+        client.sock.close.assert_called_once_with()
+        self.assertEqual(server.clients, {})
+
+    def test_flush_partial(self):
+        server = memredis.Server('listener')
+        client = self.make_client()
+        client.sock.send.side_effect = [3, memredis.socket.error(
+            memredis.errno.EAGAIN, 'again')]
+        client.outbuf = '+OK\r\n'
+
+        server._flush(client)
+
+        self.assertEqual(client.outbuf, '\r\n')
+
+    @mock.patch('os.getppid', side_effect=[1234, 1234, 1])
+    def test_serve_parent_exits(self, mock_getppid):
+        listener, other = socket.socketpair()
+        self.addCleanup(listener.close)
+        self.addCleanup(other.close)
+        server = memredis.Server(listener, sweep_interval=0.001)
+
+        server.serve()
+
+        self.assertEqual(mock_getppid.call_count, 3)
+
+    @mock.patch('os.getppid', return_value=1)
+    def test_serve_parent_given(self, mock_getppid):
+        listener, other = socket.socketpair()
+        self.addCleanup(listener.close)
+        self.addCleanup(other.close)
+        server = memredis.Server(listener, sweep_interval=0.001)
+
+        server.serve(1234)
+
+        mock_getppid.assert_called_once_with()
+
+
+class TestFakeRedis(unittest2.TestCase):
+    def kill(self, pid):
+        # Don't leave a server behind if a test fails
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    @mock.patch('tempfile.mkdtemp', return_value='/tmp/train-redis-x')
+    @mock.patch('socket.socket')
+    @mock.patch.object(memredis, 'Server')
+    @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
+        'start.return_value': 1234,
+    }))
+    @mock.patch('os.getpid', return_value=42)
+    def test_start(self, mock_getpid, mock_Launcher, mock_Server,
+                   mock_socket, mock_mkdtemp):
+        fake = memredis.FakeRedis()
+
+        result = fake.start()
+
+        self.assertEqual(result, 1234)
+        self.assertEqual(fake.pid, 1234)
+        self.assertEqual(fake.path, '/tmp/train-redis-x/redis.sock')
+        listener = mock_socket.return_value
+        mock_socket.assert_called_once_with(memredis.socket.AF_UNIX,
+                                            memredis.socket.SOCK_STREAM)
+        listener.bind.assert_called_once_with(fake.path)
+        listener.listen.assert_called_once_with(128)
+        mock_Server.assert_called_once_with(listener)
+        mock_Launcher.assert_called_once_with(fake._serve,
+                                              mock_Server.return_value, 42)
+        listener.close.assert_called_once_with()
+        self.assertEqual(fake._owner, 42)
+
+    @mock.patch('shutil.rmtree')
+    def test_serve(self, mock_rmtree):
+        fake = memredis.FakeRedis()
+        fake.path = '/tmp/train-redis-x/redis.sock'
+        fake._tmpdir = '/tmp/train-redis-x'
+        server = mock.Mock()
+
+        fake._serve(server, 42)
+
+        server.serve.assert_called_once_with(42)
+        mock_rmtree.assert_called_once_with('/tmp/train-redis-x',
+                                            ignore_errors=True)
+        self.assertEqual(fake.path, None)
+
+    def test_parent_exits(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'redis.sock')
+
+        # Start the server from a child which exits without stopping
+        # it
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(rfd)
+            os.write(wfd, str(memredis.FakeRedis(path).start()))
+            os._exit(0)
+        os.close(wfd)
+        server = int(os.read(rfd, 32))
+        os.close(rfd)
+        os.waitpid(pid, 0)
+        self.addCleanup(self.kill, server)
+        self.assertTrue(os.path.exists(path))
+
+        deadline = time.time() + 10.0
+        while os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.05)
+
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch('os.getpid', return_value=42)
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid')
+    @mock.patch('shutil.rmtree')
+    def test_stop(self, mock_rmtree, mock_waitpid, mock_kill, mock_getpid):
+        fake = memredis.FakeRedis()
+        fake.pid = 1234
+        fake.path = '/tmp/train-redis-x/redis.sock'
+        fake._tmpdir = '/tmp/train-redis-x'
+        fake._owner = 42
+
+        fake.stop()
+
+        mock_kill.assert_called_once_with(1234, signal.SIGTERM)
+        mock_waitpid.assert_called_once_with(1234, 0)
+        mock_rmtree.assert_called_once_with('/tmp/train-redis-x',
+                                            ignore_errors=True)
+        self.assertEqual(fake.pid, None)
+        self.assertEqual(fake.path, None)
+
+    @mock.patch('os.getpid', return_value=43)
+    @mock.patch('os.kill')
+    def test_stop_other_process(self, mock_kill, mock_getpid):
+        fake = memredis.FakeRedis()
+        fake.pid = 1234
+        fake._owner = 42
+
+        fake.stop()
+
+        self.assertFalse(mock_kill.called)
+        self.assertEqual(fake.pid, 1234)
+
+    @mock.patch('signal.getsignal', return_value=signal.SIG_DFL)
+    @mock.patch('signal.signal')
+    @mock.patch('os.getpid', return_value=42)
+    @mock.patch('os.kill')
+    def test_stop_on_signal(self, mock_kill, mock_getpid, mock_signal,
+                            mock_getsignal):
+        fake = memredis.FakeRedis()
+
+        with mock.patch.object(fake, 'stop') as mock_stop:
+            fake.stop_on_signal()
+
+            mock_getsignal.assert_called_once_with(signal.SIGTERM)
+            mock_signal.assert_called_once_with(signal.SIGTERM, mock.ANY)
+            handler = mock_signal.call_args[0][1]
+            mock_signal.reset_mock()
+
+            handler(signal.SIGTERM, 'frame')
+
+        mock_stop.assert_called_once_with()
+        mock_signal.assert_has_calls([
+            mock.call(signal.SIGTERM, signal.SIG_DFL),
+            mock.call(signal.SIGTERM, signal.SIG_DFL),
+        ])
+        mock_kill.assert_called_once_with(42, signal.SIGTERM)
+
+    @mock.patch('signal.getsignal')
+    @mock.patch('signal.signal')
+    @mock.patch('os.kill')
+    def test_stop_on_signal_previous(self, mock_kill, mock_signal,
+                                     mock_getsignal):
+        previous = mock.Mock()
+        mock_getsignal.return_value = previous
+        fake = memredis.FakeRedis()
+
+        with mock.patch.object(fake, 'stop') as mock_stop:
+            fake.stop_on_signal(signal.SIGHUP)
+            handler = mock_signal.call_args[0][1]
+            mock_signal.reset_mock()
+
+            handler(signal.SIGHUP, 'frame')
+
+        mock_stop.assert_called_once_with()
+        mock_signal.assert_called_once_with(signal.SIGHUP, previous)
+        previous.assert_called_once_with(signal.SIGHUP, 'frame')
+        self.assertFalse(mock_kill.called)
+
+    @mock.patch('signal.getsignal', return_value=signal.SIG_IGN)
+    @mock.patch('signal.signal')
+    @mock.patch('os.kill')
+    def test_stop_on_signal_ignored(self, mock_kill, mock_signal,
+                                    mock_getsignal):
+        fake = memredis.FakeRedis()
+
+        with mock.patch.object(fake, 'stop') as mock_stop:
+            fake.stop_on_signal()
+            handler = mock_signal.call_args[0][1]
+            mock_signal.reset_mock()
+
+            handler(signal.SIGTERM, 'frame')
+
+        mock_stop.assert_called_once_with()
+        mock_signal.assert_called_once_with(signal.SIGTERM, signal.SIG_IGN)
+        self.assertFalse(mock_kill.called)
+
+
+class TestLoadLimits(unittest2.TestCase):
+    @mock.patch('lxml.etree.parse')
+    @mock.patch('turnstile.tools.parse_limit_node')
+    @mock.patch('msgpack.dumps', side_effect=lambda x: 'packed %s' % x)
+    def test_load_limits(self, mock_dumps, mock_parse_limit_node,
+                         mock_parse):
+        nodes = [mock.Mock(tag='limit'), mock.Mock(tag='comment'),
+                 mock.Mock(tag='limit')]
+        mock_parse.return_value.getroot.return_value = nodes
+        lims = [mock.Mock(**{'dehydrate.return_value': 'lim1'}),
+                mock.Mock(**{'dehydrate.return_value': 'lim2'})]
+        mock_parse_limit_node.side_effect = lims
+        db = mock.Mock()
+        conf = mock.MagicMock(**{'get_database.return_value': db})
+        conf.__getitem__.return_value = {'limits_key': 'lims'}
+
+        result = memredis.load_limits(conf, 'limits.xml')
+
+        self.assertEqual(result, lims)
+        mock_parse.assert_called_once_with('limits.xml')
+        mock_parse_limit_node.assert_has_calls([
+            mock.call(db, 0, nodes[0]),
+            mock.call(db, 2, nodes[2]),
+        ])
+        db.execute_command.assert_has_calls([
+            mock.call('DEL', 'lims'),
+            mock.call('ZADD', 'lims', 10, 'packed lim1'),
+            mock.call('ZADD', 'lims', 20, 'packed lim2'),
+        ])
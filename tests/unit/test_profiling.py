@@ -0,0 +1,209 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import pstats
+import shutil
+import signal
+import StringIO
+import sys
+import tempfile
+
+import mock
+import unittest2
+
+from train import profiling
+from train import util
+
+
+class TestException(Exception):
+    pass
+
+
+def busy(count):
+    return sum(range(count))
+
+
+def fail():
+    raise TestException()
+
+
+def stopped():
+    raise util.SignalExit(15)
+
+
+class TestProfiler(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'test.pstats')
+
+    def get_functions(self):
+        stats = pstats.Stats(self.path)
+        return set(func[2] for func in stats.stats)
+
+    def test_call(self):
+        profiler = profiling.Profiler(busy, self.path)
+
+        result = profiler(10)
+
+        self.assertEqual(result, 45)
+        self.assertIn('busy', self.get_functions())
+
+    def test_call_exception(self):
+        profiler = profiling.Profiler(fail, self.path)
+
+        self.assertRaises(TestException, profiler)
+        self.assertIn('fail', self.get_functions())
+
+    def test_call_signal_exit(self):
+        profiler = profiling.Profiler(stopped, self.path)
+
+        self.assertRaises(util.SignalExit, profiler)
+        self.assertIn('stopped', self.get_functions())
+
+
+class TestSampler(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'test.collapsed')
+
+    def test_sample(self):
+        sampler = profiling.Sampler(busy, self.path)
+
+        def inner():
+            sampler._sample(signal.SIGPROF, sys._getframe())
+
+        inner()
+        inner()
+
+        self.assertEqual(len(sampler.stacks), 1)
+        stack, count = sampler.stacks.items()[0]
+        self.assertEqual(count, 2)
+        frames = stack.split(';')
+        self.assertTrue(frames[-2].startswith('test_sample ('))
+        self.assertEqual(frames[-1], 'inner (%s:%d)' %
+                         (inner.func_code.co_filename,
+                          inner.func_code.co_firstlineno))
+
+    @mock.patch('signal.setitimer')
+    @mock.patch('signal.siginterrupt')
+    @mock.patch('signal.signal', return_value='old_handler')
+    def test_call(self, mock_signal, mock_siginterrupt, mock_setitimer):
+        sampler = profiling.Sampler(busy, self.path, 0.01)
+        sampler.stacks['a;b'] = 3
+
+        result = sampler(10)
+
+        self.assertEqual(result, 45)
+        mock_signal.assert_has_calls([
+            mock.call(signal.SIGPROF, sampler._sample),
+            mock.call(signal.SIGPROF, 'old_handler'),
+        ])
+        mock_siginterrupt.assert_called_once_with(signal.SIGPROF, False)
+        mock_setitimer.assert_has_calls([
+            mock.call(signal.ITIMER_PROF, 0.01, 0.01),
+            mock.call(signal.ITIMER_PROF, 0),
+        ])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'a;b 3\n')
+
+    @mock.patch('signal.setitimer')
+    @mock.patch('signal.siginterrupt')
+    @mock.patch('signal.signal', return_value='old_handler')
+    def test_call_signal_exit(self, mock_signal, mock_siginterrupt,
+                              mock_setitimer):
+        sampler = profiling.Sampler(stopped, self.path)
+
+        self.assertRaises(util.SignalExit, sampler)
+        mock_setitimer.assert_called_with(signal.ITIMER_PROF, 0)
+        mock_signal.assert_called_with(signal.SIGPROF, 'old_handler')
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_call_samples(self):
+        sampler = profiling.Sampler(busy, self.path, 0.001)
+
+        sampler(3000000)
+
+        self.assertTrue(any('busy (' in stack for stack in sampler.stacks))
+
+
+class TestWorkerPath(unittest2.TestCase):
+    def test_worker_path(self):
+        self.assertEqual(profiling.worker_path('/tmp/prof', 3),
+                         '/tmp/prof/worker-3.pstats')
+
+    def test_worker_path_ext(self):
+        self.assertEqual(profiling.worker_path('/tmp/prof', 3, 'collapsed'),
+                         '/tmp/prof/worker-3.collapsed')
+
+
+class TestMerge(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_merge(self):
+        paths = [profiling.worker_path(self.tmpdir, i) for i in range(3)]
+        profiling.Profiler(busy, paths[0])(10)
+        profiling.Profiler(busy, paths[1])(20)
+        output = os.path.join(self.tmpdir, 'merged.pstats')
+        stream = StringIO.StringIO()
+
+        result = profiling.merge(paths, stream, 'calls', 5, output)
+
+        self.assertEqual(len(result.files), 2)
+        self.assertIn('busy', stream.getvalue())
+        merged = pstats.Stats(output)
+        busy_stats = [v for k, v in merged.stats.items() if k[2] == 'busy']
+        self.assertEqual(busy_stats[0][1], 2)
+
+    def test_merge_none(self):
+        stream = StringIO.StringIO()
+
+        result = profiling.merge([os.path.join(self.tmpdir, 'missing')],
+                                 stream)
+
+        self.assertEqual(result, None)
+        self.assertEqual(stream.getvalue(), '')
+
+
+class TestCollapsed(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_write_collapsed(self):
+        fobj = StringIO.StringIO()
+
+        profiling.write_collapsed(fobj, {'b;c': 2, 'a (x y:1);b': 5})
+
+        self.assertEqual(fobj.getvalue(), 'a (x y:1);b 5\nb;c 2\n')
+
+    def test_merge_collapsed(self):
+        paths = [os.path.join(self.tmpdir, name)
+                 for name in ('w0', 'w1', 'missing')]
+        with open(paths[0], 'w') as f:
+            f.write('a (x y:1);b 5\nb;c 2\n')
+        with open(paths[1], 'w') as f:
+            f.write('a (x y:1);b 1\nd 7\n\n')
+        output = os.path.join(self.tmpdir, 'merged')
+
+        result = profiling.merge_collapsed(paths, output)
+
+        self.assertEqual(result, {'a (x y:1);b': 6, 'b;c': 2, 'd': 7})
+        with open(output) as f:
+            self.assertEqual(f.read(), 'a (x y:1);b 6\nb;c 2\nd 7\n')
@@ -0,0 +1,148 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import StringIO
+import threading
+
+import mock
+import unittest2
+
+from train import progress
+
+
+class TestProgress(unittest2.TestCase):
+    def test_init(self):
+        prog = progress.Progress(3)
+
+        self.assertEqual(prog.workers, 3)
+        self.assertEqual(len(prog._counts), 3 * len(progress.FIELDS))
+        self.assertEqual(len(prog._buckets), 3 * progress.BUCKETS)
+
+    def test_snapshot_empty(self):
+        prog = progress.Progress(2)
+
+        totals, buckets = prog.snapshot()
+
+        self.assertEqual(totals, dict(dispatched=0, completed=0, errors=0,
+                                      limited=0))
+        self.assertEqual(buckets, [0] * progress.BUCKETS)
+
+    def test_slots(self):
+        prog = progress.Progress(2)
+        slot0 = prog.slot(0)
+        slot1 = prog.slot(1)
+
+        slot0.dispatched(3)
+        slot1.dispatched()
+        slot0.record(0.000005)
+        slot0.record(0.000005, error=True)
+        slot1.record(0.000007, limited=True)
+        slot1.record(1e6)
+
+        totals, buckets = prog.snapshot()
+
+        self.assertEqual(totals, dict(dispatched=4, completed=4, errors=1,
+                                      limited=1))
+        self.assertEqual(buckets[5], 2)
+        self.assertEqual(buckets[7], 1)
+        self.assertEqual(buckets[-1], 1)
+        self.assertEqual(sum(buckets), 4)
+        self.assertEqual(list(prog._counts), [3, 2, 1, 0, 1, 2, 0, 1])
+
+
+class TestPercentile(unittest2.TestCase):
+    def test_empty(self):
+        self.assertEqual(progress.percentile([0] * 10, 99), None)
+
+    def test_percentile(self):
+        buckets = [0] * progress.BUCKETS
+        buckets[3] = 98
+        buckets[10] = 2
+
+        self.assertAlmostEqual(progress.percentile(buckets, 50), 0.000003)
+        self.assertAlmostEqual(progress.percentile(buckets, 99), 0.00001)
+
+
+class TestTicker(unittest2.TestCase):
+    def test_init(self):
+        ticker = progress.Ticker('progress')
+
+        self.assertEqual(ticker.progress, 'progress')
+        self.assertEqual(ticker.queue, None)
+        self.assertEqual(ticker.interval, 1.0)
+        self.assertNotEqual(ticker.out, None)
+
+    def test_format(self):
+        queue = mock.Mock(**{'qsize.return_value': 12})
+        ticker = progress.Ticker('progress', queue)
+        prev = (dict(dispatched=100, completed=90, errors=0, limited=0),
+                [0] * 20)
+        buckets = [0] * 20
+        buckets[2] = 150
+        buckets[10] = 10
+        cur = (dict(dispatched=270, completed=250, errors=1, limited=3),
+               buckets)
+
+        result = ticker.format(12.04, 0.5, prev, cur)
+
+        self.assertEqual(result, "[   12.0s] 320.0 req/s; dispatched 270, "
+                         "completed 250, errors 1, limited 3; queue depth "
+                         "12; p99 0.010ms")
+
+    def test_format_unknown(self):
+        queue = mock.Mock(**{'qsize.side_effect': NotImplementedError})
+        ticker = progress.Ticker('progress', queue)
+        snap = (dict(dispatched=0, completed=0, errors=0, limited=0), [0] * 4)
+
+        result = ticker.format(1.0, 1.0, snap, snap)
+
+        self.assertEqual(result, "[    1.0s] 0.0 req/s; dispatched 0, "
+                         "completed 0, errors 0, limited 0; queue depth -; "
+                         "p99 -")
+
+    def test_start_stop(self):
+        prog = progress.Progress(1)
+        out = StringIO.StringIO()
+        ticker = progress.Ticker(prog, interval=0.01, out=out)
+
+        ticker.start()
+        prog.slot(0).record(0.001)
+        while not out.getvalue():
+            ticker._stop.wait(0.01)
+        ticker.stop()
+
+        self.assertEqual(ticker._thread, None)
+        self.assertTrue(out.getvalue().startswith('['))
+        self.assertTrue(out.getvalue().endswith('\n'))
+
+    def test_run(self):
+        prog = progress.Progress(1)
+        out = StringIO.StringIO()
+        ticker = progress.Ticker(prog, interval=0.01, out=out)
+        stop = threading.Event()
+        waits = []
+
+        # As on Python 2.6, wait() does not return the flag
+        def fake_wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 3:
+                stop.set()
+
+        ticker._stop = mock.Mock(wait=fake_wait, is_set=stop.is_set)
+
+        ticker._run()
+
+        self.assertEqual(waits, [0.01] * 3)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
@@ -0,0 +1,98 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import marshal
+import os
+import shutil
+import tempfile
+
+import mock
+import unittest2
+
+from train import reqcache
+
+
+class TestReqCache(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fname = os.path.join(self.tmpdir, 'requests.txt')
+        with open(self.fname, 'w') as f:
+            f.write('[seq]\nGET /\n')
+
+    @mock.patch.object(reqcache, 'CHUNK_SIZE', 4)
+    def test_digest(self):
+        result = reqcache.digest(self.fname)
+
+        self.assertEqual(result, hashlib.sha1('[seq]\nGET /\n').hexdigest())
+
+    def test_cache_path(self):
+        result = reqcache.cache_path('cache', self.fname)
+
+        self.assertEqual(result, os.path.join(
+            'cache', '%s.cache' % hashlib.sha1(self.fname).hexdigest()))
+
+    def test_stamp(self):
+        os.utime(self.fname, (1000.0, 1001.0))
+
+        result = reqcache.stamp(self.fname)
+
+        self.assertEqual(result, (1001.0, reqcache.digest(self.fname)))
+
+    def test_save_load(self):
+        stamp = reqcache.stamp(self.fname)
+
+        reqcache.save(self.tmpdir, self.fname, stamp, ['data'])
+        result = reqcache.load(self.tmpdir, self.fname, stamp)
+
+        self.assertEqual(result, ['data'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([
+            'requests.txt',
+            os.path.basename(reqcache.cache_path(self.tmpdir, self.fname)),
+        ]))
+
+    def test_load_missing(self):
+        result = reqcache.load(self.tmpdir, self.fname, (1000.0, 'digest'))
+
+        self.assertEqual(result, None)
+
+    def test_load_stale(self):
+        reqcache.save(self.tmpdir, self.fname, (1000.0, 'digest'), ['data'])
+
+        self.assertEqual(reqcache.load(self.tmpdir, self.fname,
+                                       (1001.0, 'digest')), None)
+        self.assertEqual(reqcache.load(self.tmpdir, self.fname,
+                                       (1000.0, 'other')), None)
+        self.assertEqual(reqcache.load(self.tmpdir, self.fname,
+                                       (1000.0, 'digest')), ['data'])
+
+    @mock.patch.object(reqcache, 'VERSION', 0)
+    def test_load_old_version(self):
+        stamp = reqcache.stamp(self.fname)
+        with open(reqcache.cache_path(self.tmpdir, self.fname), 'wb') as f:
+            f.write(marshal.dumps((1, stamp, ['data'])))
+
+        result = reqcache.load(self.tmpdir, self.fname, stamp)
+
+        self.assertEqual(result, None)
+
+    def test_load_corrupt(self):
+        with open(reqcache.cache_path(self.tmpdir, self.fname), 'wb') as f:
+            f.write('garbage')
+
+        result = reqcache.load(self.tmpdir, self.fname, (1000.0, 'digest'))
+
+        self.assertEqual(result, None)
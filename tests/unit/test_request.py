@@ -41,7 +41,9 @@ class TestSequence(unittest2.TestCase):
 
         self.assertEqual(seq.requests, ['request1', 'gap', 'request2'])
 
-    def test_queue_request(self):
+    @mock.patch('time.sleep')
+    @mock.patch('train.util.monotonic', return_value=1000.0)
+    def test_queue_request(self, mock_monotonic, mock_sleep):
         seq = request.Sequence('test_seq', {})
         requests = [
             mock.Mock(),
@@ -54,6 +56,42 @@ class TestSequence(unittest2.TestCase):
 
         for req in requests:
             req.queue_request.assert_called_once_with('queue')
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch('time.sleep')
+    @mock.patch('train.util.monotonic', side_effect=[
+        1000.0,  # start
+        1000.0, 1000.0, 1000.0,  # req 0
+        1000.5, 1001.5, 1001.5,  # req 1
+        1003.2, 1003.2, 1003.3,  # req 2
+    ])
+    def test_queue_request_gaps(self, mock_monotonic, mock_sleep):
+        seq = request.Sequence('test_seq', {})
+        requests = [
+            mock.Mock(),
+            request.Gap(1.5),
+            mock.Mock(),
+            request.Gap(1.5),
+            mock.Mock(),
+        ]
+        seq.requests = requests
+        results = mock.Mock()
+
+        queue = mock.Mock(spec=['put', 'flush'])
+
+        seq.queue_request(queue, results)
+
+        for req in requests[::2]:
+            req.queue_request.assert_called_once_with(queue)
+        mock_sleep.assert_called_once_with(1.0)
+        self.assertEqual(queue.flush.call_count, 2)
+        self.assertEqual(results.put.call_count, 1)
+        lag = results.put.call_args[0][0]
+        self.assertEqual(lag.count, 3)
+        self.assertAlmostEqual(lag.min, 0.0)
+        self.assertAlmostEqual(lag.max, 0.2)
+        self.assertEqual(lag.first, 1000.0)
+        self.assertEqual(lag.last, 1003.3)
 
 
 class TestRequest(unittest2.TestCase):
@@ -71,12 +109,24 @@ class TestRequest(unittest2.TestCase):
 
     def test_init(self):
         headers = dict(a=1, b=2, c=3)
-        req = request.Request(mock.Mock(headers=headers), 'get', 'uri')
+        seq = mock.Mock(headers=headers)
+        seq.name = 'test_seq'
+        req = request.Request(seq, 'get', 'uri')
 
+        self.assertEqual(req.sequence_name, 'test_seq')
         self.assertEqual(req.method, 'GET')
         self.assertEqual(req.uri, 'uri')
         self.assertIsInstance(req.headers, util.StackedDict)
         self.assertEqual(req.headers, dict(a=1, b=2, c=3))
+        self.assertEqual(req.key, None)
+        self.assertEqual(req.template, None)
+
+    def test_init_headers(self):
+        headers = dict(a=1)
+        seq = mock.Mock(headers=dict(b=2))
+        req = request.Request(seq, 'get', 'uri', headers)
+
+        self.assertIs(req.headers, headers)
 
     def test_fix(self):
         headers = dict(a=1, b=2, c=3)
@@ -89,10 +139,14 @@ class TestRequest(unittest2.TestCase):
 
         self.assertIsInstance(req.headers, dict)
         self.assertEqual(req.headers, dict(a=1, b=2, c=3, d=4))
+        self.assertEqual(req.template['HTTP_d'], 4)
+        self.assertFalse('wsgi.input' in req.template)
 
     def test_synthesize_basic(self):
         headers = dict(A='1', B='2', C='3')
-        req = request.Request(mock.Mock(headers=headers), 'get', 'uri%20test')
+        seq = mock.Mock(headers=headers)
+        seq.name = 'test_seq'
+        req = request.Request(seq, 'get', 'uri%20test')
         req.fix()
 
         environ = req.synthesize()
@@ -114,6 +168,7 @@ class TestRequest(unittest2.TestCase):
             'REMOTE_ADDR': 'localhost',
             'REMOTE_PORT': '80',
             'GATEWAY_INTERFACE': 'CGI/1.1',
+            'train.sequence': 'test_seq',
             'CONTENT_TYPE': 'text/plain',
             'HTTP_A': '1',
             'HTTP_B': '2',
@@ -162,15 +217,57 @@ class TestRequest(unittest2.TestCase):
         self.partial_dict(expected, [], environ)
         self.assertEqual(environ['wsgi.input'].read(), '')
 
-    @mock.patch.object(request.Request, 'synthesize', return_value='environ')
-    def test_queue_request(self, mock_synthesize):
+    def test_synthesize_unfixed(self):
+        headers = dict(A='1')
+        req = request.Request(mock.Mock(headers=headers), 'get', 'uri')
+
+        environ = req.synthesize()
+
+        self.partial_dict(dict(REQUEST_METHOD='GET', HTTP_A='1'), [],
+                          environ)
+        self.assertEqual(environ['wsgi.input'].read(), '')
+        self.assertEqual(req.template, None)
+
+    def test_synthesize_fresh(self):
+        headers = dict(A='1')
+        req = request.Request(mock.Mock(headers=headers), 'get', 'uri')
+        req.fix()
+
+        environ1 = req.synthesize()
+        environ1['HTTP_A'] = '2'
+        environ1['wsgi.input'].read()
+        environ2 = req.synthesize()
+
+        self.assertEqual(environ2['HTTP_A'], '1')
+        self.assertNotEqual(environ1['wsgi.input'], environ2['wsgi.input'])
+        self.assertFalse('wsgi.input' in req.template)
+
+    @mock.patch('train.util.monotonic', return_value=1000.5)
+    @mock.patch.object(request.Request, 'synthesize',
+                       return_value=dict(environ='here'))
+    def test_queue_request(self, mock_synthesize, mock_monotonic):
         req = request.Request(mock.Mock(headers={}), 'get', 'uri_test')
         queue = mock.Mock()
 
         req.queue_request(queue)
 
         mock_synthesize.assert_called_once_with()
-        queue.put.assert_called_once_with('environ')
+        queue.put.assert_called_once_with({
+            'environ': 'here',
+            'train.enqueued': 1000.5,
+        })
+
+    @mock.patch('train.util.monotonic', return_value=1000.5)
+    @mock.patch.object(request.Request, 'synthesize', return_value={})
+    def test_queue_request_key(self, mock_synthesize, mock_monotonic):
+        req = request.Request(mock.Mock(headers={}), 'get', 'uri_test')
+        req.key = (3, 5)
+        queue = mock.Mock()
+
+        req.queue_request(queue)
+
+        self.assertFalse(mock_synthesize.called)
+        queue.put.assert_called_once_with((3, 5, 1000.5))
 
 
 class TestGap(unittest2.TestCase):
@@ -179,14 +276,6 @@ class TestGap(unittest2.TestCase):
 
         self.assertEqual(gap.delta, 18.23)
 
-    @mock.patch('time.sleep')
-    def test_queue_request(self, mock_sleep):
-        gap = request.Gap(18.23)
-
-        gap.queue_request('queue')
-
-        mock_sleep.assert_called_once_with(18.23)
-
 
 class TestPartialHeader(unittest2.TestCase):
     def test_canon_name(self):
@@ -219,6 +308,12 @@ class TestRequestParseState(unittest2.TestCase):
         self.assertEqual(state._sequence, None)
         self.assertEqual(state._request, None)
         self.assertEqual(state._header, None)
+        self.assertEqual(state.ready, None)
+
+    def test_init_stream(self):
+        state = request.RequestParseState(stream=True)
+
+        self.assertEqual(state.ready, [])
 
     @mock.patch.object(request.RequestParseState, 'finish_request')
     @mock.patch.object(request.RequestParseState, 'finish_header')
@@ -346,6 +441,18 @@ class TestRequestParseState(unittest2.TestCase):
         mock_Request.assert_called_once_with(state._sequence, 'get', 'uri')
         state._sequence.push.assert_called_once_with('new_req')
 
+    @mock.patch.object(request, 'Request', return_value='new_req')
+    def test_start_request_stream(self, mock_Request):
+        state = request.RequestParseState(stream=True)
+        state._sequence = mock.Mock()
+
+        state.start_request('filename', 'get', 'uri')
+
+        self.assertEqual(state._request, 'new_req')
+        mock_Request.assert_called_once_with(state._sequence, 'get', 'uri')
+        self.assertFalse(state._sequence.push.called)
+        self.assertEqual(state.ready, [])
+
     def test_finish_request(self):
         req = mock.Mock()
         state = request.RequestParseState()
@@ -356,6 +463,18 @@ class TestRequestParseState(unittest2.TestCase):
         req.fix.assert_called_once_with()
         self.assertEqual(state._request, None)
 
+    def test_finish_request_stream(self):
+        req = mock.Mock()
+        state = request.RequestParseState(stream=True)
+        state._sequence = 'sequence'
+        state._request = req
+
+        state.finish_request('filename')
+
+        req.fix.assert_called_once_with()
+        self.assertEqual(state.ready, [('sequence', req)])
+        self.assertEqual(state._request, None)
+
     @mock.patch.object(request.RequestParseState, 'finish_request')
     @mock.patch.object(request.RequestParseState, 'finish_header')
     @mock.patch.object(request, 'Gap', return_value='gap')
@@ -405,6 +524,17 @@ class TestRequestParseState(unittest2.TestCase):
         mock_Gap.assert_called_once_with(12.34)
         state._sequence.push.assert_called_once_with('gap')
 
+    @mock.patch.object(request, 'Gap', return_value='gap')
+    def test_push_gap_stream(self, mock_Gap):
+        state = request.RequestParseState(stream=True)
+        state._sequence = mock.Mock()
+
+        state.push_gap('filename', 12.34)
+
+        mock_Gap.assert_called_once_with(12.34)
+        self.assertFalse(state._sequence.push.called)
+        self.assertEqual(state.ready, [(state._sequence, 'gap')])
+
     @mock.patch.object(request.RequestParseState, 'finish_header')
     @mock.patch.object(request, 'PartialHeader', return_value='header')
     def test_start_header(self, mock_PartialHeader, mock_finish_header):
@@ -646,6 +776,27 @@ get /some/uri#fragment # introduce a request
             mock.call.finish('filename'),
         ])
 
+    @mock.patch('__builtin__.open')
+    def test_parse_file_tokens(self, mock_open):
+        state = mock.Mock()
+        self.prep_data(mock_open, """
+x-header:value:with:colons\t# tab before comment
+get\t/uri:with#colon
+put /uri?q=a:b #comment
+\tcontinuation#not a comment
+""")
+
+        request._parse_file(state, 'filename')
+
+        state.assert_has_calls([
+            mock.call.start_header('filename', 'x-header',
+                                   'value:with:colons'),
+            mock.call.start_request('filename', 'get', '/uri:with#colon'),
+            mock.call.start_request('filename', 'put', '/uri?q=a:b'),
+            mock.call.extend_header('filename', 'continuation#not a comment'),
+            mock.call.finish('filename'),
+        ])
+
     @mock.patch('__builtin__.open')
     def test_parse_file_bad_sequence_header(self, mock_open):
         state = mock.Mock()
@@ -676,6 +827,76 @@ something
         self.assertRaises(request.RequestParseException, request._parse_file,
                           state, 'filename')
 
+    @mock.patch('__builtin__.open')
+    def test_iter_file(self, mock_open):
+        self.prep_data(mock_open, """
+global-header: value
+
+[seq1]
+get /one
++1.5
+get /two
+
+[seq2]
+post /three
+""")
+        state = request.RequestParseState(stream=True)
+
+        result = list(request.iter_file(state, 'filename'))
+
+        mock_open.assert_called_once_with('filename')
+        self.assertEqual(state.ready, [])
+        self.assertEqual([(seq.name, type(item).__name__)
+                          for seq, item in result], [
+            ('seq1', 'Request'),
+            ('seq1', 'Gap'),
+            ('seq1', 'Request'),
+            ('seq2', 'Request'),
+        ])
+        self.assertEqual(result[0][1].uri, '/one')
+        self.assertEqual(result[0][1].headers, {'GLOBAL_HEADER': 'value'})
+        self.assertEqual(result[1][1].delta, 1.5)
+        self.assertEqual(result[2][1].uri, '/two')
+        self.assertEqual(result[3][1].method, 'POST')
+        self.assertEqual(state._sequences['seq1'].requests, [])
+        self.assertEqual(state._sequences['seq2'].requests, [])
+
+
+class TestIterFiles(unittest2.TestCase):
+    @mock.patch.object(request, 'RequestParseState')
+    @mock.patch.object(request, 'iter_file', side_effect=lambda s, f: [
+        (f, 1), (f, 2)])
+    def test_iter_files(self, mock_iter_file, mock_RequestParseState):
+        result = request.iter_files(['file1', 'file2'])
+
+        self.assertFalse(mock_RequestParseState.called)
+        self.assertEqual(list(result), [
+            ('file1', 1), ('file1', 2), ('file2', 1), ('file2', 2),
+        ])
+        mock_RequestParseState.assert_called_once_with(stream=True)
+        mock_iter_file.assert_has_calls([
+            mock.call(mock_RequestParseState.return_value, 'file1'),
+            mock.call(mock_RequestParseState.return_value, 'file2'),
+        ])
+
+
+class TestIndexSequences(unittest2.TestCase):
+    def test_index_sequences(self):
+        seq1 = request.Sequence('seq1', {})
+        seq1.push(request.Request(seq1, 'get', '/1'))
+        seq1.push(request.Gap(1.0))
+        seq1.push(request.Request(seq1, 'get', '/2'))
+        seq2 = request.Sequence('seq2', {})
+        seq2.push(request.Request(seq2, 'get', '/3'))
+
+        result = request.index_sequences([seq1, seq2])
+
+        self.assertEqual(result, [seq1.requests, seq2.requests])
+        self.assertEqual(seq1.requests[0].key, (0, 0))
+        self.assertEqual(seq1.requests[2].key, (0, 2))
+        self.assertEqual(seq2.requests[0].key, (1, 0))
+        self.assertEqual(result[0][2].uri, '/2')
+
 
 class TestParseFiles(unittest2.TestCase):
     @mock.patch.object(request, 'RequestParseState',
@@ -691,3 +912,187 @@ class TestParseFiles(unittest2.TestCase):
             mock.call(mock_RequestParseState.return_value, 'file2'),
             mock.call(mock_RequestParseState.return_value, 'file3'),
         ])
+
+    @mock.patch.object(request, 'RequestParseState')
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch.object(request, '_parse_cached', side_effect=[
+        [('seq1', [('GET', '/1', {})]), ('seq2', [1.0])],
+        [('seq1', [('PUT', '/2', {'X_A': 'a'})])],
+    ])
+    def test_parse_files_cached(self, mock_parse_cached, mock_parse_file,
+                                mock_RequestParseState):
+        result = request.parse_files(['file1', 'file2'], 'cache', True)
+
+        self.assertFalse(mock_RequestParseState.called)
+        self.assertFalse(mock_parse_file.called)
+        mock_parse_cached.assert_has_calls([
+            mock.call('file1', 'cache', True),
+            mock.call('file2', 'cache', True),
+        ])
+        seqs = dict((seq.name, seq) for seq in result)
+        self.assertEqual(len(result), 2)
+        self.assertEqual([req.uri for req in seqs['seq1'].requests],
+                         ['/1', '/2'])
+        self.assertEqual(seqs['seq1'].requests[1].headers, {'X_A': 'a'})
+        self.assertEqual(seqs['seq2'].requests[0].delta, 1.0)
+
+    @mock.patch.object(request, 'RequestParseState')
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch.object(request, '_parse_cached')
+    @mock.patch('multiprocessing.Pool')
+    def test_parse_files_jobs(self, mock_Pool, mock_parse_cached,
+                              mock_parse_file, mock_RequestParseState):
+        pool = mock_Pool.return_value
+        pool.map.return_value = [
+            [('seq1', [('GET', '/1', {})]), ('seq2', [1.0])],
+            [('seq1', [('PUT', '/2', {'X_A': 'a'})])],
+        ]
+
+        result = request.parse_files(['file1', 'file2'], jobs=4)
+
+        mock_Pool.assert_called_once_with(2)
+        pool.assert_has_calls([
+            mock.call.map(request._parse_task, [
+                ('file1', None, False),
+                ('file2', None, False),
+            ]),
+            mock.call.terminate(),
+            mock.call.join(),
+        ])
+        self.assertFalse(mock_RequestParseState.called)
+        self.assertFalse(mock_parse_file.called)
+        self.assertFalse(mock_parse_cached.called)
+        seqs = dict((seq.name, seq) for seq in result)
+        self.assertEqual(len(result), 2)
+        self.assertEqual([req.uri for req in seqs['seq1'].requests],
+                         ['/1', '/2'])
+        self.assertEqual(seqs['seq1'].requests[1].headers, {'X_A': 'a'})
+        self.assertEqual(seqs['seq2'].requests[0].delta, 1.0)
+
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch('multiprocessing.Pool')
+    def test_parse_files_jobs_failed(self, mock_Pool, mock_parse_file):
+        pool = mock_Pool.return_value
+        pool.map.side_effect = request.RequestParseException('bad line')
+
+        self.assertRaises(request.RequestParseException, request.parse_files,
+                          ['file1', 'file2', 'file3'], 'cache', True, 2)
+
+        mock_Pool.assert_called_once_with(2)
+        pool.assert_has_calls([
+            mock.call.map(request._parse_task, [
+                ('file1', 'cache', True),
+                ('file2', 'cache', True),
+                ('file3', 'cache', True),
+            ]),
+            mock.call.terminate(),
+            mock.call.join(),
+        ])
+        self.assertFalse(mock_parse_file.called)
+
+    @mock.patch.object(request, 'RequestParseState',
+                       return_value=mock.Mock(sequences='sequences'))
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch('multiprocessing.Pool')
+    def test_parse_files_jobs_one_file(self, mock_Pool, mock_parse_file,
+                                       mock_RequestParseState):
+        result = request.parse_files(['file1'], jobs=4)
+
+        self.assertEqual(result, 'sequences')
+        self.assertFalse(mock_Pool.called)
+        mock_parse_file.assert_called_once_with(
+            mock_RequestParseState.return_value, 'file1')
+
+
+class TestParseTask(unittest2.TestCase):
+    @mock.patch.object(request, '_parse_frozen', return_value='frozen')
+    @mock.patch.object(request, '_parse_cached', return_value='cached')
+    def test_uncached(self, mock_parse_cached, mock_parse_frozen):
+        result = request._parse_task(('file1', None, False))
+
+        self.assertEqual(result, 'frozen')
+        mock_parse_frozen.assert_called_once_with('file1')
+        self.assertFalse(mock_parse_cached.called)
+
+    @mock.patch.object(request, '_parse_frozen', return_value='frozen')
+    @mock.patch.object(request, '_parse_cached', return_value='cached')
+    def test_cached(self, mock_parse_cached, mock_parse_frozen):
+        result = request._parse_task(('file1', 'cache', True))
+
+        self.assertEqual(result, 'cached')
+        mock_parse_cached.assert_called_once_with('file1', 'cache', True)
+        self.assertFalse(mock_parse_frozen.called)
+
+
+class TestFreezeSequences(unittest2.TestCase):
+    def test_freeze_thaw(self):
+        seq = request.Sequence('seq', {})
+        req = request.Request(seq, 'get', '/1?a=b')
+        req.headers['X_A'] = 'a'
+        req.fix()
+        seq.push(req)
+        seq.push(request.Gap(1.5))
+
+        data = request.freeze_sequences([seq])
+
+        self.assertEqual(data, [('seq', [('GET', '/1?a=b', {'X_A': 'a'}),
+                                         1.5])])
+
+        sequences = {'other': 'other_seq'}
+        request.thaw_sequences(sequences, data)
+
+        self.assertEqual(sorted(sequences.keys()), ['other', 'seq'])
+        requests = sequences['seq'].requests
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[0].method, 'GET')
+        self.assertEqual(requests[0].headers, {'X_A': 'a'})
+        self.assertEqual(requests[0].template, req.template)
+        self.assertEqual(requests[1].delta, 1.5)
+
+
+class TestParseCached(unittest2.TestCase):
+    @mock.patch('train.reqcache.stamp', return_value='stamp')
+    @mock.patch('train.reqcache.load', return_value='cached')
+    @mock.patch('train.reqcache.save')
+    @mock.patch.object(request, '_parse_file')
+    def test_current(self, mock_parse_file, mock_save, mock_load,
+                     mock_stamp):
+        result = request._parse_cached('file', 'cache')
+
+        self.assertEqual(result, 'cached')
+        mock_load.assert_called_once_with('cache', 'file', 'stamp')
+        self.assertFalse(mock_parse_file.called)
+        self.assertFalse(mock_save.called)
+
+    @mock.patch('train.reqcache.stamp', return_value='stamp')
+    @mock.patch('train.reqcache.load', return_value=None)
+    @mock.patch('train.reqcache.save')
+    @mock.patch.object(request, 'RequestParseState',
+                       return_value=mock.Mock(sequences=['seq']))
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch.object(request, 'freeze_sequences', return_value='frozen')
+    def test_stale(self, mock_freeze_sequences, mock_parse_file,
+                   mock_RequestParseState, mock_save, mock_load, mock_stamp):
+        result = request._parse_cached('file', 'cache')
+
+        self.assertEqual(result, 'frozen')
+        mock_parse_file.assert_called_once_with(
+            mock_RequestParseState.return_value, 'file')
+        mock_freeze_sequences.assert_called_once_with(['seq'])
+        mock_save.assert_called_once_with('cache', 'file', 'stamp', 'frozen')
+
+    @mock.patch('train.reqcache.stamp', return_value='stamp')
+    @mock.patch('train.reqcache.load', return_value='cached')
+    @mock.patch('train.reqcache.save')
+    @mock.patch.object(request, 'RequestParseState',
+                       return_value=mock.Mock(sequences=['seq']))
+    @mock.patch.object(request, '_parse_file')
+    @mock.patch.object(request, 'freeze_sequences', return_value='frozen')
+    def test_rebuild(self, mock_freeze_sequences, mock_parse_file,
+                     mock_RequestParseState, mock_save, mock_load,
+                     mock_stamp):
+        result = request._parse_cached('file', 'cache', True)
+
+        self.assertEqual(result, 'frozen')
+        self.assertFalse(mock_load.called)
+        mock_save.assert_called_once_with('cache', 'file', 'stamp', 'frozen')
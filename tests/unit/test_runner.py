@@ -14,14 +14,37 @@
 #    under the License.
 
 import ConfigParser
+import json
+import multiprocessing
+import os
+import Queue
+import shutil
 import signal
 import StringIO
 import sys
+import tempfile
 
 import mock
 import unittest2
 
 from train import runner
+from train import stats
+
+
+def make_results(feeders, workers):
+    # The feeders report their schedule lag, and the workers their
+    # reports, on the same queue
+    return mock.Mock(**{'get.side_effect': (
+        [stats.ScheduleLag() for i in range(feeders)] +
+        [stats.Report() for i in range(workers)])})
+
+
+def make_lag(*times):
+    # A feeder which placed requests onto the queue at the given times
+    lag = stats.ScheduleLag()
+    for when in times:
+        lag.record(0.0, when)
+    return lag
 
 
 class TestTrain(unittest2.TestCase):
@@ -142,7 +165,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.side_effect': [False, True]})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -159,17 +183,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 5)
+        self.assertEqual(len(conf.method_calls), 6)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -209,7 +235,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -225,17 +252,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.read(['train.cfg']),
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 4)
+        self.assertEqual(len(conf.method_calls), 5)
         mock_fileConfig.assert_called_once_with('log.cfg')
         self.assertFalse(mock_basicConfig.called)
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -275,7 +304,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -292,17 +322,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 5)
+        self.assertEqual(len(conf.method_calls), 6)
         mock_fileConfig.assert_called_once_with('log.cfg')
         self.assertFalse(mock_basicConfig.called)
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -340,7 +372,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -356,17 +389,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.read(['train.cfg']),
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 4)
+        self.assertEqual(len(conf.method_calls), 5)
         mock_fileConfig.assert_called_once_with('log.cfg')
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -405,7 +440,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -422,17 +458,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 5)
+        self.assertEqual(len(conf.method_calls), 6)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 23)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 23, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -469,7 +507,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -487,17 +526,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'workers'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 6)
+        self.assertEqual(len(conf.method_calls), 7)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -537,7 +578,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -555,17 +597,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'workers'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 6)
+        self.assertEqual(len(conf.method_calls), 7)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 23)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 23, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -605,7 +649,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -623,17 +668,19 @@ class TestTrain(unittest2.TestCase):
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'workers'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 6)
+        self.assertEqual(len(conf.method_calls), 7)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(requests)
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -673,7 +720,8 @@ class TestTrain(unittest2.TestCase):
             mock.Mock(queue_request='qreq2'),
         ]
         queue = mock.Mock(**{'empty.return_value': True})
-        mock_Queue.return_value = queue
+        results = make_results(2, 3)
+        mock_Queue.side_effect = [queue, results]
         mock_start_workers.return_value = [1234, 2345, 3456]
         procs = [
             mock.Mock(),
@@ -690,18 +738,20 @@ class TestTrain(unittest2.TestCase):
             mock.call.has_section('turnstile'),
             mock.call.get('train', 'log_config'),
             mock.call.get('train', 'requests'),
+            mock.call.items('train'),
             mock.call.items('turnstile'),
         ])
-        self.assertEqual(len(conf.method_calls), 5)
+        self.assertEqual(len(conf.method_calls), 6)
         self.assertFalse(mock_fileConfig.called)
         mock_basicConfig.assert_called_once_with()
         mock_parse_files.assert_called_once_with(
             ['req1', 'req2', 'req3', 'req4', 'req5'])
-        mock_Queue.assert_called_once_with()
-        mock_start_workers.assert_called_once_with(queue, [('a', '1')], 1)
+        mock_Queue.assert_has_calls([mock.call(), mock.call()])
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results)
         mock_Process.assert_has_calls([
-            mock.call(target='qreq1', args=(queue,)),
-            mock.call(target='qreq2', args=(queue,)),
+            mock.call(target='qreq1', args=(queue, results)),
+            mock.call(target='qreq2', args=(queue, results)),
         ])
         for proc in procs:
             proc.assert_has_calls([
@@ -716,3 +766,1410 @@ class TestTrain(unittest2.TestCase):
             mock.call(3456, signal.SIGTERM),
         ])
         self.assertEqual(sys.stderr.getvalue(), '')
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.scheduler.partition')
+    def test_heap_schedule(self, mock_partition, mock_start_workers,
+                           mock_parse_files, mock_sleep, mock_kill,
+                           mock_Queue, mock_Process, mock_fileConfig,
+                           mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(schedule='heap', feeders='3'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = 'sequences'
+        mock_partition.return_value = [
+            mock.Mock(queue_request='sched1'),
+            mock.Mock(queue_request='sched2'),
+        ]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(2, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        procs = [
+            mock.Mock(),
+            mock.Mock(),
+        ]
+        mock_Process.side_effect = procs
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_partition.assert_called_once_with('sequences', 3, None)
+        mock_Process.assert_has_calls([
+            mock.call(target='sched1', args=(queue, results)),
+            mock.call(target='sched2', args=(queue, results)),
+        ])
+        self.assertEqual(mock_Process.call_count, 2)
+        for proc in procs:
+            proc.assert_has_calls([
+                mock.call.start(),
+                mock.call.join(),
+            ])
+        mock_kill.assert_called_once_with(1234, signal.SIGTERM)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.scheduler.partition')
+    def test_heap_schedule_cmdline(self, mock_partition, mock_start_workers,
+                                   mock_parse_files, mock_sleep, mock_kill,
+                                   mock_Queue, mock_Process, mock_fileConfig,
+                                   mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(schedule='process', feeders='3'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = 'sequences'
+        mock_partition.return_value = [mock.Mock(queue_request='sched1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], schedule='heap', feeders=5)
+
+        mock_partition.assert_called_once_with('sequences', 5, None)
+        mock_Process.assert_called_once_with(target='sched1',
+                                             args=(queue, results))
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_bad_schedule(self, mock_start_workers, mock_parse_files,
+                          mock_sleep, mock_kill, mock_Queue, mock_Process,
+                          mock_fileConfig, mock_basicConfig,
+                          mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(schedule='bogus'),
+        )
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+
+        self.assertFalse(mock_parse_files.called)
+        self.assertFalse(mock_Queue.called)
+        self.assertFalse(mock_start_workers.called)
+        self.assertFalse(mock_Process.called)
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1004.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.scheduler.partition')
+    def test_heap_schedule_rate(self, mock_partition, mock_start_workers,
+                                mock_parse_files, mock_time, mock_sleep,
+                                mock_kill, mock_Queue, mock_Process,
+                                mock_fileConfig, mock_basicConfig,
+                                mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(schedule='heap', rate='1000'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = 'sequences'
+        mock_partition.return_value = [mock.Mock(queue_request='sched1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = mock.Mock(**{'get.side_effect': [
+            make_lag(100.0, 100.002, 100.004, 100.006),
+            stats.Report(),
+        ]})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_partition.assert_called_once_with('sequences', 1, 1000.0)
+        mock_Process.assert_called_once_with(target='sched1',
+                                             args=(queue, results))
+        self.assertEqual(sys.stdout.getvalue(),
+                         "Target rate 1000.0 req/s; achieved 500.0 req/s "
+                         "from first to last dispatch (50.0% short)\n"
+                         "Schedule lag: count=4 p50=0.000ms p90=0.000ms "
+                         "p99=0.000ms p99.9=0.000ms max=0.000ms\n"
+                         "Request latency: count=0\n"
+                         "Throughput: 0 requests in 4.000s (0.0 req/s)\n")
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.scheduler.SharedTokenBucket', return_value='bucket')
+    @mock.patch('train.scheduler.PacedQueue', return_value='paced')
+    def test_process_schedule_rate(self, mock_PacedQueue,
+                                   mock_SharedTokenBucket,
+                                   mock_start_workers, mock_parse_files,
+                                   mock_time, mock_sleep, mock_kill,
+                                   mock_Queue, mock_Process, mock_fileConfig,
+                                   mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        sequences = [
+            mock.Mock(queue_request='qreq1'),
+            mock.Mock(queue_request='qreq2'),
+        ]
+        mock_parse_files.return_value = sequences
+        queue = mock.Mock(**{'empty.return_value': True})
+        # The achieved rate is measured from the first dispatch to
+        # the last, across both feeders
+        results = mock.Mock(**{'get.side_effect': [
+            make_lag(100.0, 100.04),
+            make_lag(100.02, 100.06),
+            stats.Report(),
+        ]})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.side_effect = [mock.Mock(), mock.Mock()]
+
+        runner.train('train.cfg', ['req1'], rate=50.0)
+
+        mock_SharedTokenBucket.assert_called_once_with(50.0)
+        mock_PacedQueue.assert_called_once_with(queue, 'bucket')
+        mock_Process.assert_has_calls([
+            mock.call(target='qreq1', args=('paced', results)),
+            mock.call(target='qreq2', args=('paced', results)),
+        ])
+        self.assertEqual(sys.stdout.getvalue(),
+                         "Target rate 50.0 req/s; achieved 50.0 req/s "
+                         "from first to last dispatch (0.0% short)\n"
+                         "Schedule lag: count=4 p50=0.000ms p90=0.000ms "
+                         "p99=0.000ms p99.9=0.000ms max=0.000ms\n"
+                         "Request latency: count=0\n"
+                         "Throughput: 0 requests in 2.000s (0.0 req/s)\n")
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.request.index_sequences', return_value='table')
+    @mock.patch('train.wsgi.start_workers')
+    def test_indexed(self, mock_start_workers, mock_index_sequences,
+                     mock_parse_files, mock_sleep, mock_kill, mock_Queue,
+                     mock_Process, mock_fileConfig, mock_basicConfig,
+                     mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(indexed='yes'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        sequences = [mock.Mock(queue_request='qreq1')]
+        mock_parse_files.return_value = sequences
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_index_sequences.assert_called_once_with(sequences)
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results, table='table')
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.request.index_sequences', return_value='table')
+    @mock.patch('train.wsgi.start_workers')
+    def test_indexed_cmdline(self, mock_start_workers, mock_index_sequences,
+                             mock_parse_files, mock_sleep, mock_kill,
+                             mock_Queue, mock_Process, mock_fileConfig,
+                             mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(indexed='no'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        sequences = [mock.Mock(queue_request='qreq1')]
+        mock_parse_files.return_value = sequences
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], indexed=True)
+
+        mock_index_sequences.assert_called_once_with(sequences)
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results, table='table')
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.BatchingQueue', return_value='batching')
+    def test_batching(self, mock_BatchingQueue, mock_start_workers,
+                      mock_parse_files, mock_sleep, mock_kill, mock_Queue,
+                      mock_Process, mock_fileConfig, mock_basicConfig,
+                      mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(batch_size='16', batch_time='500'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_BatchingQueue.assert_called_once_with(queue, 16, 0.0005)
+        mock_Process.assert_called_once_with(target='qreq1',
+                                             args=('batching', results))
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.BatchingQueue', return_value='batching')
+    def test_batching_cmdline(self, mock_BatchingQueue, mock_start_workers,
+                              mock_parse_files, mock_sleep, mock_kill,
+                              mock_Queue, mock_Process, mock_fileConfig,
+                              mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], batch_size=8)
+
+        mock_BatchingQueue.assert_called_once_with(queue, 8, 0.001)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.request.index_sequences', return_value='table')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.RingQueue')
+    def test_ring_transport(self, mock_RingQueue, mock_start_workers,
+                            mock_index_sequences, mock_parse_files,
+                            mock_sleep, mock_kill, mock_Queue, mock_Process,
+                            mock_fileConfig, mock_basicConfig,
+                            mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(transport='ring', indexed='yes', ring_slots='64',
+                       ring_slot_size='128'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        mock_RingQueue.record_size.return_value = 21
+        ring = mock_RingQueue.return_value
+        ring.empty.return_value = True
+        results = make_results(1, 1)
+        mock_Queue.return_value = results
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_RingQueue.record_size.assert_called_once_with(
+            (2 ** 32 - 1, 2 ** 32 - 1, mock.ANY))
+        mock_RingQueue.assert_called_once_with(64, 128)
+        mock_Queue.assert_called_once_with()
+        mock_start_workers.assert_called_once_with(
+            ring, [('a', '1')], 1, results=results, table='table')
+        mock_Process.assert_called_once_with(target='qreq1',
+                                             args=(ring, results))
+        ring.put.assert_called_once_with('STOP')
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.request.index_sequences', return_value='table')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.BatchingQueue')
+    @mock.patch('train.transport.RingQueue')
+    def test_ring_transport_slot_size(self, mock_RingQueue,
+                                      mock_BatchingQueue, mock_start_workers,
+                                      mock_index_sequences, mock_parse_files,
+                                      mock_sleep, mock_kill, mock_Queue,
+                                      mock_Process, mock_fileConfig,
+                                      mock_basicConfig,
+                                      mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(transport='ring', indexed='yes', batch_size='16'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        mock_RingQueue.record_size.return_value = 600
+        ring = mock_RingQueue.return_value
+        ring.empty.return_value = True
+        mock_Queue.return_value = make_results(1, 1)
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        item = mock_RingQueue.record_size.call_args[0][0]
+        self.assertEqual(len(item), 16)
+        mock_RingQueue.assert_called_once_with(16384, 600)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.request.index_sequences', return_value='table')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.RingQueue')
+    def test_ring_transport_slot_too_small(self, mock_RingQueue,
+                                           mock_start_workers,
+                                           mock_index_sequences,
+                                           mock_parse_files, mock_Queue,
+                                           mock_fileConfig, mock_basicConfig,
+                                           mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(transport='ring', indexed='yes', batch_size='16',
+                       ring_slot_size='512'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_RingQueue.record_size.return_value = 600
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        self.assertFalse(mock_RingQueue.called)
+        self.assertFalse(mock_start_workers.called)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.transport.RingQueue')
+    def test_ring_transport_unindexed(self, mock_RingQueue, mock_parse_files,
+                                      mock_Queue, mock_fileConfig,
+                                      mock_basicConfig,
+                                      mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(transport='ring'),
+        )
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        self.assertFalse(mock_RingQueue.called)
+        self.assertFalse(mock_Queue.called)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.transport.BatchingQueue')
+    @mock.patch('train.transport.ShardedQueue')
+    def test_sharded(self, mock_ShardedQueue, mock_BatchingQueue,
+                     mock_start_workers, mock_parse_files, mock_sleep,
+                     mock_kill, mock_Queue, mock_Process, mock_fileConfig,
+                     mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(sharded='yes', workers='2', batch_size='16'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        seqs = [mock.Mock(queue_request='qreq1')]
+        mock_parse_files.return_value = seqs
+        queues = [mock.Mock(), mock.Mock()]
+        results = make_results(1, 2)
+        mock_Queue.side_effect = queues + [results]
+        sharded = mock_ShardedQueue.return_value
+        sharded.empty.return_value = True
+        mock_start_workers.return_value = [1234, 1235]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], workers=None)
+
+        mock_ShardedQueue.assert_called_once_with(queues, seqs, 16, 0.001)
+        mock_start_workers.assert_called_once_with(
+            sharded, [('a', '1')], 2, results=results)
+        self.assertFalse(mock_BatchingQueue.called)
+        mock_Process.assert_called_once_with(target='qreq1',
+                                             args=(sharded, results))
+        sharded.put.assert_has_calls([mock.call('STOP')] * 2)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('train.request.parse_files')
+    def test_bad_transport(self, mock_parse_files, mock_Queue,
+                           mock_fileConfig, mock_basicConfig,
+                           mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(transport='carrier-pigeon'),
+        )
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        self.assertFalse(mock_Queue.called)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_app(self, mock_start_workers, mock_parse_files, mock_sleep,
+                 mock_kill, mock_Queue, mock_Process, mock_fileConfig,
+                 mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(app='static', body_size='64', service_time='2.5',
+                       service_dist='exponential', body_limit='16'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results, app_mode='static',
+            body_size=64, service_time=0.0025, service_dist='exponential',
+            body_limit=16)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_app_cmdline(self, mock_start_workers, mock_parse_files,
+                         mock_sleep, mock_kill, mock_Queue, mock_Process,
+                         mock_fileConfig, mock_basicConfig,
+                         mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], app='empty', service_time=10.0)
+
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results, app_mode='empty',
+            service_time=0.01, service_dist='fixed')
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_bad_app(self, mock_start_workers, mock_parse_files,
+                     mock_fileConfig, mock_basicConfig,
+                     mock_SafeConfigParser):
+        for train_conf in (dict(app='bogus'),
+                           dict(service_time='1', service_dist='bogus')):
+            conf = self.setup_conf(turnstile=dict(a='1'), train=train_conf)
+            mock_SafeConfigParser.return_value = conf
+
+            self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        self.assertFalse(mock_start_workers.called)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('logging.getLogger')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.asynclog.install')
+    @mock.patch('train.asynclog.JSONFormatter')
+    def test_logging(self, mock_JSONFormatter, mock_install,
+                     mock_start_workers, mock_parse_files, mock_sleep,
+                     mock_kill, mock_Queue, mock_Process, mock_getLogger,
+                     mock_fileConfig, mock_basicConfig,
+                     mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(log_format='json', log_sample='0.01',
+                       log_async='on'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        handler = mock.Mock()
+        mock_getLogger.return_value.handlers = [handler]
+        log_queue = mock.Mock()
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results, log_queue]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        handler.setFormatter.assert_called_once_with(
+            mock_JSONFormatter.return_value)
+        mock_install.assert_called_once_with(log_queue)
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, results=results, log_format='json',
+            log_sample=0.01)
+        mock_install.return_value.stop.assert_called_once_with()
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.asynclog.install')
+    @mock.patch.object(runner, '_get_result',
+                       side_effect=Exception("Worker process 1234 exited "
+                                             "with status 1"))
+    def test_logging_failed(self, mock_get_result, mock_install,
+                            mock_start_workers, mock_parse_files, mock_Queue,
+                            mock_Process, mock_fileConfig, mock_basicConfig,
+                            mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(log_async='on'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        mock_install.return_value.stop.assert_called_once_with()
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_bad_log_format(self, mock_start_workers, mock_parse_files,
+                            mock_fileConfig, mock_basicConfig,
+                            mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(log_format='xml'),
+        )
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'])
+        self.assertFalse(mock_start_workers.called)
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_latency(self, mock_start_workers, mock_parse_files, mock_time,
+                     mock_sleep, mock_kill, mock_Queue, mock_Process,
+                     mock_fileConfig, mock_basicConfig,
+                     mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        reports = [stats.Report(), stats.Report()]
+        reports[0].record('seq', 'GET /', 0.001, '200')
+        reports[0].record('seq', 'GET /', 0.002, '200')
+        reports[1].record('seq', 'GET /', 0.004, '413')
+        results = mock.Mock(**{'get.side_effect': [stats.ScheduleLag()] +
+                               reports})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234, 1235]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        self.assertEqual(results.get.call_count, 3)
+        self.assertEqual(sys.stdout.getvalue(),
+                         "Schedule lag: count=0\n"
+                         "Request latency: count=3 p50=2.016ms p90=4.000ms "
+                         "p99=4.000ms p99.9=4.000ms max=4.000ms\n"
+                         "Throughput: 3 requests in 2.000s (1.5 req/s)\n")
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0] * 2)
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_report(self, mock_start_workers, mock_parse_files, mock_time,
+                    mock_sleep, mock_kill, mock_Queue, mock_Process,
+                    mock_fileConfig, mock_basicConfig,
+                    mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        json_file = os.path.join(tmpdir, 'report.json')
+        csv_file = os.path.join(tmpdir, 'report.csv')
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(report=json_file),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        for report in (None, csv_file):
+            worker_report = stats.Report()
+            worker_report.record('seq', 'GET /', 0.001, '200')
+            queue = mock.Mock(**{'empty.return_value': True})
+            results = mock.Mock(**{'get.side_effect': [
+                stats.ScheduleLag(), worker_report,
+            ]})
+            mock_Queue.side_effect = [queue, results]
+
+            runner.train('train.cfg', ['req1'], report=report)
+
+        with open(json_file) as f:
+            result = json.load(f)
+        self.assertEqual(result['elapsed'], 2.0)
+        self.assertEqual(result['total']['count'], 1)
+        self.assertEqual(result['sequences'].keys(), ['seq'])
+        with open(csv_file) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('total,,1,0.5,'))
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_report_uris(self, mock_start_workers, mock_parse_files,
+                         mock_time, mock_sleep, mock_kill, mock_Queue,
+                         mock_Process, mock_fileConfig, mock_basicConfig,
+                         mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        json_file = os.path.join(tmpdir, 'report.json')
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(report=json_file, report_uris='2'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        worker_report = stats.Report(0)
+        for uri in ('GET /a', 'GET /b', 'GET /c'):
+            worker_report.record('seq', uri, 0.001, '200')
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = mock.Mock(**{'get.side_effect': [
+            stats.ScheduleLag(), worker_report,
+        ]})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, report_uris=2, results=results)
+
+        # The cap also applies when the workers' reports are merged
+        with open(json_file) as f:
+            result = json.load(f)
+        self.assertEqual(sorted(result['uris']),
+                         ['(other)', 'GET /a', 'GET /b'])
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.progress.Ticker')
+    @mock.patch('train.progress.Progress', return_value='progress')
+    def test_progress(self, mock_Progress, mock_Ticker, mock_start_workers,
+                      mock_parse_files, mock_time, mock_sleep, mock_kill,
+                      mock_Queue, mock_Process, mock_fileConfig,
+                      mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(progress='on'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 2)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234, 1235]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], 2)
+
+        mock_Progress.assert_called_once_with(2)
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 2, progress='progress', results=results)
+        mock_Ticker.assert_called_once_with('progress', queue)
+        mock_Ticker.return_value.assert_has_calls([
+            mock.call.start(),
+            mock.call.stop(),
+        ])
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_summary(self, mock_start_workers, mock_parse_files, mock_time,
+                     mock_sleep, mock_kill, mock_Queue, mock_Process,
+                     mock_fileConfig, mock_basicConfig,
+                     mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        worker_report = stats.Report()
+        worker_report.record('seq', 'GET /', 0.001, '200')
+        worker_report.outcomes.record('seq')
+        worker_report.record('seq', 'GET /', 0.001, '413')
+        worker_report.outcomes.record('seq', 'GET / (1/second)', 1.0)
+        worker_report.record_phase('app', 0.002)
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = mock.Mock(**{'get.side_effect': [
+            stats.ScheduleLag(), worker_report,
+        ]})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(lines[2], "  Time in app: count=1 p50=2.000ms "
+                         "p90=2.000ms p99=2.000ms p99.9=2.000ms max=2.000ms")
+        self.assertEqual(lines[4:], [
+            "Rate limiting: 1 passed, 1 limited (50.0%)",
+            "Retry-After: count=1 mean=1.0s p50=1.0s p99=1.0s max=1.0s",
+            "  Limited by GET / (1/second): 1",
+            "  Sequence seq: 1 passed, 1 limited",
+        ])
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.profiling.merge')
+    def test_profile(self, mock_merge, mock_start_workers, mock_parse_files,
+                     mock_time, mock_sleep, mock_waitpid, mock_kill,
+                     mock_Queue, mock_Process, mock_fileConfig,
+                     mock_basicConfig, mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        profile = os.path.join(tmpdir, 'prof')
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(profile_sort='time'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 2)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234, 1235]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'], 2, profile=profile)
+
+        self.assertTrue(os.path.isdir(profile))
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 2, profile_dir=profile, results=results)
+        mock_waitpid.assert_has_calls([
+            mock.call(1234, 0),
+            mock.call(1235, 0),
+        ])
+        mock_merge.assert_called_once_with(
+            [os.path.join(profile, 'worker-0.pstats'),
+             os.path.join(profile, 'worker-1.pstats')],
+            mock.ANY, 'time', 40, os.path.join(profile, 'merged.pstats'))
+        self.assertTrue(os.path.exists(os.path.join(profile, 'report.txt')))
+        self.assertFalse(mock_kill.called)
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.profiling.merge_collapsed')
+    def test_profile_sample(self, mock_merge_collapsed, mock_start_workers,
+                            mock_parse_files, mock_time, mock_sleep,
+                            mock_waitpid, mock_kill, mock_Queue,
+                            mock_Process, mock_fileConfig, mock_basicConfig,
+                            mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(profile=tmpdir, sample_rate='250'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, profile_dir=tmpdir, sample_rate=250.0,
+            results=results)
+        mock_waitpid.assert_called_once_with(1234, 0)
+        mock_merge_collapsed.assert_called_once_with(
+            [os.path.join(tmpdir, 'worker-0.collapsed')],
+            os.path.join(tmpdir, 'merged.collapsed'))
+        self.assertFalse(mock_kill.called)
+
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('train.request.parse_files')
+    def test_sample_no_profile(self, mock_parse_files, mock_basicConfig,
+                               mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'],
+                          sample=100.0)
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_redis_stats(self, mock_start_workers, mock_parse_files,
+                         mock_time, mock_sleep, mock_kill, mock_Queue,
+                         mock_Process, mock_fileConfig, mock_basicConfig,
+                         mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(redis_stats='yes'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        worker_report = stats.Report()
+        worker_report.record('seq', 'GET /', 0.001, '200')
+        worker_report.commands.record('GET', 0.001)
+        worker_report.commands.finish_request()
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = mock.Mock(**{'get.side_effect': [
+            stats.ScheduleLag(), worker_report,
+        ]})
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        mock_start_workers.assert_called_once_with(
+            queue, [('a', '1')], 1, redis_stats=True, results=results)
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(lines[3], "Redis: 1.00 commands and 1.00 round "
+                         "trips per request (1 requests)")
+        self.assertTrue(lines[4].startswith("  GET: count=1 "))
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[1000.0, 1002.0])
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_parse_cache(self, mock_start_workers, mock_parse_files,
+                         mock_time, mock_sleep, mock_kill, mock_Queue,
+                         mock_Process, mock_fileConfig, mock_basicConfig,
+                         mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cache_dir = os.path.join(tmpdir, 'cache')
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(parse_cache=cache_dir),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        mock_Queue.side_effect = [queue, make_results(1, 1)]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1'])
+
+        self.assertTrue(os.path.isdir(cache_dir))
+        mock_parse_files.assert_called_once_with(['req1'],
+                                                 cache_dir=cache_dir)
+
+    @mock.patch.object(sys, 'stdout', StringIO.StringIO())
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_rebuild_cache(self, mock_start_workers, mock_parse_files,
+                           mock_Queue, mock_Process, mock_fileConfig,
+                           mock_basicConfig, mock_SafeConfigParser):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+
+        runner.train('train.cfg', ['req1'], parse_cache=tmpdir,
+                     rebuild_cache=True)
+
+        mock_parse_files.assert_called_once_with(['req1'], cache_dir=tmpdir,
+                                                 rebuild=True)
+        self.assertEqual(sys.stdout.getvalue(),
+                         "Rebuilt the parse cache for 1 request files in "
+                         "%s\n" % tmpdir)
+        self.assertFalse(mock_Queue.called)
+        self.assertFalse(mock_start_workers.called)
+        self.assertFalse(mock_Process.called)
+
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('train.request.parse_files')
+    def test_rebuild_cache_no_cache(self, mock_parse_files, mock_basicConfig,
+                                    mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'],
+                          rebuild_cache=True)
+        self.assertFalse(mock_parse_files.called)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_parse_jobs(self, mock_start_workers, mock_parse_files,
+                        mock_sleep, mock_kill, mock_Queue, mock_Process,
+                        mock_fileConfig, mock_basicConfig,
+                        mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(parse_jobs='4'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        mock_Queue.side_effect = [queue, make_results(1, 1)]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1', 'req2'])
+
+        mock_parse_files.assert_called_once_with(['req1', 'req2'], jobs=4)
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    def test_parse_jobs_cmdline(self, mock_start_workers, mock_parse_files,
+                                mock_sleep, mock_kill, mock_Queue,
+                                mock_Process, mock_fileConfig,
+                                mock_basicConfig, mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(parse_jobs='4'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        mock_parse_files.return_value = [mock.Mock(queue_request='qreq1')]
+        queue = mock.Mock(**{'empty.return_value': True})
+        mock_Queue.side_effect = [queue, make_results(1, 1)]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1', 'req2'], parse_jobs=1)
+
+        mock_parse_files.assert_called_once_with(['req1', 'req2'])
+
+    @mock.patch.object(sys, 'stderr', StringIO.StringIO())
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('logging.config.fileConfig')
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    @mock.patch('os.kill')
+    @mock.patch('time.sleep')
+    @mock.patch('train.request.parse_files')
+    @mock.patch('train.wsgi.start_workers')
+    @mock.patch('train.scheduler.StreamScheduler',
+                return_value=mock.Mock(queue_request='stream'))
+    def test_stream(self, mock_StreamScheduler, mock_start_workers,
+                    mock_parse_files, mock_sleep, mock_kill, mock_Queue,
+                    mock_Process, mock_fileConfig, mock_basicConfig,
+                    mock_SafeConfigParser):
+        conf = self.setup_conf(
+            turnstile=dict(a='1'),
+            train=dict(stream='true', stream_lookahead='50', feeders='3'),
+        )
+        mock_SafeConfigParser.return_value = conf
+        queue = mock.Mock(**{'empty.return_value': True})
+        results = make_results(1, 1)
+        mock_Queue.side_effect = [queue, results]
+        mock_start_workers.return_value = [1234]
+        mock_Process.return_value = mock.Mock()
+
+        runner.train('train.cfg', ['req1', 'req2'])
+
+        self.assertFalse(mock_parse_files.called)
+        mock_StreamScheduler.assert_called_once_with(['req1', 'req2'],
+                                                     None, 50)
+        mock_Process.assert_called_once_with(target='stream',
+                                             args=(queue, results))
+
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('train.request.parse_files')
+    def test_stream_indexed(self, mock_parse_files, mock_basicConfig,
+                            mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'],
+                          stream=True, indexed=True)
+        self.assertFalse(mock_parse_files.called)
+
+    @mock.patch.object(ConfigParser, 'SafeConfigParser')
+    @mock.patch('logging.basicConfig')
+    @mock.patch('train.request.parse_files')
+    def test_stream_sharded(self, mock_parse_files, mock_basicConfig,
+                            mock_SafeConfigParser):
+        conf = self.setup_conf(turnstile=dict(a='1'))
+        mock_SafeConfigParser.return_value = conf
+
+        self.assertRaises(Exception, runner.train, 'train.cfg', ['req1'],
+                          stream=True, sharded=True)
+        self.assertFalse(mock_parse_files.called)
+
+
+class TestToBool(unittest2.TestCase):
+    def test_true(self):
+        for value in ('true', 'Yes', 'ON', '1'):
+            self.assertEqual(runner._to_bool(value), True)
+
+    def test_false(self):
+        for value in ('false', 'No', 'OFF', '0'):
+            self.assertEqual(runner._to_bool(value), False)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, runner._to_bool, 'maybe')
+
+
+class TestGetOption(unittest2.TestCase):
+    def test_missing(self):
+        result = runner._get_option({}, 'opt', 'default', int)
+
+        self.assertEqual(result, 'default')
+
+    def test_bad_value(self):
+        result = runner._get_option(dict(opt='bad'), 'opt', 'default', int)
+
+        self.assertEqual(result, 'default')
+
+    def test_converted(self):
+        result = runner._get_option(dict(opt='23'), 'opt', 'default', int)
+
+        self.assertEqual(result, 23)
+
+
+class TestLargestRingItem(unittest2.TestCase):
+    def test_single(self):
+        result = runner._largest_ring_item(1, False)
+
+        self.assertEqual(result[:2], (2 ** 32 - 1, 2 ** 32 - 1))
+        self.assertTrue(isinstance(result[2], float))
+
+    def test_sharded(self):
+        result = runner._largest_ring_item(1, True)
+
+        self.assertEqual(result[0], 2 ** 32 - 1)
+        self.assertEqual(len(result[1]), 3)
+
+    def test_batch(self):
+        result = runner._largest_ring_item(4, True)
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(len(set(key[:2] for _seq, key in result)), 4)
+
+
+class TestGetResult(unittest2.TestCase):
+    def test_result(self):
+        results = mock.Mock(**{'get.return_value': 'result'})
+
+        result = runner._get_result(results, [], [1234], set())
+
+        self.assertEqual(result, 'result')
+        results.get.assert_called_once_with(timeout=1.0)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid', return_value=(0, 0))
+    def test_waiting(self, mock_waitpid, mock_kill):
+        results = mock.Mock(**{'get.side_effect': [Queue.Empty(),
+                                                   'result']})
+        procs = [mock.Mock(exitcode=None)]
+        exited = set()
+
+        result = runner._get_result(results, procs, [1234], exited)
+
+        self.assertEqual(result, 'result')
+        mock_waitpid.assert_called_once_with(1234, os.WNOHANG)
+        self.assertEqual(exited, set())
+        self.assertFalse(mock_kill.called)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid', return_value=(1234, 0))
+    def test_worker_exited(self, mock_waitpid, mock_kill):
+        results = mock.Mock(**{'get.side_effect': [Queue.Empty(),
+                                                   Queue.Empty(),
+                                                   'result']})
+        exited = set()
+
+        result = runner._get_result(results, [], [1234], exited)
+
+        self.assertEqual(result, 'result')
+        mock_waitpid.assert_called_once_with(1234, os.WNOHANG)
+        self.assertEqual(exited, set([1234]))
+        self.assertFalse(mock_kill.called)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid', return_value=(0, 0))
+    def test_feeder_failed(self, mock_waitpid, mock_kill):
+        results = mock.Mock(**{'get.side_effect': Queue.Empty()})
+        procs = [
+            mock.Mock(exitcode=1, pid=4321,
+                      **{'is_alive.return_value': False}),
+            mock.Mock(exitcode=None, **{'is_alive.return_value': True}),
+        ]
+
+        self.assertRaises(Exception, runner._get_result, results, procs,
+                          [1234], set())
+        self.assertFalse(procs[0].terminate.called)
+        procs[1].terminate.assert_called_once_with()
+        mock_kill.assert_called_once_with(1234, signal.SIGTERM)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid', return_value=(1234, signal.SIGKILL))
+    def test_worker_killed(self, mock_waitpid, mock_kill):
+        results = mock.Mock(**{'get.side_effect': Queue.Empty()})
+        exited = set()
+
+        self.assertRaises(Exception, runner._get_result, results, [],
+                          [1234, 1235], exited)
+        self.assertEqual(exited, set([1234]))
+        mock_kill.assert_called_once_with(1235, signal.SIGTERM)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.waitpid', return_value=(1234, 3 << 8))
+    def test_worker_failed(self, mock_waitpid, mock_kill):
+        results = mock.Mock(**{'get.side_effect': Queue.Empty()})
+        exited = set()
+
+        self.assertRaises(Exception, runner._get_result, results, [],
+                          [1234], exited)
+        self.assertEqual(exited, set([1234]))
+        self.assertFalse(mock_kill.called)
+
+    def test_worker_died(self):
+        results = multiprocessing.Queue()
+        pid = os.fork()
+        if not pid:
+            os._exit(3)
+        exited = set()
+
+        with self.assertRaises(Exception) as cm:
+            runner._get_result(results, [], [pid], exited, 0.01)
+
+        self.assertEqual(str(cm.exception),
+                         "Worker process %d exited with status 3" % pid)
+        self.assertEqual(exited, set([pid]))
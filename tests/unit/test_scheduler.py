@@ -0,0 +1,512 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest2
+
+from train import request
+from train import scheduler
+from train import stats
+
+
+class FakeClock(object):
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delta):
+        self.now += delta
+
+
+class FakeQueue(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.log = []
+
+    def put(self, item):
+        self.log.append((self.clock.now, item))
+
+
+class FakeRequest(object):
+    def __init__(self, name):
+        self.name = name
+
+    def queue_request(self, queue):
+        queue.put(self.name)
+
+
+class TestTokenBucket(unittest2.TestCase):
+    def test_init(self):
+        bucket = scheduler.TokenBucket(5000)
+
+        self.assertEqual(bucket.rate, 5000.0)
+        self.assertEqual(bucket.burst, 50.0)
+        self.assertEqual(bucket.tokens, 1.0)
+        self.assertEqual(bucket.last, None)
+
+    def test_init_slow(self):
+        bucket = scheduler.TokenBucket(10)
+
+        self.assertEqual(bucket.burst, 1.0)
+
+    def test_init_burst(self):
+        bucket = scheduler.TokenBucket(10, 5.0)
+
+        self.assertEqual(bucket.burst, 5.0)
+
+    def test_consume(self):
+        clock = FakeClock()
+        bucket = scheduler.TokenBucket(10)
+        times = []
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                for i in range(4):
+                    bucket.consume()
+                    times.append(clock.now)
+
+        for actual, expected in zip(times, [1000.0, 1000.1, 1000.2, 1000.3]):
+            self.assertAlmostEqual(actual, expected)
+
+    def test_consume_refill(self):
+        clock = FakeClock()
+        bucket = scheduler.TokenBucket(10, 2.0)
+        times = []
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                bucket.consume()
+                clock.now += 1.0
+                for i in range(3):
+                    bucket.consume()
+                    times.append(clock.now)
+
+        for actual, expected in zip(times, [1001.0, 1001.0, 1001.1]):
+            self.assertAlmostEqual(actual, expected)
+
+    def test_consume_before_sleep(self):
+        clock = FakeClock()
+        bucket = scheduler.TokenBucket(10)
+        before_sleep = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                bucket.consume(before_sleep)
+                self.assertFalse(before_sleep.called)
+                bucket.consume(before_sleep)
+
+        before_sleep.assert_called_once_with()
+
+
+class TestSharedTokenBucket(unittest2.TestCase):
+    def test_init(self):
+        clock = FakeClock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            bucket = scheduler.SharedTokenBucket(5000)
+
+        self.assertEqual(bucket.rate, 5000.0)
+        self.assertEqual(bucket.burst, 50.0)
+        self.assertEqual(bucket._tokens.value, 1.0)
+        self.assertEqual(bucket._last.value, 1000.0)
+
+    def test_init_burst(self):
+        bucket = scheduler.SharedTokenBucket(10, 5.0)
+
+        self.assertEqual(bucket.burst, 5.0)
+
+    def test_consume(self):
+        clock = FakeClock()
+        times = []
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                bucket = scheduler.SharedTokenBucket(10)
+                for i in range(4):
+                    bucket.consume()
+                    times.append(clock.now)
+
+        for actual, expected in zip(times, [1000.0, 1000.1, 1000.2, 1000.3]):
+            self.assertAlmostEqual(actual, expected)
+
+    @mock.patch('time.sleep')
+    def test_consume_reserves(self, mock_sleep):
+        clock = FakeClock()
+        before_sleep = mock.Mock()
+
+        # Without advancing the clock, each consumer reserves the
+        # next token and waits its turn
+        with mock.patch('train.util.monotonic', clock.time):
+            bucket = scheduler.SharedTokenBucket(10)
+            for i in range(3):
+                bucket.consume(before_sleep)
+
+        self.assertEqual(before_sleep.call_count, 2)
+        self.assertEqual(len(mock_sleep.call_args_list), 2)
+        self.assertAlmostEqual(mock_sleep.call_args_list[0][0][0], 0.1)
+        self.assertAlmostEqual(mock_sleep.call_args_list[1][0][0], 0.2)
+        self.assertAlmostEqual(bucket._tokens.value, -2.0)
+
+    def test_consume_refill(self):
+        clock = FakeClock()
+        times = []
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                bucket = scheduler.SharedTokenBucket(10, 2.0)
+                bucket.consume()
+                clock.now += 1.0
+                for i in range(3):
+                    bucket.consume()
+                    times.append(clock.now)
+
+        for actual, expected in zip(times, [1001.0, 1001.0, 1001.1]):
+            self.assertAlmostEqual(actual, expected)
+
+
+class TestPacedQueue(unittest2.TestCase):
+    def test_put(self):
+        queue = mock.Mock()
+        bucket = mock.Mock()
+        paced = scheduler.PacedQueue(queue, bucket)
+
+        paced.put('item')
+
+        bucket.consume.assert_called_once_with(paced.flush)
+        queue.put.assert_called_once_with('item')
+
+    def test_flush(self):
+        queue = mock.Mock()
+        paced = scheduler.PacedQueue(queue, 'bucket')
+
+        paced.flush()
+
+        queue.flush.assert_called_once_with()
+
+    def test_shard(self):
+        queue = mock.Mock(**{'shard.return_value': 'shard'})
+        paced = scheduler.PacedQueue(queue, 'bucket')
+
+        result = paced.shard('seq')
+
+        self.assertTrue(isinstance(result, scheduler.PacedQueue))
+        self.assertEqual(result.queue, 'shard')
+        self.assertEqual(result.bucket, 'bucket')
+        queue.shard.assert_called_once_with('seq')
+
+
+class TestScheduler(unittest2.TestCase):
+    def test_init(self):
+        sched = scheduler.Scheduler(['seq1', 'seq2'])
+
+        self.assertEqual(sched.sequences, ['seq1', 'seq2'])
+        self.assertEqual(sched.rate, None)
+
+    def test_queue_request(self):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seqs = [
+            mock.Mock(requests=[
+                FakeRequest('a1'),
+                request.Gap(2.0),
+                FakeRequest('a2'),
+            ]),
+            mock.Mock(requests=[
+                FakeRequest('b1'),
+                FakeRequest('b2'),
+                request.Gap(1.0),
+                FakeRequest('b3'),
+                request.Gap(5.0),
+            ]),
+            mock.Mock(requests=[]),
+        ]
+        sched = scheduler.Scheduler(seqs)
+        results = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue, results)
+
+        self.assertEqual(queue.log, [
+            (1000.0, 'a1'),
+            (1000.0, 'b1'),
+            (1000.0, 'b2'),
+            (1001.0, 'b3'),
+            (1002.0, 'a2'),
+        ])
+        self.assertEqual(clock.now, 1006.0)
+        self.assertEqual(results.put.call_count, 1)
+        lag = results.put.call_args[0][0]
+        self.assertIsInstance(lag, stats.ScheduleLag)
+        self.assertEqual(lag.count, 5)
+        self.assertEqual(lag.max, 0.0)
+        self.assertEqual(lag.first, 1000.0)
+        self.assertEqual(lag.last, 1002.0)
+
+    def test_queue_request_drift(self):
+        clock = FakeClock()
+        queue = mock.Mock(spec=['put', 'flush'], **{
+            'put.side_effect': lambda x: clock.sleep(0.1),
+        })
+        seqs = [
+            mock.Mock(requests=[
+                FakeRequest('a1'),
+                request.Gap(1.0),
+                FakeRequest('a2'),
+                request.Gap(1.0),
+                FakeRequest('a3'),
+                FakeRequest('a4'),
+            ]),
+        ]
+        sched = scheduler.Scheduler(seqs)
+        results = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue, results)
+
+        # The time taken by put() does not accumulate into the gaps, and
+        # the queue was flushed before each sleep and at the end
+        self.assertEqual(queue.flush.call_count, 3)
+        self.assertAlmostEqual(clock.now, 1002.2)
+        lag = results.put.call_args[0][0]
+        self.assertEqual(lag.count, 4)
+        self.assertAlmostEqual(lag.max, 0.1)
+
+    def test_queue_request_rate(self):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seqs = [
+            mock.Mock(requests=[
+                FakeRequest('a1'),
+                FakeRequest('a2'),
+                FakeRequest('a3'),
+            ]),
+            mock.Mock(requests=[
+                FakeRequest('b1'),
+                request.Gap(0.25),
+                FakeRequest('b2'),
+            ]),
+        ]
+        sched = scheduler.Scheduler(seqs, 10)
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue)
+
+        self.assertEqual([name for _t, name in queue.log],
+                         ['a1', 'b1', 'a2', 'a3', 'b2'])
+        self.assertAlmostEqual(clock.now, 1000.4)
+
+    @mock.patch.object(scheduler, 'PacedQueue')
+    def test_queue_request_bucket(self, mock_PacedQueue):
+        queue = mock.Mock()
+        bucket = mock.Mock()
+        sched = scheduler.Scheduler([mock.Mock(requests=[])], 10, bucket)
+
+        sched.queue_request(queue)
+
+        mock_PacedQueue.assert_called_once_with(queue, bucket)
+
+
+def make_seq(name):
+    seq = mock.Mock()
+    seq.name = name
+    return seq
+
+
+class TestStreamScheduler(unittest2.TestCase):
+    def test_init(self):
+        sched = scheduler.StreamScheduler(['file1', 'file2'])
+
+        self.assertEqual(sched.fnames, ['file1', 'file2'])
+        self.assertEqual(sched.rate, None)
+        self.assertEqual(sched.lookahead, 1000)
+
+    @mock.patch.object(request, 'iter_files')
+    def test_queue_request(self, mock_iter_files):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seq_a, seq_b = make_seq('a'), make_seq('b')
+        mock_iter_files.return_value = iter([
+            (seq_a, FakeRequest('a1')),
+            (seq_b, FakeRequest('b1')),
+            (seq_a, request.Gap(2.0)),
+            (seq_b, FakeRequest('b2')),
+            (seq_b, request.Gap(1.0)),
+            (seq_a, FakeRequest('a2')),
+            (seq_b, FakeRequest('b3')),
+            (seq_b, request.Gap(5.0)),
+        ])
+        sched = scheduler.StreamScheduler(['file1'])
+        results = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue, results)
+
+        mock_iter_files.assert_called_once_with(['file1'])
+        self.assertEqual(queue.log, [
+            (1000.0, 'a1'),
+            (1000.0, 'b1'),
+            (1000.0, 'b2'),
+            (1001.0, 'b3'),
+            (1002.0, 'a2'),
+        ])
+        self.assertEqual(clock.now, 1006.0)
+        lag = results.put.call_args[0][0]
+        self.assertIsInstance(lag, stats.Histogram)
+        self.assertEqual(lag.count, 5)
+        self.assertEqual(lag.max, 0.0)
+
+    @mock.patch.object(request, 'iter_files')
+    def test_queue_request_lookahead(self, mock_iter_files):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seq_a, seq_b = make_seq('a'), make_seq('b')
+        items = [
+            (seq_a, FakeRequest('a1')),
+            (seq_a, request.Gap(2.0)),
+            (seq_a, FakeRequest('a2')),
+            (seq_a, request.Gap(1.0)),
+            (seq_a, FakeRequest('a3')),
+            (seq_b, FakeRequest('b1')),
+        ]
+        read = []
+
+        def iter_files(fnames):
+            for item in items:
+                read.append(clock.now)
+                yield item
+
+        mock_iter_files.side_effect = iter_files
+        sched = scheduler.StreamScheduler(['file1'], lookahead=2)
+        results = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue, results)
+
+        # Sequence b is not seen until a2 has been dispatched, so it
+        # is dispatched late
+        self.assertEqual(read, [1000.0, 1000.0, 1000.0, 1000.0,
+                                1002.0, 1002.0])
+        self.assertEqual(queue.log, [
+            (1000.0, 'a1'),
+            (1002.0, 'a2'),
+            (1002.0, 'b1'),
+            (1003.0, 'a3'),
+        ])
+        lag = results.put.call_args[0][0]
+        self.assertEqual(lag.count, 4)
+        self.assertAlmostEqual(lag.max, 2.0, 2)
+
+    @mock.patch.object(request, 'iter_files')
+    def test_queue_request_late_gaps(self, mock_iter_files):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seq_a, seq_b = make_seq('a'), make_seq('b')
+        mock_iter_files.return_value = iter([
+            (seq_a, FakeRequest('a1')),
+            (seq_a, request.Gap(2.0)),
+            (seq_a, FakeRequest('a2')),
+            (seq_a, request.Gap(1.0)),
+            (seq_a, FakeRequest('a3')),
+            (seq_b, FakeRequest('b1')),
+            (seq_b, request.Gap(1.0)),
+            (seq_b, FakeRequest('b2')),
+            (seq_b, request.Gap(1.0)),
+            (seq_b, FakeRequest('b3')),
+        ])
+        sched = scheduler.StreamScheduler(['file1'], lookahead=2)
+        results = mock.Mock()
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue, results)
+
+        # Sequence b is seen 2 seconds late, but its gaps are kept
+        self.assertEqual(queue.log, [
+            (1000.0, 'a1'),
+            (1002.0, 'a2'),
+            (1002.0, 'b1'),
+            (1003.0, 'a3'),
+            (1003.0, 'b2'),
+            (1004.0, 'b3'),
+        ])
+        lag = results.put.call_args[0][0]
+        self.assertEqual(lag.count, 6)
+        self.assertAlmostEqual(lag.max, 2.0, 2)
+        self.assertAlmostEqual(lag.total, 2.0, 2)
+
+    @mock.patch.object(request, 'iter_files')
+    def test_queue_request_rate(self, mock_iter_files):
+        clock = FakeClock()
+        queue = FakeQueue(clock)
+        seq_a, seq_b = make_seq('a'), make_seq('b')
+        mock_iter_files.return_value = iter([
+            (seq_a, FakeRequest('a1')),
+            (seq_a, FakeRequest('a2')),
+            (seq_b, FakeRequest('b1')),
+            (seq_b, FakeRequest('b2')),
+        ])
+        sched = scheduler.StreamScheduler(['file1'], rate=10)
+
+        with mock.patch('train.util.monotonic', clock.time):
+            with mock.patch('time.sleep', clock.sleep):
+                sched.queue_request(queue)
+
+        self.assertEqual([item for _t, item in queue.log],
+                         ['a1', 'b1', 'a2', 'b2'])
+        for (actual, _item), expected in zip(queue.log, [
+                1000.0, 1000.1, 1000.2, 1000.3]):
+            self.assertAlmostEqual(actual, expected)
+
+
+class TestPartition(unittest2.TestCase):
+    def test_partition(self):
+        result = scheduler.partition(range(7), 3)
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0].sequences, [0, 3, 6])
+        self.assertEqual(result[1].sequences, [1, 4])
+        self.assertEqual(result[2].sequences, [2, 5])
+        for sched in result:
+            self.assertEqual(sched.rate, None)
+
+    def test_partition_rate(self):
+        result = scheduler.partition(range(7), 4, 1000)
+
+        self.assertEqual(len(result), 4)
+        self.assertTrue(isinstance(result[0].bucket,
+                                   scheduler.SharedTokenBucket))
+        self.assertEqual(result[0].bucket.rate, 1000.0)
+        for sched in result:
+            self.assertEqual(sched.rate, 1000)
+            self.assertTrue(sched.bucket is result[0].bucket)
+
+    def test_partition_empty(self):
+        result = scheduler.partition([], 4, 1000)
+
+        self.assertEqual(result, [])
+
+    def test_partition_few_sequences(self):
+        result = scheduler.partition(range(2), 5)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0].sequences, [0])
+        self.assertEqual(result[1].sequences, [1])
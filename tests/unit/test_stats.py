@@ -0,0 +1,651 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import csv
+import json
+import pickle
+import StringIO
+
+import unittest2
+
+from train import stats
+
+
+class TestHistogram(unittest2.TestCase):
+    def test_init(self):
+        hist = stats.Histogram()
+
+        self.assertEqual(hist.precision, 5)
+        self.assertEqual(hist.buckets, {})
+        self.assertEqual(hist.count, 0)
+        self.assertEqual(hist.total, 0.0)
+        self.assertEqual(hist.min, None)
+        self.assertEqual(hist.max, None)
+
+    def test_index_value_roundtrip(self):
+        hist = stats.Histogram()
+
+        for value in range(0, 100000, 7):
+            idx = hist.bucket_index(value)
+            rep = hist.bucket_value(idx)
+
+            # The representative value is within the precision
+            self.assertLessEqual(abs(rep - value), max(1, value / 16.0))
+
+            # And it lands in the same bucket
+            self.assertEqual(hist.bucket_index(rep), idx)
+
+    def test_index_powers(self):
+        hist = stats.Histogram()
+
+        # Each power of 2 starts a new run of 16 buckets, for values
+        # of any size, including longs
+        for bits in range(5, 80):
+            self.assertEqual(hist.bucket_index(2 ** bits),
+                             ((bits - 4) << 4) + 16)
+            self.assertEqual(hist.bucket_index(2 ** bits - 1),
+                             ((bits - 4) << 4) + 15)
+
+    def test_index_monotonic(self):
+        hist = stats.Histogram()
+
+        indexes = [hist.bucket_index(value) for value in range(100000)]
+
+        self.assertEqual(indexes, sorted(indexes))
+        self.assertEqual(len(set(indexes)), max(indexes) + 1)
+
+    def test_record(self):
+        hist = stats.Histogram()
+
+        hist.record(0.001)
+        hist.record(0.003)
+        hist.record(-0.5)
+
+        self.assertEqual(hist.count, 3)
+        self.assertAlmostEqual(hist.total, 0.004)
+        self.assertEqual(hist.min, 0.0)
+        self.assertEqual(hist.max, 0.003)
+        self.assertEqual(sum(hist.buckets.values()), 3)
+
+    def test_merge(self):
+        hist1 = stats.Histogram()
+        hist1.record(0.001)
+        hist1.record(0.002)
+        hist2 = stats.Histogram()
+        hist2.record(0.002)
+        hist2.record(0.010)
+
+        result = hist1.merge(hist2)
+
+        self.assertEqual(result, hist1)
+        self.assertEqual(hist1.count, 4)
+        self.assertAlmostEqual(hist1.total, 0.015)
+        self.assertEqual(hist1.min, 0.001)
+        self.assertEqual(hist1.max, 0.010)
+        self.assertEqual(hist1.buckets[hist1.bucket_index(2000)], 2)
+
+    def test_merge_empty(self):
+        hist1 = stats.Histogram()
+        hist2 = stats.Histogram()
+        hist2.record(0.002)
+
+        hist1.merge(hist2)
+        hist1.merge(stats.Histogram())
+
+        self.assertEqual(hist1.count, 1)
+        self.assertEqual(hist1.min, 0.002)
+        self.assertEqual(hist1.max, 0.002)
+
+    def test_merge_mismatch(self):
+        hist1 = stats.Histogram()
+        hist2 = stats.Histogram(7)
+
+        self.assertRaises(ValueError, hist1.merge, hist2)
+
+    def test_percentile_empty(self):
+        hist = stats.Histogram()
+
+        self.assertEqual(hist.percentile(50), None)
+        self.assertEqual(hist.mean, None)
+
+    def test_percentile(self):
+        hist = stats.Histogram()
+        for i in range(1, 1001):
+            hist.record(i * 0.001)
+
+        self.assertAlmostEqual(hist.percentile(50), 0.5, delta=0.5 / 16)
+        self.assertAlmostEqual(hist.percentile(99), 0.99, delta=0.99 / 16)
+        self.assertEqual(hist.percentile(100), 1.0)
+        self.assertEqual(hist.percentile(0), 0.001)
+        self.assertAlmostEqual(hist.mean, 0.5005)
+
+    def test_pickle(self):
+        hist = stats.Histogram()
+        hist.record(0.25)
+
+        result = pickle.loads(pickle.dumps(hist, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(result.buckets, hist.buckets)
+        self.assertEqual(result.count, 1)
+
+    def test_summary_empty(self):
+        hist = stats.Histogram()
+
+        self.assertEqual(hist.summary(), "count=0")
+
+    def test_summary(self):
+        hist = stats.Histogram()
+        hist.record(0.002)
+
+        self.assertEqual(hist.summary((50, 99.9)),
+                         "count=1 p50=2.000ms p99.9=2.000ms max=2.000ms")
+
+
+class TestScheduleLag(unittest2.TestCase):
+    def test_init(self):
+        lag = stats.ScheduleLag()
+
+        self.assertEqual(lag.count, 0)
+        self.assertEqual(lag.first, None)
+        self.assertEqual(lag.last, None)
+        self.assertEqual(lag.span, None)
+        self.assertEqual(lag.rate, None)
+
+    def test_record(self):
+        lag = stats.ScheduleLag()
+
+        lag.record(0.002, 100.5)
+        lag.record(0.001, 100.0)
+        lag.record(0.003, 102.0)
+        lag.record(0.004)
+
+        self.assertEqual(lag.count, 4)
+        self.assertEqual(lag.max, 0.004)
+        self.assertEqual(lag.first, 100.0)
+        self.assertEqual(lag.last, 102.0)
+        self.assertEqual(lag.span, 2.0)
+
+    def test_rate(self):
+        lag = stats.ScheduleLag()
+        for i in range(5):
+            lag.record(0.0, 100.0 + i * 0.5)
+
+        # Five dispatches are four intervals
+        self.assertEqual(lag.rate, 2.0)
+
+    def test_rate_single(self):
+        lag = stats.ScheduleLag()
+        lag.record(0.0, 100.0)
+
+        self.assertEqual(lag.span, 0.0)
+        self.assertEqual(lag.rate, None)
+
+    def test_merge(self):
+        lag1 = stats.ScheduleLag()
+        lag1.record(0.001, 101.0)
+        lag1.record(0.002, 103.0)
+        lag2 = stats.ScheduleLag()
+        lag2.record(0.002, 100.0)
+        lag2.record(0.010, 102.0)
+
+        result = lag1.merge(lag2)
+
+        self.assertEqual(result, lag1)
+        self.assertEqual(lag1.count, 4)
+        self.assertEqual(lag1.max, 0.010)
+        self.assertEqual(lag1.first, 100.0)
+        self.assertEqual(lag1.last, 103.0)
+
+    def test_merge_empty(self):
+        lag1 = stats.ScheduleLag()
+        lag2 = stats.ScheduleLag()
+        lag2.record(0.002, 100.0)
+
+        lag1.merge(lag2)
+        lag1.merge(stats.ScheduleLag())
+
+        self.assertEqual(lag1.count, 1)
+        self.assertEqual(lag1.first, 100.0)
+        self.assertEqual(lag1.last, 100.0)
+
+
+class TestBreakdown(unittest2.TestCase):
+    def test_init(self):
+        bd = stats.Breakdown()
+
+        self.assertEqual(bd.count, 0)
+        self.assertEqual(bd.statuses, {})
+
+    def test_record(self):
+        bd = stats.Breakdown()
+
+        bd.record(0.002, '200')
+        bd.record(0.004, '413')
+        bd.record(0.001, '200')
+
+        self.assertEqual(bd.count, 3)
+        self.assertEqual(bd.latency.max, 0.004)
+        self.assertEqual(bd.statuses, {'200': 2, '413': 1})
+
+    def test_merge(self):
+        bd1 = stats.Breakdown()
+        bd1.record(0.002, '200')
+        bd2 = stats.Breakdown()
+        bd2.record(0.004, '200')
+        bd2.record(0.001, 'error')
+
+        result = bd1.merge(bd2)
+
+        self.assertEqual(result, bd1)
+        self.assertEqual(bd1.count, 3)
+        self.assertEqual(bd1.latency.min, 0.001)
+        self.assertEqual(bd1.statuses, {'200': 2, 'error': 1})
+
+    def test_to_dict_empty(self):
+        bd = stats.Breakdown()
+
+        self.assertEqual(bd.to_dict(0.0), {
+            'count': 0,
+            'throughput': 0.0,
+            'statuses': {},
+            'latency_ms': {},
+        })
+
+    def test_to_dict(self):
+        bd = stats.Breakdown()
+        bd.record(0.002, '200')
+        bd.record(0.004, '200')
+
+        result = bd.to_dict(4.0)
+
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['throughput'], 0.5)
+        self.assertEqual(result['statuses'], {'200': 2})
+        self.assertEqual(sorted(result['latency_ms']),
+                         ['max', 'mean', 'p50', 'p90', 'p99', 'p99.9'])
+        self.assertAlmostEqual(result['latency_ms']['mean'], 3.0)
+        self.assertAlmostEqual(result['latency_ms']['p50'], 2.0, delta=0.1)
+        self.assertAlmostEqual(result['latency_ms']['max'], 4.0)
+
+
+class TestOutcomes(unittest2.TestCase):
+    def make_outcomes(self):
+        outcomes = stats.Outcomes()
+        outcomes.record('seq1')
+        outcomes.record('seq1', 'GET /a (1/second)', 2.0)
+        outcomes.record('seq2', 'GET /a (1/second)', 4.0)
+        outcomes.record('seq2', 'unknown')
+        return outcomes
+
+    def test_init(self):
+        outcomes = stats.Outcomes()
+
+        self.assertEqual(outcomes.count, 0)
+        self.assertEqual(outcomes.sequences, {})
+        self.assertEqual(outcomes.limits, {})
+        self.assertEqual(outcomes.delays.count, 0)
+
+    def test_record(self):
+        outcomes = self.make_outcomes()
+
+        self.assertEqual(outcomes.count, 4)
+        self.assertEqual(outcomes.passed, 1)
+        self.assertEqual(outcomes.limited, 3)
+        self.assertEqual(outcomes.sequences, {
+            'seq1': dict(passed=1, limited=1),
+            'seq2': dict(passed=0, limited=2),
+        })
+        self.assertEqual(outcomes.limits, {
+            'GET /a (1/second)': 2,
+            'unknown': 1,
+        })
+        self.assertEqual(outcomes.delays.count, 2)
+        self.assertEqual(outcomes.delays.max, 4.0)
+
+    def test_merge(self):
+        outcomes1 = self.make_outcomes()
+        outcomes2 = stats.Outcomes()
+        outcomes2.record('seq2')
+        outcomes2.record('seq3', 'GET /a (1/second)', 1.0)
+
+        result = outcomes1.merge(outcomes2)
+
+        self.assertEqual(result, outcomes1)
+        self.assertEqual(outcomes1.passed, 2)
+        self.assertEqual(outcomes1.limited, 4)
+        self.assertEqual(outcomes1.sequences['seq2'],
+                         dict(passed=1, limited=2))
+        self.assertEqual(outcomes1.sequences['seq3'],
+                         dict(passed=0, limited=1))
+        self.assertEqual(outcomes1.limits['GET /a (1/second)'], 3)
+        self.assertEqual(outcomes1.delays.min, 1.0)
+
+    def test_to_dict(self):
+        result = self.make_outcomes().to_dict()
+
+        self.assertEqual(result['passed'], 1)
+        self.assertEqual(result['limited'], 3)
+        self.assertEqual(result['sequences']['seq2'],
+                         dict(passed=0, limited=2))
+        self.assertEqual(result['limits']['unknown'], 1)
+        self.assertEqual(sorted(result['delays_s']),
+                         ['max', 'mean', 'p50', 'p90', 'p99', 'p99.9'])
+        self.assertEqual(result['delays_s']['mean'], 3.0)
+
+    def test_to_dict_empty(self):
+        self.assertEqual(stats.Outcomes().to_dict(), {
+            'passed': 0,
+            'limited': 0,
+            'sequences': {},
+            'limits': {},
+            'delays_s': {},
+        })
+
+    def test_summary(self):
+        result = self.make_outcomes().summary()
+
+        self.assertEqual(result, [
+            "Rate limiting: 1 passed, 3 limited (75.0%)",
+            "Retry-After: count=2 mean=3.0s p50=2.0s p99=4.0s max=4.0s",
+            "  Limited by GET /a (1/second): 2",
+            "  Limited by unknown: 1",
+            "  Sequence seq1: 1 passed, 1 limited",
+            "  Sequence seq2: 0 passed, 2 limited",
+        ])
+
+    def test_summary_passed(self):
+        outcomes = stats.Outcomes()
+        outcomes.record('seq1')
+
+        self.assertEqual(outcomes.summary(), [
+            "Rate limiting: 1 passed, 0 limited (0.0%)",
+        ])
+
+
+class TestCommands(unittest2.TestCase):
+    def make_commands(self):
+        commands = stats.Commands()
+        commands.record('GET', 0.001)
+        commands.record('GET', 0.003)
+        commands.record_pipeline(3, 0.002)
+        commands.finish_request()
+        commands.record('LRANGE', 0.002)
+        commands.finish_request()
+        commands.finish_request()
+        return commands
+
+    def test_init(self):
+        commands = stats.Commands()
+
+        self.assertEqual(commands.requests, 0)
+        self.assertEqual(commands.commands, {})
+        self.assertEqual(commands.pipelines.count, 0)
+        self.assertEqual(commands.pipelined, 0)
+
+    def test_record(self):
+        commands = self.make_commands()
+
+        self.assertEqual(commands.requests, 3)
+        self.assertEqual(sorted(commands.commands), ['GET', 'LRANGE'])
+        self.assertEqual(commands.commands['GET'].count, 2)
+        self.assertEqual(commands.pipelines.count, 1)
+        self.assertEqual(commands.pipelined, 3)
+        self.assertEqual(commands.per_request, {5: 1, 1: 1, 0: 1})
+        self.assertEqual(commands.round_trips, {3: 1, 1: 1, 0: 1})
+
+    def test_merge(self):
+        commands1 = self.make_commands()
+        commands2 = stats.Commands()
+        commands2.record('GET', 0.002)
+        commands2.record('ZADD', 0.002)
+        commands2.finish_request()
+
+        result = commands1.merge(commands2)
+
+        self.assertEqual(result, commands1)
+        self.assertEqual(commands1.requests, 4)
+        self.assertEqual(commands1.commands['GET'].count, 3)
+        self.assertEqual(commands1.commands['ZADD'].count, 1)
+        self.assertEqual(commands1.per_request, {5: 1, 2: 1, 1: 1, 0: 1})
+        self.assertEqual(commands1.round_trips, {3: 1, 2: 1, 1: 1, 0: 1})
+
+    def test_to_dict(self):
+        result = self.make_commands().to_dict()
+
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['commands_per_request'], {
+            'mean': 2.0,
+            'counts': {5: 1, 1: 1, 0: 1},
+        })
+        self.assertEqual(result['round_trips_per_request']['mean'], 4 / 3.0)
+        self.assertEqual(result['pipelines']['count'], 1)
+        self.assertEqual(result['pipelines']['commands'], 3)
+        self.assertAlmostEqual(result['pipelines']['latency_ms']['max'], 2.0)
+        self.assertEqual(result['commands']['GET']['count'], 2)
+        self.assertAlmostEqual(result['commands']['GET']['latency_ms']['mean'],
+                               2.0)
+
+    def test_to_dict_empty(self):
+        result = stats.Commands().to_dict()
+
+        self.assertEqual(result['requests'], 0)
+        self.assertEqual(result['commands_per_request']['mean'], 0.0)
+        self.assertEqual(result['pipelines']['latency_ms'], {})
+        self.assertEqual(result['commands'], {})
+
+    def test_summary(self):
+        result = self.make_commands().summary()
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0], "Redis: 2.00 commands and 1.33 round "
+                         "trips per request (3 requests)")
+        self.assertTrue(result[1].startswith(
+            "  Pipelines: 1 carrying 3 commands; count=1 "))
+        self.assertTrue(result[2].startswith("  GET: count=2 "))
+        self.assertTrue(result[3].startswith("  LRANGE: count=1 "))
+
+
+class TestReport(unittest2.TestCase):
+    def make_report(self):
+        report = stats.Report()
+        report.record('seq1', 'GET /a', 0.002, '200')
+        report.record('seq1', 'GET /b', 0.004, '413')
+        report.record('seq2', 'GET /a', 0.001, '200')
+        return report
+
+    def test_init(self):
+        report = stats.Report()
+
+        self.assertEqual(report.total.count, 0)
+        self.assertEqual(report.sequences, {})
+        self.assertEqual(report.uris, {})
+        self.assertEqual(report.max_uris, 1000)
+
+    def test_init_max_uris(self):
+        report = stats.Report(5)
+
+        self.assertEqual(report.max_uris, 5)
+
+    def test_record(self):
+        report = self.make_report()
+
+        self.assertEqual(report.total.count, 3)
+        self.assertEqual(report.sequences['seq1'].count, 2)
+        self.assertEqual(report.sequences['seq2'].count, 1)
+        self.assertEqual(report.uris['GET /a'].count, 2)
+        self.assertEqual(report.uris['GET /b'].statuses, {'413': 1})
+
+    def test_merge(self):
+        report1 = self.make_report()
+        report2 = stats.Report()
+        report2.record('seq3', 'GET /a', 0.003, '200')
+
+        result = report1.merge(report2)
+
+        self.assertEqual(result, report1)
+        self.assertEqual(report1.total.count, 4)
+        self.assertEqual(sorted(report1.sequences),
+                         ['seq1', 'seq2', 'seq3'])
+        self.assertEqual(report1.uris['GET /a'].count, 3)
+        self.assertFalse(report2.total.count == 4)
+
+    def test_record_max_uris(self):
+        report = stats.Report(2)
+        for i in range(5):
+            report.record('seq', 'GET /item/%d' % i, 0.001, '200')
+        report.record('seq', 'GET /item/1', 0.001, '200')
+
+        self.assertEqual(sorted(report.uris),
+                         ['(other)', 'GET /item/0', 'GET /item/1'])
+        self.assertEqual(report.uris['GET /item/1'].count, 2)
+        self.assertEqual(report.uris['(other)'].count, 3)
+        self.assertEqual(report.total.count, 6)
+
+    def test_record_unlimited_uris(self):
+        report = stats.Report(0)
+        for i in range(5):
+            report.record('seq', 'GET /item/%d' % i, 0.001, '200')
+
+        self.assertEqual(len(report.uris), 5)
+        self.assertFalse('(other)' in report.uris)
+
+    def test_merge_max_uris(self):
+        report1 = stats.Report(2)
+        report1.record('seq', 'GET /a', 0.001, '200')
+        report2 = stats.Report(0)
+        for uri in ('GET /b', 'GET /c', 'GET /d', 'GET /d'):
+            report2.record('seq', uri, 0.001, '200')
+
+        report1.merge(report2)
+
+        # The busiest URI takes the last place
+        self.assertEqual(sorted(report1.uris),
+                         ['(other)', 'GET /a', 'GET /d'])
+        self.assertEqual(report1.uris['GET /d'].count, 2)
+        self.assertEqual(report1.uris['(other)'].count, 2)
+        self.assertEqual(report1.total.count, 5)
+
+    def test_merge_overflow(self):
+        report1 = stats.Report(2)
+        report2 = stats.Report(1)
+        for uri in ('GET /a', 'GET /b', 'GET /c'):
+            report2.record('seq', uri, 0.001, '200')
+
+        report1.merge(report2)
+
+        # The overflow doesn't take up one of the places
+        self.assertEqual(sorted(report1.uris), ['(other)', 'GET /a'])
+        self.assertEqual(report1.uris['(other)'].count, 2)
+        report1.record('seq', 'GET /d', 0.001, '200')
+        self.assertEqual(report1.uris['GET /d'].count, 1)
+
+    def test_record_phase(self):
+        report = stats.Report()
+
+        report.record_phase('app', 0.002)
+
+        self.assertEqual(sorted(report.phases), sorted(stats.PHASES))
+        self.assertEqual(report.phases['app'].count, 1)
+        self.assertEqual(report.phases['queue'].count, 0)
+
+    def test_merge_phases(self):
+        report1 = stats.Report()
+        report1.record_phase('queue', 0.001)
+        report2 = stats.Report()
+        report2.record_phase('queue', 0.003)
+        report2.record_phase('app', 0.002)
+
+        report1.merge(report2)
+
+        self.assertEqual(report1.phases['queue'].count, 2)
+        self.assertEqual(report1.phases['app'].count, 1)
+
+    def test_merge_commands(self):
+        report1 = stats.Report()
+        report2 = stats.Report()
+        report2.commands.record('GET', 0.001)
+        report2.commands.finish_request()
+
+        report1.merge(report2)
+
+        self.assertEqual(report1.commands.requests, 1)
+        self.assertEqual(report1.commands.commands['GET'].count, 1)
+
+    def test_merge_outcomes(self):
+        report1 = stats.Report()
+        report1.outcomes.record('seq1')
+        report2 = stats.Report()
+        report2.outcomes.record('seq1', 'limit', 1.0)
+
+        report1.merge(report2)
+
+        self.assertEqual(report1.outcomes.passed, 1)
+        self.assertEqual(report1.outcomes.limited, 1)
+
+    def test_pickle(self):
+        report = self.make_report()
+
+        result = pickle.loads(pickle.dumps(report, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(result.total.count, 3)
+        self.assertEqual(result.uris['GET /b'].statuses, {'413': 1})
+
+    def test_write_json(self):
+        report = self.make_report()
+        fobj = StringIO.StringIO()
+
+        report.write_json(fobj, 2.0)
+
+        result = json.loads(fobj.getvalue())
+        self.assertEqual(result['elapsed'], 2.0)
+        self.assertEqual(result['total']['count'], 3)
+        self.assertEqual(result['total']['throughput'], 1.5)
+        self.assertEqual(result['total']['statuses'], {'200': 2, '413': 1})
+        self.assertEqual(sorted(result['sequences']), ['seq1', 'seq2'])
+        self.assertEqual(result['uris']['GET /a']['count'], 2)
+        self.assertEqual(result['outcomes']['passed'], 0)
+        self.assertEqual(result['phases_ms']['app'], {})
+        self.assertEqual(result['redis']['requests'], 0)
+
+    def test_write_csv(self):
+        report = self.make_report()
+        fobj = StringIO.StringIO()
+
+        report.write_csv(fobj, 2.0)
+
+        rows = list(csv.reader(StringIO.StringIO(fobj.getvalue())))
+        self.assertEqual(rows[0], [
+            'group', 'name', 'count', 'throughput', 'mean', 'p50', 'p90',
+            'p99', 'p99.9', 'max', 'statuses',
+        ])
+        self.assertEqual([row[:4] for row in rows[1:]], [
+            ['total', '', '3', '1.5'],
+            ['sequence', 'seq1', '2', '1.0'],
+            ['sequence', 'seq2', '1', '0.5'],
+            ['uri', 'GET /a', '2', '1.0'],
+            ['uri', 'GET /b', '1', '0.5'],
+        ])
+        self.assertEqual(rows[1][9], '4.000')
+        self.assertEqual(rows[1][10], '200:2 413:1')
+
+    def test_write_csv_empty(self):
+        report = stats.Report()
+        fobj = StringIO.StringIO()
+
+        report.write_csv(fobj, 2.0)
+
+        rows = list(csv.reader(StringIO.StringIO(fobj.getvalue())))
+        self.assertEqual(rows[1], ['total', '', '0', '0.0', '', '', '', '',
+                                   '', '', ''])
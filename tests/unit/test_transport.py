@@ -0,0 +1,413 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import cPickle
+import multiprocessing
+
+import mock
+import unittest2
+
+from train import transport
+
+
+class TestException(Exception):
+    pass
+
+
+class ListQueue(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def get(self):
+        return self.items.pop(0)
+
+    def empty(self):
+        return not self.items
+
+
+class TestFlush(unittest2.TestCase):
+    def test_flush(self):
+        queue = mock.Mock()
+
+        transport.flush(queue)
+
+        queue.flush.assert_called_once_with()
+
+    def test_flush_unsupported(self):
+        queue = mock.Mock(spec=['put', 'get'])
+
+        transport.flush(queue)
+
+
+class TestShard(unittest2.TestCase):
+    def test_shard(self):
+        queue = mock.Mock(**{'shard.return_value': 'shard'})
+
+        result = transport.shard(queue, 'seq')
+
+        self.assertEqual(result, 'shard')
+        queue.shard.assert_called_once_with('seq')
+
+    def test_shard_unsupported(self):
+        queue = mock.Mock(spec=['put', 'get'])
+
+        result = transport.shard(queue, 'seq')
+
+        self.assertEqual(result, queue)
+
+
+class TestWorker(unittest2.TestCase):
+    def test_worker(self):
+        queue = mock.Mock(**{'worker.return_value': 'worker'})
+
+        result = transport.worker(queue, 3)
+
+        self.assertEqual(result, 'worker')
+        queue.worker.assert_called_once_with(3)
+
+    def test_worker_unsupported(self):
+        queue = mock.Mock(spec=['put', 'get'])
+
+        result = transport.worker(queue, 3)
+
+        self.assertEqual(result, queue)
+
+
+class TestBatchingQueue(unittest2.TestCase):
+    def test_init(self):
+        bq = transport.BatchingQueue('queue', 5)
+
+        self.assertEqual(bq.queue, 'queue')
+        self.assertEqual(bq.size, 5)
+        self.assertEqual(bq.delay, 0.001)
+        self.assertEqual(bq.batch, [])
+
+    @mock.patch('train.util.monotonic', return_value=1000.0)
+    def test_put_size(self, mock_monotonic):
+        queue = mock.Mock()
+        bq = transport.BatchingQueue(queue, 3)
+
+        for i in range(7):
+            bq.put(i)
+
+        queue.put.assert_has_calls([
+            mock.call([0, 1, 2]),
+            mock.call([3, 4, 5]),
+        ])
+        self.assertEqual(queue.put.call_count, 2)
+        self.assertEqual(bq.batch, [6])
+
+    @mock.patch('train.util.monotonic', side_effect=[
+        1000.0, 1000.0,  # put 0
+        1000.0005,  # put 1
+        1000.0015,  # put 2
+        1000.002, 1000.002,  # put 3
+    ])
+    def test_put_delay(self, mock_monotonic):
+        queue = mock.Mock()
+        bq = transport.BatchingQueue(queue, 10)
+
+        for i in range(4):
+            bq.put(i)
+
+        queue.put.assert_called_once_with([0, 1, 2])
+        self.assertEqual(bq.batch, [3])
+        self.assertEqual(bq.started, 1000.002)
+
+    def test_flush(self):
+        queue = mock.Mock()
+        bq = transport.BatchingQueue(queue, 10)
+        bq.batch = [1, 2]
+
+        bq.flush()
+        bq.flush()
+
+        queue.put.assert_called_once_with([1, 2])
+        self.assertEqual(bq.batch, [])
+
+
+class TestRingQueue(unittest2.TestCase):
+    def test_init(self):
+        rq = transport.RingQueue(8, 64)
+
+        self.assertEqual(rq.slots, 8)
+        self.assertEqual(rq.slot_size, 64)
+        self.assertEqual(len(rq._buf), 512)
+        self.assertTrue(rq.empty())
+
+    def test_encode_key(self):
+        rq = transport.RingQueue(8, 64)
+
+        self.assertEqual(rq._encode((3, 5)),
+                         (rq._KEY, '\x00\x00\x00\x03\x00\x00\x00\x05'))
+
+    def test_encode_stamped_key(self):
+        rq = transport.RingQueue(8, 64)
+
+        tag, data = rq._encode((3, 5, 1000.5))
+
+        self.assertEqual(tag, rq._STAMPED_KEY)
+        self.assertEqual(len(data), 16)
+
+    def test_encode_other(self):
+        rq = transport.RingQueue(8, 64)
+
+        for item in ['STOP', (3, -5), (1, 2, 3), ('a', 'b'), [(1, 2)]]:
+            tag, data = rq._encode(item)
+            self.assertEqual(tag, rq._PICKLE)
+
+    def test_record_size(self):
+        self.assertEqual(transport.RingQueue.record_size((3, 5)), 13)
+        self.assertEqual(transport.RingQueue.record_size((3, 5, 1000.5)),
+                         21)
+        self.assertEqual(transport.RingQueue.record_size('STOP'),
+                         5 + len(cPickle.dumps('STOP',
+                                               cPickle.HIGHEST_PROTOCOL)))
+
+    def test_roundtrip(self):
+        rq = transport.RingQueue(4, 64)
+        items = [(1, 2), 'STOP', dict(a=1), [(3, 4), (5, 6)], (7, 8),
+                 (2 ** 32 - 1, 0), (9, 10, 1000.5), 'last']
+
+        # Push enough items through to wrap around the ring
+        result = []
+        for item in items:
+            rq.put(item)
+            self.assertFalse(rq.empty())
+            if len(items) - len(result) > 2:
+                result.append(rq.get())
+        while not rq.empty():
+            result.append(rq.get())
+
+        self.assertEqual(result, items)
+
+    def test_put_too_large(self):
+        rq = transport.RingQueue(4, 64)
+
+        self.assertRaises(ValueError, rq.put, 'x' * 64)
+        self.assertTrue(rq.empty())
+
+    def test_cross_process(self):
+        rq = transport.RingQueue(4, 64)
+        count = 100
+
+        def producer():
+            for i in range(count):
+                rq.put((0, i))
+            rq.put('STOP')
+
+        proc = multiprocessing.Process(target=producer)
+        proc.start()
+        result = []
+        while True:
+            item = rq.get()
+            if item == 'STOP':
+                break
+            result.append(item)
+        proc.join()
+
+        self.assertEqual(result, [(0, i) for i in range(count)])
+
+
+class TestShardedQueue(unittest2.TestCase):
+    def make_sharded(self, workers=2, count=3, **kwargs):
+        seqs = [mock.Mock(requests=[])
+                for i in range(count)]
+        for i, seq in enumerate(seqs):
+            seq.name = 'seq%d' % i
+        queues = [ListQueue() for i in range(workers)]
+        return seqs, transport.ShardedQueue(queues, seqs, **kwargs)
+
+    def test_init(self):
+        seqs, sq = self.make_sharded()
+
+        self.assertEqual(len(sq.queues), 2)
+        self.assertEqual(sq._outputs, sq.queues)
+        self.assertEqual(list(sq._home), [0, 1, 0])
+        self.assertEqual(list(sq._dispatched), [0, 0, 0])
+        self.assertEqual(list(sq._completed), [0, 0, 0])
+        self.assertEqual(list(sq._idle), [0, 0])
+
+    @mock.patch.object(transport, 'BatchingQueue')
+    def test_init_batching(self, mock_BatchingQueue):
+        seqs, sq = self.make_sharded(batch_size=8, batch_time=0.005)
+
+        mock_BatchingQueue.assert_has_calls([
+            mock.call(sq.queues[0], 8, 0.005),
+            mock.call(sq.queues[1], 8, 0.005),
+        ])
+        self.assertEqual(sq._outputs, [mock_BatchingQueue.return_value] * 2)
+
+    def test_shard(self):
+        seqs, sq = self.make_sharded()
+
+        result = sq.shard(seqs[2])
+
+        self.assertTrue(isinstance(result, transport.SequenceShard))
+        self.assertEqual(result.sharded, sq)
+        self.assertEqual(result.seq_id, 2)
+
+    def test_worker(self):
+        seqs, sq = self.make_sharded()
+
+        result = sq.worker(1)
+
+        self.assertTrue(isinstance(result, transport.WorkerShard))
+        self.assertEqual(result.sharded, sq)
+        self.assertEqual(result.idx, 1)
+        self.assertEqual(result.queue, sq.queues[1])
+        self.assertEqual(result.pending, [])
+
+    def test_dispatch(self):
+        seqs, sq = self.make_sharded()
+
+        for seq_id in (0, 1, 2, 0):
+            sq.dispatch(seq_id, 'req%d' % seq_id)
+
+        self.assertEqual(sq.queues[0].items, [
+            (0, 'req0'), (2, 'req2'), (0, 'req0'),
+        ])
+        self.assertEqual(sq.queues[1].items, [(1, 'req1')])
+        self.assertEqual(list(sq._dispatched), [2, 1, 1])
+
+    def test_dispatch_steal(self):
+        seqs, sq = self.make_sharded(workers=3)
+        sq._idle[2] = 1
+
+        sq.dispatch(0, 'req0')
+        sq.dispatch(1, 'req1')
+
+        # Sequence 0 moved to the idle worker, claiming it, so
+        # sequence 1 stays home
+        self.assertEqual(list(sq._home), [2, 1, 2])
+        self.assertEqual(list(sq._idle), [0, 0, 0])
+        self.assertEqual(sq.queues[2].items, [(0, 'req0')])
+        self.assertEqual(sq.queues[1].items, [(1, 'req1')])
+
+    def test_dispatch_pending(self):
+        seqs, sq = self.make_sharded()
+        sq.dispatch(0, 'req0')
+        sq._idle[1] = 1
+
+        sq.dispatch(0, 'req0')
+
+        # Sequence 0 still has a request pending, so it cannot move
+        self.assertEqual(sq._home[0], 0)
+        self.assertEqual(sq.queues[0].items, [(0, 'req0')] * 2)
+
+    def test_dispatch_home_idle(self):
+        seqs, sq = self.make_sharded()
+        sq._idle[0] = 1
+        sq._idle[1] = 1
+
+        sq.dispatch(0, 'req0')
+
+        self.assertEqual(sq._home[0], 0)
+        self.assertEqual(list(sq._idle), [1, 1])
+
+    def test_put(self):
+        seqs, sq = self.make_sharded()
+
+        for i in range(3):
+            sq.put('STOP')
+
+        self.assertEqual(sq.queues[0].items, ['STOP', 'STOP'])
+        self.assertEqual(sq.queues[1].items, ['STOP'])
+
+    def test_flush(self):
+        seqs, sq = self.make_sharded()
+        sq._outputs = [mock.Mock(), mock.Mock()]
+
+        sq.flush()
+
+        for output in sq._outputs:
+            output.flush.assert_called_once_with()
+
+    def test_empty(self):
+        seqs, sq = self.make_sharded()
+
+        self.assertTrue(sq.empty())
+        sq.queues[1].put('STOP')
+        self.assertFalse(sq.empty())
+
+
+class TestSequenceShard(unittest2.TestCase):
+    def test_put(self):
+        sharded = mock.Mock()
+        shard = transport.SequenceShard(sharded, 3)
+
+        shard.put('item')
+
+        sharded.dispatch.assert_called_once_with(3, 'item')
+
+    def test_flush(self):
+        sharded = mock.Mock()
+        shard = transport.SequenceShard(sharded, 3)
+
+        shard.flush()
+
+        sharded.flush.assert_called_once_with()
+
+
+class TestWorkerShard(unittest2.TestCase):
+    def test_get(self):
+        seqs = [mock.Mock(requests=[]) for i in range(3)]
+        for i, seq in enumerate(seqs):
+            seq.name = 'seq%d' % i
+        queue = ListQueue()
+        sq = transport.ShardedQueue([queue], seqs)
+        shard = sq.worker(0)
+        for item in [(0, 'req0'), [(1, 'req1'), (2, 'req2')], 'STOP']:
+            queue.put(item)
+
+        result = [shard.get() for i in range(3)]
+
+        self.assertEqual(result, ['req0', ['req1', 'req2'], 'STOP'])
+        self.assertEqual(list(sq._completed), [1, 1, 1])
+        self.assertEqual(shard.pending, [])
+
+    def test_get_idle(self):
+        seqs = [mock.Mock(requests=[])]
+        seqs[0].name = 'seq0'
+        queue = mock.Mock(**{
+            'empty.return_value': True,
+            'get.side_effect': TestException,
+        })
+        sq = transport.ShardedQueue([queue], seqs)
+        shard = sq.worker(0)
+
+        self.assertRaises(TestException, shard.get)
+        self.assertEqual(sq._idle[0], 1)
+
+    def test_get_busy(self):
+        seqs = [mock.Mock(requests=[])]
+        seqs[0].name = 'seq0'
+        queue = mock.Mock(**{
+            'empty.return_value': False,
+            'get.return_value': (0, 'req0'),
+        })
+        sq = transport.ShardedQueue([queue], seqs)
+        sq._idle[0] = 1
+        shard = sq.worker(0)
+
+        result = shard.get()
+
+        self.assertEqual(result, 'req0')
+        self.assertEqual(sq._idle[0], 0)
+        self.assertEqual(shard.pending, [0])
+        self.assertEqual(sq._completed[0], 0)
@@ -205,6 +205,25 @@ class TestException(BaseException):
     pass
 
 
+class TestCloseLogHandlers(unittest2.TestCase):
+    @mock.patch('logging.getLogger')
+    def test_close(self, mock_getLogger):
+        handlers = [
+            mock.Mock(**{'flush.side_effect': IOError()}),
+            mock.Mock(),
+        ]
+        mock_getLogger.return_value.handlers = handlers
+
+        util._close_log_handlers()
+
+        mock_getLogger.assert_called_once_with()
+        self.assertFalse(handlers[0].close.called)
+        handlers[1].assert_has_calls([
+            mock.call.flush(),
+            mock.call.close(),
+        ])
+
+
 class TestLauncher(unittest2.TestCase):
     def test_class_attrs(self):
         self.assertEqual(util.Launcher.signames[signal.SIGTERM], 'SIGTERM')
@@ -245,13 +264,16 @@ class TestLauncher(unittest2.TestCase):
         self.assertEqual(exc.exception.signo, 25)
         mock_install_handler.assert_called_once_with(signal.SIG_DFL)
 
+    @mock.patch('multiprocessing.util._run_after_forkers')
+    @mock.patch.object(util, '_close_log_handlers')
     @mock.patch('os.getpid', return_value=5678)
     @mock.patch('os.fork', return_value=1234)
     @mock.patch('os._exit')
     @mock.patch.object(util, 'LOG')
     @mock.patch.object(util.Launcher, '_install_handler')
     def test_start_parent(self, mock_install_handler, mock_LOG, mock_exit,
-                          mock_fork, mock_getpid):
+                          mock_fork, mock_getpid,
+                          mock_close_log_handlers, mock_run_after_forkers):
         starter = mock.Mock()
         launcher = util.Launcher(starter)
 
@@ -259,19 +281,23 @@ class TestLauncher(unittest2.TestCase):
 
         self.assertEqual(result, 1234)
         mock_fork.assert_called_once_with()
+        self.assertFalse(mock_run_after_forkers.called)
         self.assertFalse(mock_install_handler.called)
         self.assertFalse(mock_getpid.called)
         self.assertFalse(starter.called)
         self.assertEqual(mock_LOG.method_calls, [])
         self.assertFalse(mock_exit.called)
 
+    @mock.patch('multiprocessing.util._run_after_forkers')
+    @mock.patch.object(util, '_close_log_handlers')
     @mock.patch('os.getpid', return_value=1234)
     @mock.patch('os.fork', return_value=0)
     @mock.patch('os._exit')
     @mock.patch.object(util, 'LOG')
     @mock.patch.object(util.Launcher, '_install_handler')
     def test_start_normal(self, mock_install_handler, mock_LOG, mock_exit,
-                          mock_fork, mock_getpid):
+                          mock_fork, mock_getpid,
+                          mock_close_log_handlers, mock_run_after_forkers):
         starter = mock.Mock()
         launcher = util.Launcher(starter, 'arg1', 'arg2', a='arg3', b='arg4')
 
@@ -281,17 +307,22 @@ class TestLauncher(unittest2.TestCase):
         mock_fork.assert_called_once_with()
         mock_install_handler.assert_called_once_with(launcher._handle_signal)
         mock_getpid.assert_called_once_with()
+        mock_run_after_forkers.assert_called_once_with()
         starter.assert_called_once_with('arg1', 'arg2', a='arg3', b='arg4')
         self.assertEqual(mock_LOG.method_calls, [])
+        mock_close_log_handlers.assert_called_once_with()
         mock_exit.assert_called_once_with(0)
 
+    @mock.patch('multiprocessing.util._run_after_forkers')
+    @mock.patch.object(util, '_close_log_handlers')
     @mock.patch('os.getpid', return_value=1234)
     @mock.patch('os.fork', return_value=0)
     @mock.patch('os._exit')
     @mock.patch.object(util, 'LOG')
     @mock.patch.object(util.Launcher, '_install_handler')
     def test_start_signal(self, mock_install_handler, mock_LOG, mock_exit,
-                          mock_fork, mock_getpid):
+                          mock_fork, mock_getpid,
+                          mock_close_log_handlers, mock_run_after_forkers):
         starter = mock.Mock(side_effect=util.SignalExit(signal.SIGTERM))
         launcher = util.Launcher(starter)
 
@@ -308,13 +339,16 @@ class TestLauncher(unittest2.TestCase):
         self.assertEqual(len(mock_LOG.method_calls), 1)
         mock_exit.assert_called_once_with(1)
 
+    @mock.patch('multiprocessing.util._run_after_forkers')
+    @mock.patch.object(util, '_close_log_handlers')
     @mock.patch('os.getpid', return_value=1234)
     @mock.patch('os.fork', return_value=0)
     @mock.patch('os._exit')
     @mock.patch.object(util, 'LOG')
     @mock.patch.object(util.Launcher, '_install_handler')
     def test_start_exit(self, mock_install_handler, mock_LOG, mock_exit,
-                        mock_fork, mock_getpid):
+                        mock_fork, mock_getpid,
+                        mock_close_log_handlers, mock_run_after_forkers):
         starter = mock.Mock(side_effect=SystemExit(5))
         launcher = util.Launcher(starter)
 
@@ -328,13 +362,16 @@ class TestLauncher(unittest2.TestCase):
         self.assertEqual(mock_LOG.method_calls, [])
         mock_exit.assert_called_once_with(5)
 
+    @mock.patch('multiprocessing.util._run_after_forkers')
+    @mock.patch.object(util, '_close_log_handlers')
     @mock.patch('os.getpid', return_value=1234)
     @mock.patch('os.fork', return_value=0)
     @mock.patch('os._exit')
     @mock.patch.object(util, 'LOG')
     @mock.patch.object(util.Launcher, '_install_handler')
     def test_start_exception(self, mock_install_handler, mock_LOG, mock_exit,
-                             mock_fork, mock_getpid):
+                             mock_fork, mock_getpid,
+                             mock_close_log_handlers, mock_run_after_forkers):
         starter = mock.Mock(side_effect=TestException)
         launcher = util.Launcher(starter)
 
@@ -350,3 +387,16 @@ class TestLauncher(unittest2.TestCase):
         ])
         self.assertEqual(len(mock_LOG.method_calls), 1)
         mock_exit.assert_called_once_with(2)
+
+
+class TestMonotonic(unittest2.TestCase):
+    def test_monotonic(self):
+        first = util.monotonic()
+        second = util.monotonic()
+
+        self.assertIsInstance(first, float)
+        self.assertGreaterEqual(second, first)
+
+    @mock.patch.object(util, '_monotonic', return_value=1234.5)
+    def test_monotonic_delegates(self, mock_monotonic):
+        self.assertEqual(util.monotonic(), 1234.5)
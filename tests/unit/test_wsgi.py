@@ -13,9 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import multiprocessing
+import os
+
 import mock
 import unittest2
 
+from train import stats
+from train import util
 from train import wsgi
 
 
@@ -26,6 +31,9 @@ class TestResponse(unittest2.TestCase):
         self.assertEqual(resp.status, None)
         self.assertEqual(resp.headers, {})
         self.assertEqual(resp.body, '')
+        self.assertEqual(resp.body_limit, None)
+        self.assertEqual(resp.body_length, 0)
+        self.assertFalse(resp.truncated)
 
     def test_call(self):
         application = mock.Mock(return_value=['body 0\n', '', 'body 1\n', 8])
@@ -35,6 +43,51 @@ class TestResponse(unittest2.TestCase):
 
         application.assert_called_once_with('environ', resp.start_response)
         self.assertEqual(resp.body, 'body 0\nbody 1\n8')
+        self.assertEqual(resp.body_length, 15)
+
+    def test_call_close(self):
+        result = mock.MagicMock()
+        result.__iter__.return_value = iter(['body 0\n', 'body 1\n'])
+        application = mock.Mock(return_value=result)
+        resp = wsgi.Response()
+
+        resp(application, 'environ')
+
+        self.assertEqual(resp.body, 'body 0\nbody 1\n')
+        result.close.assert_called_once_with()
+
+    def test_call_close_exception(self):
+        def body():
+            yield 'body 0\n'
+            raise TestException()
+
+        result = mock.MagicMock()
+        result.__iter__.return_value = body()
+        application = mock.Mock(return_value=result)
+        resp = wsgi.Response()
+
+        self.assertRaises(TestException, resp, application, 'environ')
+        result.close.assert_called_once_with()
+
+    def test_call_limit(self):
+        application = mock.Mock(return_value=['body 0\n', 'body 1\n', 8])
+        resp = wsgi.Response(10)
+
+        resp(application, 'environ')
+
+        self.assertEqual(resp.body, 'body 0\nbod')
+        self.assertEqual(resp.body_length, 15)
+        self.assertTrue(resp.truncated)
+
+    def test_call_limit_zero(self):
+        application = mock.Mock(return_value=['body 0\n', 'body 1\n'])
+        resp = wsgi.Response(0)
+
+        resp(application, 'environ')
+
+        self.assertEqual(resp.body, '')
+        self.assertEqual(resp.body_length, 14)
+        self.assertTrue(resp.truncated)
 
     def test_start_response(self):
         resp = wsgi.Response()
@@ -46,11 +99,49 @@ class TestResponse(unittest2.TestCase):
 
         self.assertEqual(result, resp.write)
         self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(resp._headers, None)
         self.assertEqual(resp.headers, {
             'HEADER_1': 'value 1',
             'HEADER_2': 'value 2',
         })
 
+    def test_header(self):
+        resp = wsgi.Response()
+        resp.start_response('200 OK', [
+            ('header-1', 'value 1'),
+            ('Header_1', 'value 2'),
+            ('header-22', 'value 3'),
+        ])
+
+        self.assertEqual(resp.header('HEADER_1'), 'value 2')
+        self.assertEqual(resp.header('HEADER_2'), None)
+        self.assertEqual(resp._headers, None)
+
+    def test_header_normalized(self):
+        resp = wsgi.Response()
+        resp.start_response('200 OK', [('header-1', 'value 1')])
+        resp._headers = dict(HEADER_1='normalized')
+
+        self.assertEqual(resp.header('HEADER_1'), 'normalized')
+
+    def test_start_response_again(self):
+        resp = wsgi.Response()
+        resp.start_response('200 OK', [
+            ('header-1', 'value 1'),
+            ('header-2', 'value 2'),
+        ])
+        self.assertEqual(resp.headers['HEADER_1'], 'value 1')
+
+        resp.start_response('500 Internal Error', [
+            ('header-1', 'value 3'),
+        ])
+
+        self.assertEqual(resp.status, '500 Internal Error')
+        self.assertEqual(resp.headers, {
+            'HEADER_1': 'value 3',
+            'HEADER_2': 'value 2',
+        })
+
     def test_write_empty(self):
         resp = wsgi.Response()
         resp.body = 'prefix:'
@@ -88,6 +179,52 @@ class TestTrainServer(unittest2.TestCase):
 
         filter.assert_called_once_with(ts.fake_app)
         self.assertEqual(ts.application, 'filter')
+        self.assertEqual(ts.table, None)
+        self.assertEqual(ts.app_mode, 'debug')
+        self.assertEqual(ts.body, '')
+        self.assertEqual(ts.service_time, None)
+        self.assertEqual(ts.service_dist, 'fixed')
+        self.assertEqual(ts.log_sample, 1.0)
+        self.assertEqual(ts.log_format, 'text')
+        self.assertEqual(ts.results, None)
+        self.assertIsInstance(ts.report, stats.Report)
+        self.assertEqual(ts.report.max_uris, 1000)
+
+    def test_init_report_uris(self):
+        filter = mock.Mock(return_value='filter')
+
+        ts = wsgi.TrainServer(filter, report_uris=50)
+
+        self.assertEqual(ts.report.max_uris, 50)
+
+    def test_init_table(self):
+        filter = mock.Mock(return_value='filter')
+
+        ts = wsgi.TrainServer(filter, table='table')
+
+        self.assertEqual(ts.table, 'table')
+
+    def test_init_app(self):
+        filter = mock.Mock(return_value='filter')
+
+        ts = wsgi.TrainServer(filter, app_mode='static', body_size=5,
+                              service_time=0.01, service_dist='exponential')
+
+        self.assertEqual(ts.app_mode, 'static')
+        self.assertEqual(ts.body, 'xxxxx')
+        self.assertEqual(ts.service_time, 0.01)
+        self.assertEqual(ts.service_dist, 'exponential')
+
+    def test_init_bad_app(self):
+        filter = mock.Mock(return_value='filter')
+
+        self.assertRaises(ValueError, wsgi.TrainServer, filter,
+                          app_mode='bogus')
+        self.assertRaises(ValueError, wsgi.TrainServer, filter,
+                          service_dist='bogus')
+        self.assertRaises(ValueError, wsgi.TrainServer, filter,
+                          log_format='bogus')
+        self.assertFalse(filter.called)
 
     @mock.patch.object(wsgi, 'Response', return_value=mock.Mock())
     def test_call(self, mock_Response):
@@ -97,7 +234,7 @@ class TestTrainServer(unittest2.TestCase):
         result = ts('environ')
 
         self.assertEqual(result, mock_Response.return_value)
-        mock_Response.assert_called_once_with()
+        mock_Response.assert_called_once_with(None)
         mock_Response.return_value.assert_called_once_with('filter', 'environ')
 
     @mock.patch('pprint.pformat', return_value="[pretty dict]")
@@ -106,19 +243,88 @@ class TestTrainServer(unittest2.TestCase):
         ts = wsgi.TrainServer(filter)
         start_response = mock.Mock()
 
-        result = ts.fake_app('environ', start_response)
+        environ = {}
+
+        result = ts.fake_app(environ, start_response)
 
         self.assertEqual(result, ["[pretty dict]"])
         start_response.assert_called_once_with(
             '200 OK', [('x-train-server', 'completed')])
-        mock_pformat.assert_called_once_with('environ')
+        mock_pformat.assert_called_once_with(environ)
+
+    @mock.patch('time.sleep')
+    @mock.patch('pprint.pformat', return_value="[pretty dict]")
+    def test_fake_app_empty(self, mock_pformat, mock_sleep):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, app_mode='empty')
+        start_response = mock.Mock()
+
+        result = ts.fake_app({}, start_response)
+
+        self.assertEqual(result, [])
+        start_response.assert_called_once_with(
+            '200 OK', [('x-train-server', 'completed')])
+        self.assertFalse(mock_pformat.called)
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch('pprint.pformat', return_value="[pretty dict]")
+    def test_fake_app_static(self, mock_pformat):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, app_mode='static', body_size=3)
+        start_response = mock.Mock()
+
+        result = ts.fake_app({}, start_response)
+
+        self.assertEqual(result, ['xxx'])
+        self.assertFalse(mock_pformat.called)
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.5])
+    def test_fake_app_stamps(self, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, app_mode='empty')
+        environ = {}
+
+        ts.fake_app(environ, mock.Mock())
+
+        self.assertEqual(environ, {
+            'train.app_entry': 1000.0,
+            'train.app_exit': 1000.5,
+        })
+
+    @mock.patch('time.sleep')
+    @mock.patch('random.expovariate', return_value=0.5)
+    def test_fake_app_service_fixed(self, mock_expovariate, mock_sleep):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, app_mode='empty', service_time=0.25)
+        start_response = mock.Mock()
+
+        ts.fake_app({}, start_response)
+
+        mock_sleep.assert_called_once_with(0.25)
+        self.assertFalse(mock_expovariate.called)
+
+    @mock.patch('time.sleep')
+    @mock.patch('random.expovariate', return_value=0.5)
+    def test_fake_app_service_exponential(self, mock_expovariate,
+                                          mock_sleep):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, app_mode='empty', service_time=0.25,
+                              service_dist='exponential')
+        start_response = mock.Mock()
+
+        ts.fake_app({}, start_response)
+
+        mock_expovariate.assert_called_once_with(4.0)
+        mock_sleep.assert_called_once_with(0.5)
 
     @mock.patch('os.getpid', return_value=1234)
     @mock.patch.object(wsgi, 'LOG')
     @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
         status='200 OK',
         headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
         body='response body here',
+        truncated=False,
     ))
     def test_start(self, mock_call, mock_LOG, mock_getpid):
         filter = mock.Mock(return_value='filter')
@@ -148,6 +354,380 @@ class TestTrainServer(unittest2.TestCase):
             mock.call(dict(request='1')),
         ])
 
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='200 OK',
+        headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
+        body='response body here',
+        truncated=False,
+    ))
+    def test_start_indexed(self, mock_call, mock_LOG, mock_getpid):
+        filter = mock.Mock(return_value='filter')
+        table = [
+            [mock.Mock(**{'synthesize.return_value': dict(request='0')})],
+            [
+                mock.Mock(**{'synthesize.return_value': dict(request='1')}),
+                'gap',
+                mock.Mock(**{'synthesize.return_value': dict(request='2')}),
+            ],
+        ]
+        ts = wsgi.TrainServer(filter, table)
+        queue = mock.Mock(**{'get.side_effect': [(1, 2), (0, 0), 'STOP']})
+
+        ts.start(queue)
+
+        mock_call.assert_has_calls([
+            mock.call(dict(request='2')),
+            mock.call(dict(request='0')),
+        ])
+        self.assertEqual(mock_call.call_count, 2)
+
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__')
+    def test_process_stamped_key(self, mock_call, mock_LOG):
+        filter = mock.Mock(return_value='filter')
+        table = [[mock.Mock(**{'synthesize.return_value': {}})]]
+        ts = wsgi.TrainServer(filter, table)
+
+        ts._process(1234, (0, 0, 1000.5))
+
+        mock_call.assert_called_once_with({'train.enqueued': 1000.5})
+
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='200 OK',
+        headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
+        body='response',
+        body_length=1024,
+        truncated=True,
+    ))
+    def test_process_truncated(self, mock_call, mock_LOG):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, body_limit=8)
+
+        ts._process(1234, dict(request='0'))
+
+        mock_LOG.info.assert_called_with(
+            "1234: Response code '200 OK'; headers "
+            "{'X_TEST': 'test header'}; body:\nresponse\n[1024 bytes total]")
+
+    @mock.patch('random.random', return_value=0.5)
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='200 OK',
+        headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
+        body='response body here',
+        truncated=False,
+    ))
+    def test_process_unsampled(self, mock_call, mock_LOG, mock_random):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, log_sample=0.25)
+
+        ts._process(1234, dict(request='0'))
+
+        mock_call.assert_called_once_with(dict(request='0'))
+        self.assertEqual(mock_LOG.method_calls, [])
+
+    @mock.patch('random.random', return_value=0.5)
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__',
+                       side_effect=TestException)
+    def test_process_unsampled_exception(self, mock_call, mock_LOG,
+                                         mock_random):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, log_sample=0.25)
+
+        ts._process(1234, dict(request='0'))
+
+        mock_LOG.exception.assert_called_once_with(
+            "1234: Exception while processing request")
+
+    @mock.patch('random.random', return_value=0.1)
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='200 OK',
+        headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
+        body='response body here',
+        body_length=18,
+    ))
+    def test_process_json(self, mock_call, mock_LOG, mock_random):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter, log_sample=0.25, log_format='json')
+
+        ts._process(1234, dict(REQUEST_METHOD='GET', PATH_INFO='/path'))
+
+        mock_LOG.assert_has_calls([
+            mock.call.info("Processed request", extra={'train': {
+                'method': 'GET',
+                'path': '/path',
+                'status': '200 OK',
+                'body_length': 18,
+            }}),
+        ])
+        self.assertEqual(len(mock_LOG.method_calls), 1)
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='413 Request Entity Too Large',
+        headers=dict(X_TEST='test header'),
+        header=dict(X_TEST='test header').get,
+        body='response body here',
+        truncated=False,
+    ))
+    def test_process_report(self, mock_call, mock_LOG, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        environ = {
+            'train.sequence': 'seq',
+            'REQUEST_METHOD': 'GET',
+            'RAW_PATH_INFO': '/path%20here',
+            'PATH_INFO': '/path here',
+        }
+
+        ts._process(1234, environ)
+
+        self.assertEqual(ts.report.total.count, 1)
+        self.assertEqual(ts.report.total.latency.total, 0.25)
+        self.assertEqual(ts.report.total.statuses, {'413': 1})
+        self.assertEqual(ts.report.sequences.keys(), ['seq'])
+        self.assertEqual(ts.report.uris.keys(), ['GET /path%20here'])
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__',
+                       side_effect=TestException)
+    def test_process_report_error(self, mock_call, mock_LOG,
+                                  mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+
+        ts._process(1234, dict(REQUEST_METHOD='GET', PATH_INFO='/path'))
+
+        self.assertEqual(ts.report.total.statuses, {'error': 1})
+        self.assertEqual(ts.report.sequences.keys(), [None])
+        self.assertEqual(ts.report.uris.keys(), ['GET /path'])
+        mock_LOG.exception.assert_called_once_with(
+            "1234: Exception while processing request")
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__', return_value=mock.Mock(
+        status='413 Request Entity Too Large',
+        headers=dict(RETRY_AFTER='5'),
+        header=dict(RETRY_AFTER='5').get,
+        body='response body here',
+        truncated=False,
+    ))
+    def test_process_progress(self, mock_call, mock_LOG, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        ts.slot = mock.Mock()
+
+        ts._process(1234, dict(REQUEST_METHOD='GET', PATH_INFO='/path'))
+
+        ts.slot.record.assert_called_once_with(0.25, False, True)
+
+    @mock.patch('train.util.monotonic', side_effect=[1000.0, 1000.25])
+    @mock.patch.object(wsgi, 'LOG')
+    @mock.patch.object(wsgi.TrainServer, '__call__',
+                       side_effect=TestException)
+    def test_process_progress_error(self, mock_call, mock_LOG,
+                                    mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        ts.slot = mock.Mock()
+
+        ts._process(1234, dict(REQUEST_METHOD='GET', PATH_INFO='/path'))
+
+        ts.slot.record.assert_called_once_with(0.25, True, False)
+
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(wsgi.TrainServer, '_process')
+    def test_start_progress(self, mock_process, mock_getpid):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        queue = mock.Mock(**{'get.side_effect': [
+            [dict(request='0'), dict(request='1')],
+            'STOP',
+        ]})
+        slot = mock.Mock()
+
+        ts.start(queue, slot)
+
+        self.assertEqual(ts.slot, slot)
+        self.assertEqual(slot.dispatched.call_count, 2)
+
+    @mock.patch('train.util.monotonic', return_value=1000.5)
+    def test_record_phases(self, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        environ = {
+            'train.enqueued': 999.0,
+            'train.app_entry': 1000.125,
+            'train.app_exit': 1000.375,
+        }
+
+        ts._record(environ, 1000.0, '200 OK')
+
+        phases = ts.report.phases
+        self.assertEqual(phases['queue'].total, 1.0)
+        self.assertEqual(phases['filter_pre'].total, 0.125)
+        self.assertEqual(phases['app'].total, 0.25)
+        self.assertEqual(phases['filter_post'].total, 0.125)
+
+    @mock.patch('train.util.monotonic', return_value=1000.5)
+    def test_record_phases_limited(self, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+
+        ts._record({}, 1000.0, '413 Request Entity Too Large', True)
+
+        phases = ts.report.phases
+        self.assertEqual(phases['queue'].count, 0)
+        self.assertEqual(phases['filter_pre'].total, 0.5)
+        self.assertEqual(phases['app'].count, 0)
+        self.assertEqual(phases['filter_post'].count, 0)
+
+    def test_classify_passed(self):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        response = mock.Mock(header=dict(X_TRAIN_SERVER='completed').get)
+
+        result = ts._classify({'train.sequence': 'seq'}, response)
+
+        self.assertEqual(result, False)
+        self.assertEqual(ts.report.outcomes.passed, 1)
+        self.assertEqual(ts.report.outcomes.sequences,
+                         dict(seq=dict(passed=1, limited=0)))
+
+    def test_classify_limited(self):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        response = mock.Mock(header=dict(RETRY_AFTER='5').get)
+        limits = [
+            mock.Mock(verbs=['GET', 'PUT'], uri='/a', value=10,
+                      unit='minute'),
+            mock.Mock(verbs=[], uri='/{x}', value=1, unit='second'),
+        ]
+        environ = {
+            'train.sequence': 'seq',
+            'turnstile.delay': [(4.2, limits[0], 'b1'),
+                                (0.5, limits[1], 'b2')],
+        }
+
+        result = ts._classify(environ, response)
+
+        self.assertEqual(result, True)
+        self.assertEqual(ts.report.outcomes.limited, 1)
+        self.assertEqual(ts.report.outcomes.limits,
+                         {'GET,PUT /a (10/minute)': 1})
+        self.assertEqual(ts.report.outcomes.delays.max, 5.0)
+
+    def test_classify_unknown(self):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        response = mock.Mock(header={}.get)
+
+        result = ts._classify({}, response)
+
+        self.assertEqual(result, True)
+        self.assertEqual(ts.report.outcomes.limits, {'unknown': 1})
+        self.assertEqual(ts.report.outcomes.delays.count, 0)
+
+    def test_classify_turnstile(self):
+        def limiter(app):
+            def middleware(environ, start_response):
+                if environ['PATH_INFO'] == '/limited':
+                    start_response('413 Request Entity Too Large',
+                                   [('Retry-After', '3')])
+                    return []
+                start_response('200 OK', [('X-Train-Server', 'completed')])
+                return []
+            return middleware
+        ts = wsgi.TrainServer(limiter)
+
+        for path in ('/passed', '/limited', '/passed'):
+            environ = dict(PATH_INFO=path)
+            response = ts(environ)
+            ts._classify(environ, response)
+
+            # Only the headers needed were examined
+            self.assertEqual(response._headers, None)
+
+        self.assertEqual(ts.report.outcomes.passed, 2)
+        self.assertEqual(ts.report.outcomes.limited, 1)
+        self.assertEqual(ts.report.outcomes.delays.max, 3.0)
+
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(wsgi.TrainServer, '_process')
+    def test_start_results(self, mock_process, mock_getpid):
+        filter = mock.Mock(return_value='filter')
+        results = mock.Mock()
+        ts = wsgi.TrainServer(filter, results=results)
+        queue = mock.Mock(**{'get.side_effect': [dict(request='0'), 'STOP']})
+
+        ts.start(queue)
+
+        mock_process.assert_called_once_with(1234, dict(request='0'))
+        self.assertEqual(results.method_calls, [
+            mock.call.put(ts.report),
+            mock.call.close(),
+            mock.call.join_thread(),
+        ])
+
+    def test_start_results_forked(self):
+        queue = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        ts = wsgi.TrainServer(lambda app: app, app_mode='empty',
+                              log_sample=0.0, results=results)
+        queue.put(dict(REQUEST_METHOD='GET', PATH_INFO='/path'))
+        queue.put('STOP')
+
+        pid = util.Launcher(ts.start, queue).start()
+        try:
+            report = results.get(timeout=10)
+        finally:
+            _pid, status = os.waitpid(pid, 0)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(report.total.latency.count, 1)
+        self.assertEqual(report.uris.keys(), ['GET /path'])
+
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(wsgi.TrainServer, '_process')
+    def test_start_batched(self, mock_process, mock_getpid):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        queue = mock.Mock(**{'get.side_effect': [
+            [dict(request='0'), dict(request='1')],
+            dict(request='2'),
+            ['STOP'],
+        ]})
+
+        ts.start(queue)
+
+        self.assertEqual(queue.get.call_count, 3)
+        mock_process.assert_has_calls([
+            mock.call(1234, dict(request='0')),
+            mock.call(1234, dict(request='1')),
+            mock.call(1234, dict(request='2')),
+        ])
+        self.assertEqual(mock_process.call_count, 3)
+
+    @mock.patch('turnstile.middleware.turnstile_filter',
+                return_value=mock.Mock(return_value='filter'))
+    def test_from_confitems_kwargs(self, mock_turnstile_filter):
+        result = wsgi.TrainServer.from_confitems([], table='table')
+
+        self.assertEqual(result.application, 'filter')
+        self.assertEqual(result.table, 'table')
+
     @mock.patch('turnstile.middleware.turnstile_filter',
                 return_value=mock.Mock(return_value='filter'))
     def test_from_confitems(self, mock_turnstile_filter):
@@ -160,11 +740,102 @@ class TestTrainServer(unittest2.TestCase):
             {}, item1='value 1', item2='value 2')
         mock_turnstile_filter.return_value.assert_called_once_with(
             result.fake_app)
+        self.assertEqual(result.redis_stats, False)
+
+    @mock.patch('turnstile.middleware.turnstile_filter',
+                return_value=mock.Mock(return_value=mock.Mock(
+                    _db='db', control_daemon=mock.Mock(_db='db'),
+                    **{'conf.get_database.return_value': 'request db'})))
+    @mock.patch('train.instrument.instrument_redis',
+                return_value='instrumented db')
+    def test_from_confitems_redis_stats(self, mock_instrument_redis,
+                                        mock_turnstile_filter):
+        result = wsgi.TrainServer.from_confitems([], redis_stats=True)
+
+        mock_instrument_redis.assert_called_once_with(
+            'request db', result.report.commands)
+        self.assertEqual(result.application._db, 'instrumented db')
+        self.assertEqual(result.application.control_daemon._db, 'db')
+        self.assertEqual(result.redis_stats, True)
+
+    @mock.patch('turnstile.middleware.turnstile_filter',
+                return_value=mock.Mock(return_value='filter'))
+    @mock.patch('train.memredis.FakeRedis', return_value=mock.Mock(
+        path='/tmp/redis.sock'))
+    @mock.patch('train.memredis.load_limits')
+    @mock.patch('atexit.register')
+    def test_from_confitems_fake_redis(self, mock_register, mock_load_limits,
+                                       mock_FakeRedis, mock_turnstile_filter):
+        items = [('redis.host', 'redis.example.com'), ('redis.port', '6379'),
+                 ('control.redis.host', 'control.example.com'),
+                 ('control.channel', 'ctl'), ('train.fake_redis', 'yes')]
+
+        result = wsgi.TrainServer.from_confitems(items)
+
+        fake = mock_FakeRedis.return_value
+        fake.start.assert_called_once_with()
+        mock_register.assert_called_once_with(fake.stop)
+        fake.stop_on_signal.assert_called_once_with()
+        self.assertFalse(mock_load_limits.called)
+        mock_turnstile_filter.assert_called_once_with(
+            {}, **{'redis.unix_socket_path': '/tmp/redis.sock',
+                   'control.channel': 'ctl'})
+        self.assertEqual(result.application, 'filter')
+
+    @mock.patch('turnstile.middleware.turnstile_filter',
+                return_value=mock.Mock(return_value='filter'))
+    @mock.patch('train.memredis.FakeRedis', return_value=mock.Mock(
+        path='/tmp/redis.sock'))
+    @mock.patch('train.memredis.load_limits')
+    @mock.patch('atexit.register')
+    def test_from_confitems_fake_redis_limits(self, mock_register,
+                                              mock_load_limits,
+                                              mock_FakeRedis,
+                                              mock_turnstile_filter):
+        items = [('redis.host', 'redis.example.com'),
+                 ('train.fake_redis', 'on'),
+                 ('train.fake_redis_limits', 'limits.xml')]
+
+        wsgi.TrainServer.from_confitems(items)
+
+        self.assertEqual(mock_load_limits.call_count, 1)
+        conf, limits_file = mock_load_limits.call_args[0]
+        self.assertEqual(conf['redis'],
+                         {'unix_socket_path': '/tmp/redis.sock'})
+        self.assertEqual(limits_file, 'limits.xml')
+        mock_turnstile_filter.assert_called_once_with(
+            {}, **{'redis.unix_socket_path': '/tmp/redis.sock'})
+
+    @mock.patch('turnstile.middleware.turnstile_filter',
+                return_value=mock.Mock(return_value='filter'))
+    @mock.patch('train.memredis.FakeRedis')
+    def test_from_confitems_fake_redis_off(self, mock_FakeRedis,
+                                           mock_turnstile_filter):
+        items = [('redis.host', 'redis.example.com'),
+                 ('train.fake_redis', 'no'),
+                 ('train.fake_redis_limits', 'limits.xml')]
+
+        wsgi.TrainServer.from_confitems(items)
+
+        self.assertFalse(mock_FakeRedis.called)
+        mock_turnstile_filter.assert_called_once_with(
+            {}, **{'redis.host': 'redis.example.com'})
+
+    @mock.patch('train.util.monotonic', return_value=1000.5)
+    def test_record_redis_stats(self, mock_monotonic):
+        filter = mock.Mock(return_value='filter')
+        ts = wsgi.TrainServer(filter)
+        ts.redis_stats = True
+        ts.report.commands.record('GET', 0.001)
+
+        ts._record({}, 1000.0, '200 OK')
+
+        self.assertEqual(ts.report.commands.per_request, {1: 1})
 
 
 class TestStartWorkers(unittest2.TestCase):
     @mock.patch.object(wsgi.TrainServer, 'from_confitems',
-                       return_value=mock.Mock(start='starter'))
+                       return_value=mock.Mock(start='starter', progress=None))
     @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
         'start.return_value': 'worker_pid',
     }))
@@ -177,7 +848,18 @@ class TestStartWorkers(unittest2.TestCase):
         mock_Launcher.return_value.start.assert_called_once_with()
 
     @mock.patch.object(wsgi.TrainServer, 'from_confitems',
-                       return_value=mock.Mock(start='starter'))
+                       return_value=mock.Mock(start='starter', progress=None))
+    @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
+        'start.return_value': 'worker_pid',
+    }))
+    def test_kwargs(self, mock_Launcher, mock_from_confitems):
+        result = wsgi.start_workers('queue', 'items', 2, table='table')
+
+        self.assertEqual(result, ['worker_pid'] * 2)
+        mock_from_confitems.assert_called_once_with('items', table='table')
+
+    @mock.patch.object(wsgi.TrainServer, 'from_confitems',
+                       return_value=mock.Mock(start='starter', progress=None))
     @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
         'start.return_value': 'worker_pid',
     }))
@@ -186,11 +868,54 @@ class TestStartWorkers(unittest2.TestCase):
 
         self.assertEqual(result, ['worker_pid'] * 5)
         mock_from_confitems.assert_called_once_with('items')
-        mock_Launcher.assert_called_once_with('starter', 'queue')
-        mock_Launcher.return_value.start.assert_has_calls([
-            mock.call(),
-            mock.call(),
-            mock.call(),
-            mock.call(),
-            mock.call(),
+        mock_Launcher.assert_has_calls([mock.call('starter', 'queue')] * 5)
+        self.assertEqual(mock_Launcher.return_value.start.call_count, 5)
+
+    @mock.patch.object(wsgi.TrainServer, 'from_confitems',
+                       return_value=mock.Mock(start='starter', progress=None))
+    @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
+        'start.return_value': 'worker_pid',
+    }))
+    @mock.patch('train.profiling.Profiler', side_effect=lambda f, p: (f, p))
+    def test_profile(self, mock_Profiler, mock_Launcher, mock_from_confitems):
+        result = wsgi.start_workers('queue', 'items', 2, profile_dir='/prof')
+
+        self.assertEqual(result, ['worker_pid'] * 2)
+        mock_from_confitems.assert_called_once_with('items')
+        mock_Launcher.assert_has_calls([
+            mock.call(('starter', '/prof/worker-0.pstats'), 'queue'),
+            mock.call(('starter', '/prof/worker-1.pstats'), 'queue'),
+        ])
+
+    @mock.patch.object(wsgi.TrainServer, 'from_confitems',
+                       return_value=mock.Mock(start='starter', progress=None))
+    @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
+        'start.return_value': 'worker_pid',
+    }))
+    @mock.patch('train.profiling.Sampler',
+                side_effect=lambda f, p, i: (f, p, i))
+    def test_profile_sample(self, mock_Sampler, mock_Launcher,
+                            mock_from_confitems):
+        result = wsgi.start_workers('queue', 'items', 1, profile_dir='/prof',
+                                    sample_rate=200.0)
+
+        self.assertEqual(result, ['worker_pid'])
+        mock_from_confitems.assert_called_once_with('items')
+        mock_Launcher.assert_called_once_with(
+            ('starter', '/prof/worker-0.collapsed', 0.005), 'queue')
+
+    @mock.patch.object(wsgi.TrainServer, 'from_confitems',
+                       return_value=mock.Mock(start='starter', **{
+                           'progress.slot.side_effect': lambda i: 'slot%d' % i,
+                       }))
+    @mock.patch('train.util.Launcher', return_value=mock.Mock(**{
+        'start.return_value': 'worker_pid',
+    }))
+    def test_progress(self, mock_Launcher, mock_from_confitems):
+        result = wsgi.start_workers('queue', 'items', 2)
+
+        self.assertEqual(result, ['worker_pid'] * 2)
+        mock_Launcher.assert_has_calls([
+            mock.call('starter', 'queue', slot='slot0'),
+            mock.call('starter', 'queue', slot='slot1'),
         ])
@@ -0,0 +1,220 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import threading
+
+
+class QueueHandler(logging.Handler):
+    """
+    A logging handler which places log records onto a queue, to be
+    written by a ``QueueListener``.  This is a backport of the class
+    of the same name in Python 3's ``logging.handlers``.  With a
+    ``multiprocessing.Queue``, records may be written by a process
+    other than the one which logged them.
+    """
+
+    def __init__(self, queue):
+        """
+        Initialize a ``QueueHandler`` object.
+
+        :param queue: The queue object to place records onto.
+        """
+
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        """
+        Prepare a record for placing onto the queue.  The message is
+        merged with its arguments, and any exception information is
+        formatted into the record's ``exc_text``, so that the record
+        can be pickled; the handlers which finally write the record
+        still see the traceback separately from the message.
+
+        :param record: The ``logging.LogRecord``.
+
+        :returns: The prepared record.
+        """
+
+        if record.exc_info and not record.exc_text:
+            formatter = self.formatter or logging._defaultFormatter
+            record.exc_text = formatter.formatException(record.exc_info)
+
+        msg = record.getMessage()
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def emit(self, record):
+        """
+        Place a record onto the queue.
+
+        :param record: The ``logging.LogRecord``.
+        """
+
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        """
+        Close the handler.  A ``multiprocessing.Queue`` writes the
+        records placed onto it from a background thread; this waits
+        for them all to be written, so that none are lost when the
+        process exits.
+        """
+
+        if hasattr(self.queue, 'join_thread'):
+            self.queue.close()
+            self.queue.join_thread()
+        logging.Handler.close(self)
+
+
+class QueueListener(object):
+    """
+    Retrieves log records from a queue in a background thread, and
+    passes them to a set of handlers.  This is a backport of the
+    class of the same name in Python 3's ``logging.handlers``.
+    """
+
+    # Placed onto the queue to stop the listener
+    _sentinel = None
+
+    def __init__(self, queue, *handlers):
+        """
+        Initialize a ``QueueListener`` object.
+
+        :param queue: The queue object to retrieve records from.
+
+        Remaining positional arguments are the handlers to pass the
+        records to.
+        """
+
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, once it has handled all the
+        records already on the queue.
+        """
+
+        self.queue.put_nowait(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        """
+        Pass a record to each of the handlers whose level it meets.
+
+        :param record: The ``logging.LogRecord``.
+        """
+
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        """
+        Handle records from the queue until the sentinel is retrieved.
+        """
+
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats log records as single-line JSON objects.  Structured data
+    may be included by passing a dictionary as the ``train`` key of
+    the ``extra`` argument of the logging call; its keys are merged
+    into the object.
+    """
+
+    def format(self, record):
+        """
+        Format a record.
+
+        :param record: The ``logging.LogRecord``.
+
+        :returns: The JSON text of the record.
+        """
+
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            # Records from a QueueHandler carry only the text
+            data['exception'] = record.exc_text
+        data.update(getattr(record, 'train', {}))
+
+        return json.dumps(data, sort_keys=True)
+
+
+def install(queue, logger=None):
+    """
+    Route the records of a logger through a queue.  The logger's
+    handlers are moved to a ``QueueListener``, which is started, and
+    replaced with a ``QueueHandler``.  Processes forked after this
+    call will place their records onto the queue, and so will not
+    block on the handlers' output.  Processes forked with a raw
+    ``os.fork()`` must be started with ``util.Launcher``, which resets
+    the queue in the child and flushes it before the child exits.
+
+    :param queue: The queue object to route records through.
+    :param logger: The ``logging.Logger`` to reroute.  Defaults to
+                   the root logger.
+
+    :returns: The started ``QueueListener``.
+    """
+
+    if logger is None:
+        logger = logging.getLogger()
+
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(queue))
+
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+
+    return listener
@@ -0,0 +1,141 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from train import util
+
+
+class TimedCommand(object):
+    """
+    Wraps the ``execute_command()`` method of a Redis client, or the
+    ``immediate_execute_command()`` method of a pipeline, recording
+    the time taken by each command.
+    """
+
+    def __init__(self, func, commands):
+        """
+        Initialize a ``TimedCommand`` object.
+
+        :param func: The method to wrap.
+        :param commands: The ``stats.Commands`` object to record the
+                         commands in.
+        """
+
+        self.func = func
+        self.commands = commands
+
+    def __call__(self, *args, **options):
+        """
+        Execute a command.  All arguments are passed to the wrapped
+        method; the first is the name of the command.
+
+        :returns: The result of the command.
+        """
+
+        start = util.monotonic()
+        try:
+            return self.func(*args, **options)
+        finally:
+            self.commands.record(str(args[0]).upper(),
+                                 util.monotonic() - start)
+
+
+class TimedPipeline(object):
+    """
+    Wraps the ``execute()`` method of a Redis pipeline, recording the
+    number of commands sent and the time taken.
+    """
+
+    def __init__(self, pipe, commands):
+        """
+        Initialize a ``TimedPipeline`` object.
+
+        :param pipe: The pipeline.
+        :param commands: The ``stats.Commands`` object to record the
+                         pipeline in.
+        """
+
+        self.pipe = pipe
+        self.execute = pipe.execute
+        self.commands = commands
+
+    def __call__(self, *args, **kwargs):
+        """
+        Execute the pipeline.  All arguments are passed to the wrapped
+        method.
+
+        :returns: The results of the commands.
+        """
+
+        count = len(self.pipe)
+        start = util.monotonic()
+        try:
+            return self.execute(*args, **kwargs)
+        finally:
+            self.commands.record_pipeline(count, util.monotonic() - start)
+
+
+class PipelineFactory(object):
+    """
+    Wraps the ``pipeline()`` method of a Redis client, so that the
+    pipelines it returns are instrumented.
+    """
+
+    def __init__(self, func, commands):
+        """
+        Initialize a ``PipelineFactory`` object.
+
+        :param func: The method to wrap.
+        :param commands: The ``stats.Commands`` object to record the
+                         pipelines in.
+        """
+
+        self.func = func
+        self.commands = commands
+
+    def __call__(self, *args, **kwargs):
+        """
+        Create a pipeline.  All arguments are passed to the wrapped
+        method.
+
+        :returns: The instrumented pipeline.
+        """
+
+        pipe = self.func(*args, **kwargs)
+
+        # Commands sent while watching keys are not buffered
+        pipe.immediate_execute_command = TimedCommand(
+            pipe.immediate_execute_command, self.commands)
+        pipe.execute = TimedPipeline(pipe, self.commands)
+
+        return pipe
+
+
+def instrument_redis(client, commands):
+    """
+    Instrument a Redis client, so that every command it sends, alone
+    or in a pipeline, is counted and timed.  The client is modified
+    in place; its class is not.
+
+    :param client: The Redis client, such as a ``redis.StrictRedis``.
+    :param commands: The ``stats.Commands`` object to record the
+                     commands in.
+
+    :returns: The client.
+    """
+
+    client.execute_command = TimedCommand(client.execute_command, commands)
+    client.pipeline = PipelineFactory(client.pipeline, commands)
+
+    return client
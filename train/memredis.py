@@ -0,0 +1,1237 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import errno
+import fnmatch
+import os
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from train import util
+
+
+class Status(str):
+    """
+    A status reply, such as "OK".  Sent as a simple string, rather
+    than a bulk string.
+    """
+
+    pass
+
+
+class Error(Exception):
+    """
+    An error reply.  Raised by a command to send an error to the
+    client.
+    """
+
+    pass
+
+
+OK = Status('OK')
+QUEUED = Status('QUEUED')
+PONG = Status('PONG')
+
+
+class NullArray(object):
+    """
+    The reply to an ``EXEC`` aborted because a watched key changed.
+    """
+
+    pass
+
+
+def encode(reply):
+    """
+    Encode a reply in the Redis protocol.
+
+    :param reply: The reply.  May be a ``Status``, an ``Error``, a
+                  string, an integer, ``None``, or a list of replies.
+
+    :returns: The encoded reply.
+    """
+
+    if isinstance(reply, Status):
+        return '+%s\r\n' % reply
+    elif isinstance(reply, Error):
+        return '-%s\r\n' % reply
+    elif isinstance(reply, str):
+        return '$%d\r\n%s\r\n' % (len(reply), reply)
+    elif isinstance(reply, bool):
+        return ':%d\r\n' % int(reply)
+    elif isinstance(reply, (int, long)):
+        return ':%d\r\n' % reply
+    elif reply is None:
+        return '$-1\r\n'
+    elif isinstance(reply, NullArray):
+        return '*-1\r\n'
+
+    return '*%d\r\n%s' % (len(reply), ''.join(encode(r) for r in reply))
+
+
+def parse(buf):
+    """
+    Parse the commands in a buffer of data received from a client.
+    Clients send each command as an array of bulk strings.
+
+    :param buf: The data received.
+
+    :returns: A tuple of a list of the complete commands in the
+              buffer, each a list of strings, and the remainder of
+              the buffer.
+    """
+
+    commands = []
+    pos = 0
+    while True:
+        start = pos
+        end = buf.find('\r\n', pos)
+        if end < 0:
+            break
+        if buf[pos] != '*':
+            raise Error('ERR Protocol error: expected multibulk')
+        count = int(buf[pos + 1:end])
+        pos = end + 2
+
+        args = []
+        while len(args) < count:
+            end = buf.find('\r\n', pos)
+            if end < 0:
+                break
+            if buf[pos] != '$':
+                raise Error('ERR Protocol error: expected bulk string')
+            length = int(buf[pos + 1:end])
+            if len(buf) < end + 2 + length + 2:
+                break
+            args.append(buf[end + 2:end + 2 + length])
+            pos = end + 2 + length + 2
+
+        if len(args) < count:
+            # Incomplete command; wait for more data
+            pos = start
+            break
+        commands.append(args)
+
+    return commands, buf[pos:]
+
+
+def _format_score(score):
+    """
+    Format a sorted set score the way Redis does.
+
+    :param score: The score.
+
+    :returns: The formatted score.
+    """
+
+    if score in (float('inf'), float('-inf')):
+        return '%sinf' % ('-' if score < 0 else '')
+    elif score == int(score):
+        return '%d' % score
+    return repr(score)
+
+
+def _parse_bound(bound):
+    """
+    Parse a score bound, as used by ``ZRANGEBYSCORE``.
+
+    :param bound: The bound, such as "-inf", "10", or "(10".
+
+    :returns: A tuple of the score and a flag indicating whether the
+              bound is exclusive.
+    """
+
+    exclusive = bound.startswith('(')
+    if exclusive:
+        bound = bound[1:]
+    try:
+        return float(bound), exclusive
+    except ValueError:
+        raise Error('ERR min or max is not a float')
+
+
+def _slice(length, start, stop):
+    """
+    Convert Redis range indexes, which are inclusive and may be
+    negative, to Python slice indexes.
+
+    :param length: The length of the sequence.
+    :param start: The index of the first element.
+    :param stop: The index of the last element.
+
+    :returns: A tuple of the start and end indexes of the slice.
+    """
+
+    start, stop = int(start), int(stop)
+    if start < 0:
+        start = max(length + start, 0)
+    if stop < 0:
+        stop = length + stop
+    return start, max(start, stop + 1)
+
+
+class Store(object):
+    """
+    An in-memory keyspace implementing the Redis commands used by
+    Turnstile.  Values are strings, lists, sets, or sorted sets;
+    sorted sets are represented as dictionaries mapping members to
+    scores.  Expired keys are removed when they are next accessed,
+    or by ``sweep()``.  Each command is implemented by a ``cmd_*()``
+    method, which takes the command's arguments as strings and
+    returns the reply or raises ``Error``.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``Store`` object.
+        """
+
+        self.data = {}
+        self.expires = {}
+
+        # Incremented each time a key is modified, for WATCH
+        self.versions = {}
+
+    def version(self, key):
+        """
+        Retrieve the version of a key.
+
+        :param key: The key.
+
+        :returns: The number of times the key has been modified.
+        """
+
+        self._expire(key)
+        return self.versions.get(key, 0)
+
+    def sweep(self, now=None):
+        """
+        Remove all the expired keys.
+
+        :param now: The current time.  Defaults to the current time.
+        """
+
+        if now is None:
+            now = time.time()
+        for key, when in self.expires.items():
+            if when <= now:
+                self._delete(key)
+
+    def _touch(self, key):
+        """
+        Record a modification of a key.
+
+        :param key: The key.
+        """
+
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _delete(self, key):
+        """
+        Delete a key.
+
+        :param key: The key.
+
+        :returns: ``True`` if the key existed.
+        """
+
+        self.expires.pop(key, None)
+        if self.data.pop(key, None) is None:
+            return False
+        self._touch(key)
+        return True
+
+    def _expire(self, key):
+        """
+        Delete a key if it has expired.
+
+        :param key: The key.
+        """
+
+        when = self.expires.get(key)
+        if when is not None and when <= time.time():
+            self._delete(key)
+
+    def _get(self, key, type_, create=False):
+        """
+        Retrieve the value of a key.
+
+        :param key: The key.
+        :param type_: The type the value must have.
+        :param create: If ``True``, a missing key is created.
+
+        :returns: The value, or ``None`` if the key does not exist and
+                  ``create`` is ``False``.
+        """
+
+        self._expire(key)
+        value = self.data.get(key)
+        if value is None:
+            if create:
+                value = self.data[key] = type_()
+            return value
+        if not isinstance(value, type_):
+            raise Error('WRONGTYPE Operation against a key holding the '
+                        'wrong kind of value')
+        return value
+
+    def _cleanup(self, key):
+        """
+        Delete a key holding an empty container, as Redis does.
+
+        :param key: The key.
+        """
+
+        if not self.data.get(key, True):
+            self._delete(key)
+
+    def cmd_ping(self, message=None):
+        """
+        ``PING [message]``: Check the connection.
+        """
+
+        return PONG if message is None else message
+
+    def cmd_echo(self, message):
+        """
+        ``ECHO message``: Return the message.
+        """
+
+        return message
+
+    def cmd_select(self, db):
+        """
+        ``SELECT index``: Accepted and ignored; there is only one
+        database.
+        """
+
+        return OK
+
+    def cmd_flushdb(self):
+        """
+        ``FLUSHDB``: Delete all the keys.
+        """
+
+        for key in self.data.keys():
+            self._delete(key)
+        return OK
+
+    def cmd_get(self, key):
+        """
+        ``GET key``: Retrieve the value of a string.
+        """
+
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *args):
+        """
+        ``SET key value [EX seconds|PX milliseconds] [NX|XX]``: Set the
+        value of a string.
+        """
+
+        args = [arg.upper() for arg in args]
+        expire = None
+        nx = xx = False
+        while args:
+            opt = args.pop(0)
+            if opt == 'EX':
+                expire = time.time() + int(args.pop(0))
+            elif opt == 'PX':
+                expire = time.time() + int(args.pop(0)) / 1000.0
+            elif opt == 'NX':
+                nx = True
+            elif opt == 'XX':
+                xx = True
+            else:
+                raise Error('ERR syntax error')
+
+        self._expire(key)
+        if (nx and key in self.data) or (xx and key not in self.data):
+            return None
+
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if expire is not None:
+            self.expires[key] = expire
+        self._touch(key)
+        return OK
+
+    def cmd_del(self, *keys):
+        """
+        ``DEL key [key ...]``: Delete keys.
+        """
+
+        count = 0
+        for key in keys:
+            self._expire(key)
+            count += self._delete(key)
+        return count
+
+    def cmd_exists(self, *keys):
+        """
+        ``EXISTS key [key ...]``: Count the keys which exist.
+        """
+
+        count = 0
+        for key in keys:
+            self._expire(key)
+            count += key in self.data
+        return count
+
+    def cmd_expire(self, key, seconds):
+        """
+        ``EXPIRE key seconds``: Set the time to live of a key.
+        """
+
+        return self.cmd_expireat(key, time.time() + int(seconds))
+
+    def cmd_pexpire(self, key, millis):
+        """
+        ``PEXPIRE key milliseconds``: Set the time to live of a key.
+        """
+
+        return self.cmd_expireat(key, time.time() + int(millis) / 1000.0)
+
+    def cmd_expireat(self, key, when):
+        """
+        ``EXPIREAT key timestamp``: Set the expiration time of a key.
+        """
+
+        self._expire(key)
+        if key not in self.data:
+            return 0
+        self.expires[key] = float(when)
+        self._touch(key)
+        return 1
+
+    def cmd_ttl(self, key):
+        """
+        ``TTL key``: Retrieve the time to live of a key.
+        """
+
+        self._expire(key)
+        if key not in self.data:
+            return -2
+        when = self.expires.get(key)
+        if when is None:
+            return -1
+        return int(round(when - time.time()))
+
+    def cmd_rpush(self, key, *values):
+        """
+        ``RPUSH key element [element ...]``: Append to a list.
+        """
+
+        value = self._get(key, list, True)
+        value.extend(values)
+        self._touch(key)
+        return len(value)
+
+    def cmd_lpush(self, key, *values):
+        """
+        ``LPUSH key element [element ...]``: Prepend to a list.
+        """
+
+        value = self._get(key, list, True)
+        value[:0] = reversed(values)
+        self._touch(key)
+        return len(value)
+
+    def cmd_linsert(self, key, where, pivot, element):
+        """
+        ``LINSERT key BEFORE|AFTER pivot element``: Insert into a
+        list.
+        """
+
+        value = self._get(key, list)
+        if value is None:
+            return 0
+        try:
+            idx = value.index(pivot)
+        except ValueError:
+            return -1
+        if where.upper() == 'AFTER':
+            idx += 1
+        value.insert(idx, element)
+        self._touch(key)
+        return len(value)
+
+    def cmd_llen(self, key):
+        """
+        ``LLEN key``: Retrieve the length of a list.
+        """
+
+        return len(self._get(key, list) or [])
+
+    def cmd_lrange(self, key, start, stop):
+        """
+        ``LRANGE key start stop``: Retrieve a range of a list.
+        """
+
+        value = self._get(key, list) or []
+        start, end = _slice(len(value), start, stop)
+        return value[start:end]
+
+    def cmd_ltrim(self, key, start, stop):
+        """
+        ``LTRIM key start stop``: Trim a list to a range.
+        """
+
+        value = self._get(key, list)
+        if value is not None:
+            start, end = _slice(len(value), start, stop)
+            value[:] = value[start:end]
+            self._touch(key)
+            self._cleanup(key)
+        return OK
+
+    def cmd_sadd(self, key, *members):
+        """
+        ``SADD key member [member ...]``: Add to a set.
+        """
+
+        value = self._get(key, set, True)
+        count = len(value)
+        value.update(members)
+        self._touch(key)
+        return len(value) - count
+
+    def cmd_srem(self, key, *members):
+        """
+        ``SREM key member [member ...]``: Remove from a set.
+        """
+
+        value = self._get(key, set)
+        if value is None:
+            return 0
+        count = len(value)
+        value.difference_update(members)
+        self._touch(key)
+        self._cleanup(key)
+        return count - len(value)
+
+    def cmd_smembers(self, key):
+        """
+        ``SMEMBERS key``: Retrieve the members of a set.
+        """
+
+        return sorted(self._get(key, set) or [])
+
+    def cmd_zadd(self, key, *args):
+        """
+        ``ZADD key [NX|XX] [CH] score member [score member ...]``: Add
+        to a sorted set.
+        """
+
+        args = list(args)
+        nx = xx = ch = False
+        while args and args[0].upper() in ('NX', 'XX', 'CH'):
+            opt = args.pop(0).upper()
+            nx = nx or opt == 'NX'
+            xx = xx or opt == 'XX'
+            ch = ch or opt == 'CH'
+        if not args or len(args) % 2:
+            raise Error('ERR syntax error')
+
+        value = self._get(key, dict, True)
+        added = changed = 0
+        for idx in range(0, len(args), 2):
+            try:
+                score = float(args[idx])
+            except ValueError:
+                raise Error('ERR value is not a valid float')
+            member = args[idx + 1]
+            if member in value:
+                if nx:
+                    continue
+                if value[member] != score:
+                    changed += 1
+            elif xx:
+                continue
+            else:
+                added += 1
+            value[member] = score
+
+        self._touch(key)
+        self._cleanup(key)
+        return added + changed if ch else added
+
+    def cmd_zrem(self, key, *members):
+        """
+        ``ZREM key member [member ...]``: Remove from a sorted set.
+        """
+
+        value = self._get(key, dict)
+        if value is None:
+            return 0
+        count = 0
+        for member in members:
+            if value.pop(member, None) is not None:
+                count += 1
+        self._touch(key)
+        self._cleanup(key)
+        return count
+
+    def cmd_zcard(self, key):
+        """
+        ``ZCARD key``: Retrieve the size of a sorted set.
+        """
+
+        return len(self._get(key, dict) or {})
+
+    def cmd_zscore(self, key, member):
+        """
+        ``ZSCORE key member``: Retrieve the score of a member.
+        """
+
+        score = (self._get(key, dict) or {}).get(member)
+        return None if score is None else _format_score(score)
+
+    def _zsorted(self, key):
+        """
+        Sort the members of a sorted set.
+
+        :param key: The key.
+
+        :returns: A list of ``(score, member)`` tuples, in order.
+        """
+
+        value = self._get(key, dict) or {}
+        return sorted((score, member) for member, score in value.items())
+
+    def _zreply(self, items, withscores):
+        """
+        Build the reply to a sorted set range command.
+
+        :param items: A list of ``(score, member)`` tuples.
+        :param withscores: If ``True``, the scores are included.
+
+        :returns: The reply.
+        """
+
+        result = []
+        for score, member in items:
+            result.append(member)
+            if withscores:
+                result.append(_format_score(score))
+        return result
+
+    def cmd_zrange(self, key, start, stop, *args):
+        """
+        ``ZRANGE key start stop [WITHSCORES]``: Retrieve a range of a
+        sorted set, by index.
+        """
+
+        items = self._zsorted(key)
+        start, end = _slice(len(items), start, stop)
+        return self._zreply(items[start:end],
+                            [arg.upper() for arg in args] == ['WITHSCORES'])
+
+    def _zbyscore(self, key, low, high):
+        """
+        Select the members of a sorted set within a range of scores.
+
+        :param key: The key.
+        :param low: The lower bound, as accepted by ``ZRANGEBYSCORE``.
+        :param high: The upper bound.
+
+        :returns: A list of ``(score, member)`` tuples, in order.
+        """
+
+        (low, low_ex), (high, high_ex) = _parse_bound(low), _parse_bound(high)
+        items = self._zsorted(key)
+        scores = [score for score, _member in items]
+        start = (bisect.bisect_right if low_ex else bisect.bisect_left)(
+            scores, low)
+        end = (bisect.bisect_left if high_ex else bisect.bisect_right)(
+            scores, high)
+        return items[start:end]
+
+    def cmd_zrangebyscore(self, key, low, high, *args):
+        """
+        ``ZRANGEBYSCORE key min max [WITHSCORES] [LIMIT offset
+        count]``: Retrieve a range of a sorted set, by score.
+        """
+
+        args = [arg.upper() for arg in args]
+        items = self._zbyscore(key, low, high)
+        withscores = 'WITHSCORES' in args
+        if 'LIMIT' in args:
+            idx = args.index('LIMIT')
+            offset, count = int(args[idx + 1]), int(args[idx + 2])
+            items = items[offset:] if count < 0 else \
+                items[offset:offset + count]
+        return self._zreply(items, withscores)
+
+    def cmd_zremrangebyscore(self, key, low, high):
+        """
+        ``ZREMRANGEBYSCORE key min max``: Remove a range of a sorted
+        set, by score.
+        """
+
+        items = self._zbyscore(key, low, high)
+        return self.cmd_zrem(key, *[member for _score, member in items])
+
+
+# Commands which are executed immediately inside a transaction
+_IMMEDIATE = set(['MULTI', 'EXEC', 'DISCARD', 'WATCH'])
+
+# Commands permitted while subscribed
+_SUBSCRIBED = set(['SUBSCRIBE', 'UNSUBSCRIBE', 'PSUBSCRIBE', 'PUNSUBSCRIBE',
+                   'PING'])
+
+
+class Client(object):
+    """
+    The state of a connection to the ``Server``.
+    """
+
+    def __init__(self, sock):
+        """
+        Initialize a ``Client`` object.
+
+        :param sock: The client's socket.
+        """
+
+        self.sock = sock
+        self.inbuf = ''
+        self.outbuf = ''
+        self.queued = None
+        self.watched = {}
+        self.channels = set()
+        self.patterns = set()
+
+    @property
+    def subscriptions(self):
+        """
+        The number of channels and patterns the client is subscribed
+        to.
+        """
+
+        return len(self.channels) + len(self.patterns)
+
+
+class Server(object):
+    """
+    A single-threaded Redis server, serving a ``Store`` on a listening
+    socket.  Commands are executed one at a time, so each is atomic,
+    as are transactions.  Publish/subscribe is supported for
+    Turnstile's control channel.  Commands handled by the connection
+    are the ``cmd_*()`` methods of this class, which receive the
+    ``Client``; all others are the ``cmd_*()`` methods of the store.
+    """
+
+    def __init__(self, listener, store=None, sweep_interval=1.0):
+        """
+        Initialize a ``Server`` object.
+
+        :param listener: The listening socket.
+        :param store: The ``Store`` to serve.  A new, empty store is
+                      created by default.
+        :param sweep_interval: The interval at which expired keys are
+                               removed, in seconds.
+        """
+
+        self.listener = listener
+        self.store = store or Store()
+        self.sweep_interval = sweep_interval
+        self.clients = {}
+
+    def serve(self, parent=None):
+        """
+        Serve clients until interrupted by a signal, or until the
+        parent process exits.
+
+        :param parent: The process ID of the parent process.  This
+                       should be recorded before forking, as the
+                       parent may exit before the server starts.
+                       Defaults to the current parent process.
+        """
+
+        # If the parent dies without stopping us, we are reparented
+        if parent is None:
+            parent = os.getppid()
+
+        self.listener.setblocking(False)
+        next_sweep = util.monotonic() + self.sweep_interval
+        while True:
+            readers = [self.listener] + [c.sock for c in self.clients.values()]
+            writers = [c.sock for c in self.clients.values() if c.outbuf]
+            timeout = max(next_sweep - util.monotonic(), 0.0)
+
+            try:
+                readable, writable, _x = select.select(readers, writers, [],
+                                                       timeout)
+            except select.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for sock in readable:
+                if sock is self.listener:
+                    self._accept()
+                elif sock in self.clients:
+                    self._read(self.clients[sock])
+            for sock in writable:
+                if sock in self.clients:
+                    self._flush(self.clients[sock])
+
+            if util.monotonic() >= next_sweep:
+                if os.getppid() != parent:
+                    return
+                self.store.sweep()
+                next_sweep = util.monotonic() + self.sweep_interval
+
+    def _accept(self):
+        """
+        Accept a new client connection.
+        """
+
+        try:
+            sock, _addr = self.listener.accept()
+        except socket.error as exc:
+            if exc.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        sock.setblocking(False)
+        self.clients[sock] = Client(sock)
+
+    def _close(self, client):
+        """
+        Close a client connection.
+
+        :param client: The ``Client``.
+        """
+
+        del self.clients[client.sock]
+        client.sock.close()
+
+    def _read(self, client):
+        """
+        Read data from a client, and execute the commands it contains.
+
+        :param client: The ``Client``.
+        """
+
+        try:
+            data = client.sock.recv(65536)
+        except socket.error as exc:
+            if exc.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self._close(client)
+            return
+
+        try:
+            commands, client.inbuf = parse(client.inbuf + data)
+        except (Error, ValueError) as exc:
+            client.outbuf += encode(Error(str(exc)))
+            self._flush(client)
+            self._close(client)
+            return
+
+        for args in commands:
+            self._send(client, self.execute(client, args))
+        self._flush(client)
+
+    def _send(self, client, reply):
+        """
+        Queue a reply for sending to a client.
+
+        :param client: The ``Client``.
+        :param reply: The reply.
+        """
+
+        client.outbuf += encode(reply)
+
+    def _flush(self, client):
+        """
+        Send as much of a client's pending output as possible.
+
+        :param client: The ``Client``.
+        """
+
+        while client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+            except socket.error as exc:
+                if exc.args[0] in (errno.EAGAIN, errno.EINTR):
+                    return
+                self._close(client)
+                return
+            client.outbuf = client.outbuf[sent:]
+
+    def execute(self, client, args):
+        """
+        Execute a command on behalf of a client.
+
+        :param client: The ``Client``.
+        :param args: The command and its arguments.
+
+        :returns: The reply.
+        """
+
+        if not args:
+            return Error('ERR empty command')
+        name = args[0].upper()
+
+        if client.subscriptions and name not in _SUBSCRIBED:
+            return Error('ERR only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / '
+                         'QUIT allowed in this context')
+
+        # Queue commands inside a transaction
+        if client.queued is not None and name not in _IMMEDIATE:
+            client.queued.append(args)
+            return QUEUED
+
+        method = getattr(self, 'cmd_%s' % name.lower(), None)
+        if method is not None:
+            return method(client, *args[1:])
+
+        return self._call(args)
+
+    def _call(self, args):
+        """
+        Execute a command against the store.
+
+        :param args: The command and its arguments.
+
+        :returns: The reply.
+        """
+
+        method = getattr(self.store, 'cmd_%s' % args[0].lower(), None)
+        if method is None:
+            return Error("ERR unknown command '%s'" % args[0])
+
+        try:
+            return method(*args[1:])
+        except TypeError:
+            return Error("ERR wrong number of arguments for '%s' command" %
+                         args[0].lower())
+        except ValueError:
+            return Error('ERR value is not an integer or out of range')
+        except Error as exc:
+            return exc
+
+    def cmd_multi(self, client):
+        """
+        ``MULTI``: Start a transaction.
+        """
+
+        if client.queued is not None:
+            return Error('ERR MULTI calls can not be nested')
+        client.queued = []
+        return OK
+
+    def cmd_discard(self, client):
+        """
+        ``DISCARD``: Abandon a transaction.
+        """
+
+        if client.queued is None:
+            return Error('ERR DISCARD without MULTI')
+        client.queued = None
+        client.watched = {}
+        return OK
+
+    def cmd_exec(self, client):
+        """
+        ``EXEC``: Execute a transaction, unless a watched key has been
+        modified.
+        """
+
+        if client.queued is None:
+            return Error('ERR EXEC without MULTI')
+        queued, client.queued = client.queued, None
+        watched, client.watched = client.watched, {}
+
+        # Abort if any watched key has been modified
+        for key, version in watched.items():
+            if self.store.version(key) != version:
+                return NullArray()
+
+        return [self.execute(client, args) for args in queued]
+
+    def cmd_watch(self, client, *keys):
+        """
+        ``WATCH key [key ...]``: Watch keys for modification.
+        """
+
+        if client.queued is not None:
+            return Error('ERR WATCH inside MULTI is not allowed')
+        for key in keys:
+            client.watched.setdefault(key, self.store.version(key))
+        return OK
+
+    def cmd_unwatch(self, client):
+        """
+        ``UNWATCH``: Forget the watched keys.
+        """
+
+        client.watched = {}
+        return OK
+
+    def _subscription_replies(self, client, kind, names, current):
+        """
+        Build the replies to a subscribe or unsubscribe command.
+
+        :param client: The ``Client``.
+        :param kind: The kind of reply, such as "subscribe".
+        :param names: The channels or patterns named in the command.
+        :param current: The set of the client's channels or patterns
+                        to update.
+
+        :returns: A list of replies.  All but the last are sent
+                  immediately; the last is returned as the reply to
+                  the command.
+        """
+
+        subscribe = not kind.endswith('unsubscribe')
+        if not subscribe and not names:
+            names = sorted(current)
+            if not names:
+                return [kind, None, client.subscriptions]
+
+        replies = []
+        for name in names:
+            if subscribe:
+                current.add(name)
+            else:
+                current.discard(name)
+            replies.append([kind, name, client.subscriptions])
+
+        for reply in replies[:-1]:
+            self._send(client, reply)
+        return replies[-1]
+
+    def cmd_subscribe(self, client, *channels):
+        """
+        ``SUBSCRIBE channel [channel ...]``: Subscribe to channels.
+        """
+
+        return self._subscription_replies(client, 'subscribe', channels,
+                                          client.channels)
+
+    def cmd_unsubscribe(self, client, *channels):
+        """
+        ``UNSUBSCRIBE [channel ...]``: Unsubscribe from channels.
+        """
+
+        return self._subscription_replies(client, 'unsubscribe', channels,
+                                          client.channels)
+
+    def cmd_psubscribe(self, client, *patterns):
+        """
+        ``PSUBSCRIBE pattern [pattern ...]``: Subscribe to channel
+        patterns.
+        """
+
+        return self._subscription_replies(client, 'psubscribe', patterns,
+                                          client.patterns)
+
+    def cmd_punsubscribe(self, client, *patterns):
+        """
+        ``PUNSUBSCRIBE [pattern ...]``: Unsubscribe from channel
+        patterns.
+        """
+
+        return self._subscription_replies(client, 'punsubscribe', patterns,
+                                          client.patterns)
+
+    def cmd_publish(self, client, channel, message):
+        """
+        ``PUBLISH channel message``: Send a message to the
+        subscribers of a channel.
+        """
+
+        count = 0
+        for other in self.clients.values():
+            if channel in other.channels:
+                self._send(other, ['message', channel, message])
+                count += 1
+            for pattern in other.patterns:
+                if fnmatch.fnmatchcase(channel, pattern):
+                    self._send(other, ['pmessage', pattern, channel,
+                                       message])
+                    count += 1
+            if other is not client:
+                self._flush(other)
+        return count
+
+
+class FakeRedis(object):
+    """
+    Runs a ``Server`` in a child process, listening on a Unix socket.
+    Processes forked after the server is started share its keyspace
+    by connecting to the socket, just as they would share a real
+    Redis server--but without the network.  If the process which
+    started the server exits without stopping it, the server removes
+    its socket and exits on its own.
+    """
+
+    def __init__(self, path=None):
+        """
+        Initialize a ``FakeRedis`` object.
+
+        :param path: The name of the Unix socket to listen on.  By
+                     default, a socket is created in a new temporary
+                     directory, which is removed when the server is
+                     stopped.
+        """
+
+        self.path = path
+        self.pid = None
+        self._tmpdir = None
+        self._owner = None
+
+    def start(self):
+        """
+        Start the server.  The socket is listening by the time this
+        method returns, so clients may connect immediately.
+
+        :returns: The process ID of the server.
+        """
+
+        if self.path is None:
+            self._tmpdir = tempfile.mkdtemp(prefix='train-redis-')
+            self.path = os.path.join(self._tmpdir, 'redis.sock')
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen(128)
+            self.pid = util.Launcher(self._serve, Server(listener),
+                                     os.getpid()).start()
+        finally:
+            listener.close()
+
+        self._owner = os.getpid()
+        return self.pid
+
+    def _serve(self, server, parent):
+        """
+        Run the server in the child process.  If the server returns
+        because the process which started it has exited, its socket
+        is removed.
+
+        :param server: The ``Server`` to run.
+        :param parent: The process ID of the process which started
+                       the server.
+        """
+
+        server.serve(parent)
+        self._cleanup()
+
+    def _cleanup(self):
+        """
+        Remove the server's socket, and its temporary directory, if
+        one was created.
+        """
+
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+            self.path = None
+        elif os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def stop(self):
+        """
+        Stop the server and remove its socket.  Does nothing in a
+        process other than the one which started the server, such as
+        a forked worker.
+        """
+
+        if self.pid is None or os.getpid() != self._owner:
+            return
+
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            # The server has already exited
+            pass
+        self.pid = None
+
+        self._cleanup()
+
+    def stop_on_signal(self, signo=signal.SIGTERM):
+        """
+        Stop the server when this process receives a signal, which
+        would otherwise kill it without running its exit handlers.
+        Once the server is stopped, the signal is handled as it was
+        before.
+
+        :param signo: The signal to handle.  Defaults to ``SIGTERM``.
+        """
+
+        previous = signal.getsignal(signo)
+
+        def handler(sig, frame):
+            self.stop()
+
+            signal.signal(sig, previous)
+            if callable(previous):
+                previous(sig, frame)
+            elif previous != signal.SIG_IGN:
+                # The default action; deliver the signal again
+                signal.signal(sig, signal.SIG_DFL)
+                os.kill(os.getpid(), sig)
+
+        signal.signal(signo, handler)
+
+
+def load_limits(conf, limits_file):
+    """
+    Load limits from an XML file into the database, as Turnstile's
+    ``setup_limits`` tool does.  This is needed to seed a
+    ``FakeRedis`` server, which starts out empty.  The limits are
+    stored in the same form as by ``turnstile.database.limit_update()``,
+    but as the database is empty, the limits are simply added; the
+    commands are sent directly, so they do not depend on the version
+    of the Redis client library.
+
+    :param conf: The ``turnstile.config.Config`` object, used to
+                 connect to the database.
+    :param limits_file: The name of the XML file describing the
+                        limits.
+
+    :returns: The list of limits loaded.
+    """
+
+    from lxml import etree
+    import msgpack
+    from turnstile import tools
+
+    db = conf.get_database()
+    limits_key = conf['control'].get('limits_key', 'limits')
+
+    lims = []
+    for idx, lim in enumerate(etree.parse(limits_file).getroot()):
+        if lim.tag == 'limit':
+            lims.append(tools.parse_limit_node(db, idx, lim))
+
+    db.execute_command('DEL', limits_key)
+    for idx, lim in enumerate(lims):
+        db.execute_command('ZADD', limits_key, (idx + 1) * 10,
+                           msgpack.dumps(lim.dehydrate()))
+
+    return lims
@@ -0,0 +1,229 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import thread
+
+
+class Profiler(object):
+    """
+    Wraps a function so that it runs under ``cProfile``.  The
+    profiling statistics are written to a file when the function
+    exits, whether it returns or raises an exception--including the
+    ``util.SignalExit`` raised when a launched worker is killed.
+    """
+
+    def __init__(self, func, path):
+        """
+        Initialize a ``Profiler`` object.
+
+        :param func: The function to profile.
+        :param path: The name of the file to write the statistics
+                     to, in the format read by ``pstats``.
+        """
+
+        self.func = func
+        self.path = path
+
+    def __call__(self, *args, **kwargs):
+        """
+        Call the function under the profiler.  All arguments are
+        passed to the function.
+
+        :returns: The return value of the function.
+        """
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.path)
+
+
+class Sampler(object):
+    """
+    Wraps a function so that it runs under a sampling profiler.  A
+    profiling interval timer delivers ``SIGPROF`` periodically, as
+    the process consumes CPU time; at each signal, the stacks of all
+    the threads are recorded.  The stacks are written to a file when
+    the function exits, in the "collapsed" format used by flame graph
+    tools: one line per distinct stack, giving the frames from the
+    outermost, separated by semicolons, followed by a space and the
+    number of samples.
+
+    The death signals installed by ``util.Launcher`` are unaffected,
+    and a ``util.SignalExit`` raised by their handler still causes the
+    stacks to be written.  ``SIGPROF`` is set not to interrupt system
+    calls, so that a worker blocked on its queue is not disturbed.
+    """
+
+    def __init__(self, func, path, interval=0.005):
+        """
+        Initialize a ``Sampler`` object.
+
+        :param func: The function to profile.
+        :param path: The name of the file to write the stacks to.
+        :param interval: The interval between samples, in seconds of
+                         CPU time.
+        """
+
+        self.func = func
+        self.path = path
+        self.interval = interval
+        self.stacks = {}
+
+    def __call__(self, *args, **kwargs):
+        """
+        Call the function under the profiler.  All arguments are
+        passed to the function.
+
+        :returns: The return value of the function.
+        """
+
+        old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, old_handler)
+            self.write()
+
+    def _sample(self, signo, frame):
+        """
+        The ``SIGPROF`` handler.  Records the stack of each thread.
+
+        :param signo: The signal that was caught.
+        :param frame: The frame during which the signal was caught.
+        """
+
+        frames = sys._current_frames()
+
+        # This thread is running the handler; use the frame it
+        # interrupted
+        frames[thread.get_ident()] = frame
+
+        for top in frames.values():
+            names = []
+            while top is not None:
+                code = top.f_code
+                names.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                             code.co_firstlineno))
+                top = top.f_back
+            if names:
+                stack = ';'.join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write(self):
+        """
+        Write the recorded stacks to the file, in collapsed format.
+        """
+
+        with open(self.path, 'w') as f:
+            write_collapsed(f, self.stacks)
+
+
+def worker_path(directory, idx, ext='pstats'):
+    """
+    Compute the name of the statistics file of a worker.
+
+    :param directory: The directory the statistics are written to.
+    :param idx: The index of the worker.
+    :param ext: The file extension; "pstats" for ``Profiler``, or
+                "collapsed" for ``Sampler``.
+
+    :returns: The file name.
+    """
+
+    return os.path.join(directory, 'worker-%d.%s' % (idx, ext))
+
+
+def merge(paths, stream, sort='cumulative', limit=40, output=None):
+    """
+    Merge profiling statistics files, and print a report of the
+    merged statistics.  Files which do not exist are skipped.
+
+    :param paths: A list of the names of the statistics files.
+    :param stream: A file object to print the report to.
+    :param sort: The key to sort the report by; see
+                 ``pstats.Stats.sort_stats()``.
+    :param limit: The number of functions to include in the report.
+    :param output: The name of a file to write the merged statistics
+                   to, if desired.
+
+    :returns: The merged ``pstats.Stats`` object, or ``None`` if none
+              of the files exist.
+    """
+
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return None
+
+    stats = pstats.Stats(*paths, stream=stream)
+    if output:
+        stats.dump_stats(output)
+    stats.sort_stats(sort).print_stats(limit)
+
+    return stats
+
+
+def write_collapsed(fobj, stacks):
+    """
+    Write stacks in collapsed format, sorted by stack.
+
+    :param fobj: A file object to write the stacks to.
+    :param stacks: A dictionary mapping each stack, as a string of
+                   frames separated by semicolons, to its number of
+                   samples.
+    """
+
+    for stack in sorted(stacks):
+        fobj.write('%s %d\n' % (stack, stacks[stack]))
+
+
+def merge_collapsed(paths, output):
+    """
+    Merge files of stacks in collapsed format.  Files which do not
+    exist are skipped.
+
+    :param paths: A list of the names of the files.
+    :param output: The name of the file to write the merged stacks
+                   to.
+
+    :returns: A dictionary mapping each stack to its total number of
+              samples.
+    """
+
+    stacks = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                stack, _sep, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] = stacks.get(stack, 0) + int(count)
+
+    with open(output, 'w') as f:
+        write_collapsed(f, stacks)
+
+    return stacks
@@ -0,0 +1,263 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import multiprocessing.sharedctypes
+import sys
+import threading
+
+from train import stats
+from train import transport
+from train import util
+
+
+# The counters kept for each worker, in order
+FIELDS = ('dispatched', 'completed', 'errors', 'limited')
+
+# Offsets of the counters within a worker's slot
+_DISPATCHED, _COMPLETED, _ERRORS, _LIMITED = range(len(FIELDS))
+
+# Used to compute latency bucket indexes; durations of 2**32
+# microseconds (about 71 minutes) and up share the last bucket
+_HISTOGRAM = stats.Histogram()
+BUCKETS = _HISTOGRAM.bucket_index((1 << 32) - 1) + 1
+
+
+class Progress(object):
+    """
+    Counters describing the progress of a run, kept in shared memory
+    so that the parent process can read them while the workers are
+    running.  Each worker has its own slot of counters and latency
+    buckets, which only that worker writes to, so no locking is
+    needed; the parent's reads may be slightly stale, which is fine
+    for a progress display.
+    """
+
+    def __init__(self, workers):
+        """
+        Initialize a ``Progress`` object.  This must be done before
+        the workers are forked.
+
+        :param workers: The number of workers.
+        """
+
+        self.workers = workers
+        self._counts = multiprocessing.sharedctypes.RawArray(
+            'L', workers * len(FIELDS))
+        self._buckets = multiprocessing.sharedctypes.RawArray(
+            'L', workers * BUCKETS)
+
+    def slot(self, idx):
+        """
+        Retrieve the slot of a worker.
+
+        :param idx: The index of the worker.
+
+        :returns: A ``WorkerSlot`` object.
+        """
+
+        return WorkerSlot(self, idx)
+
+    def snapshot(self):
+        """
+        Take a snapshot of the counters, summed across the workers.
+
+        :returns: A tuple of a dictionary mapping the names in
+                  ``FIELDS`` to their values, and a list of the
+                  counts in each latency bucket.
+        """
+
+        counts = self._counts[:]
+        width = len(FIELDS)
+        totals = dict((name, sum(counts[i::width]))
+                      for i, name in enumerate(FIELDS))
+
+        data = self._buckets[:]
+        rows = [data[i * BUCKETS:(i + 1) * BUCKETS]
+                for i in range(self.workers)]
+        buckets = [sum(col) for col in zip(*rows)]
+
+        return totals, buckets
+
+
+class WorkerSlot(object):
+    """
+    The counters of a single worker.
+    """
+
+    def __init__(self, progress, idx):
+        """
+        Initialize a ``WorkerSlot`` object.
+
+        :param progress: The ``Progress`` object.
+        :param idx: The index of the worker.
+        """
+
+        self._counts = progress._counts
+        self._buckets = progress._buckets
+        self._base = idx * len(FIELDS)
+        self._bucket_base = idx * BUCKETS
+
+    def dispatched(self, count=1):
+        """
+        Count requests dispatched to the worker, as it retrieves them
+        from the queue.
+
+        :param count: The number of requests retrieved.
+        """
+
+        self._counts[self._base + _DISPATCHED] += count
+
+    def record(self, duration, error=False, limited=False):
+        """
+        Count a processed request.
+
+        :param duration: The time taken to process the request, in
+                         seconds.
+        :param error: ``True`` if processing the request raised an
+                      exception.
+        :param limited: ``True`` if the request was rate-limited.
+        """
+
+        base = self._base
+        self._counts[base + _COMPLETED] += 1
+        if error:
+            self._counts[base + _ERRORS] += 1
+        if limited:
+            self._counts[base + _LIMITED] += 1
+
+        idx = _HISTOGRAM.bucket_index(int(max(duration, 0.0) /
+                                          _HISTOGRAM.resolution))
+        self._buckets[self._bucket_base + min(idx, BUCKETS - 1)] += 1
+
+
+def percentile(buckets, pct):
+    """
+    Compute a percentile from a list of latency bucket counts, such
+    as the difference between two snapshots.
+
+    :param buckets: A list of the counts in each bucket.
+    :param pct: The desired percentile, from 0 to 100.
+
+    :returns: The value at the percentile, in seconds, or ``None`` if
+              the buckets are empty.
+    """
+
+    count = sum(buckets)
+    if not count:
+        return None
+
+    target = max(1, int(round(count * pct / 100.0)))
+    seen = 0
+    for idx, bucket in enumerate(buckets):
+        seen += bucket
+        if seen >= target:
+            break
+
+    return _HISTOGRAM.bucket_value(idx) * _HISTOGRAM.resolution
+
+
+class Ticker(object):
+    """
+    Periodically prints a line describing the progress of a run: the
+    instantaneous rate of completed requests, the request counters,
+    the depth of the request queue, and the 99th percentile latency
+    of the requests completed during the interval.
+    """
+
+    def __init__(self, progress, queue=None, interval=1.0, out=None):
+        """
+        Initialize a ``Ticker`` object.
+
+        :param progress: The ``Progress`` object to report on.
+        :param queue: The request queue, for reporting its depth.
+        :param interval: The time between lines, in seconds.
+        :param out: The file to print the lines to.  Defaults to
+                    ``sys.stdout``.
+        """
+
+        self.progress = progress
+        self.queue = queue
+        self.interval = interval
+        self.out = out or sys.stdout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start printing progress lines from a background thread.
+        """
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop printing progress lines.
+        """
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def format(self, elapsed, interval, prev, cur):
+        """
+        Format a progress line.
+
+        :param elapsed: The time since the ticker was started, in
+                        seconds.
+        :param interval: The time since the previous snapshot, in
+                         seconds.
+        :param prev: The previous snapshot, as returned by
+                     ``Progress.snapshot()``.
+        :param cur: The current snapshot.
+
+        :returns: The progress line.
+        """
+
+        totals, buckets = cur
+        completed = totals['completed'] - prev[0]['completed']
+        rate = completed / interval if interval > 0 else 0.0
+
+        depth = transport.depth(self.queue)
+        p99 = percentile([c - p for c, p in zip(buckets, prev[1])], 99)
+
+        return ("[%7.1fs] %.1f req/s; dispatched %d, completed %d, "
+                "errors %d, limited %d; queue depth %s; p99 %s" %
+                (elapsed, rate, totals['dispatched'], totals['completed'],
+                 totals['errors'], totals['limited'],
+                 '-' if depth is None else depth,
+                 '-' if p99 is None else '%.3fms' % (p99 * 1000)))
+
+    def _run(self):
+        """
+        Print a progress line every interval until stopped.
+        """
+
+        start = last = util.monotonic()
+        prev = self.progress.snapshot()
+        while not self._stop.is_set():
+            # Event.wait() only returns the flag from Python 2.7 on
+            self._stop.wait(self.interval)
+            if self._stop.is_set():
+                break
+
+            now = util.monotonic()
+            cur = self.progress.snapshot()
+            self.out.write(self.format(now - start, now - last, prev, cur) +
+                           '\n')
+            self.out.flush()
+            last, prev = now, cur
@@ -0,0 +1,126 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import marshal
+import os
+
+
+# Bumped whenever the format of the cached data changes
+VERSION = 1
+
+# Size of the chunks in which request files are read for hashing
+CHUNK_SIZE = 1 << 20
+
+
+def digest(fname):
+    """
+    Compute the hash of the contents of a file.
+
+    :param fname: The name of the file.
+
+    :returns: The hexadecimal SHA-1 digest of the contents.
+    """
+
+    hasher = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def cache_path(cache_dir, fname):
+    """
+    Compute the name of the cache file for a request file.  Each
+    request file has its own cache file, named after the hash of its
+    absolute path.
+
+    :param cache_dir: The directory containing the cache files.
+    :param fname: The name of the request file.
+
+    :returns: The name of the cache file.
+    """
+
+    key = hashlib.sha1(os.path.abspath(fname)).hexdigest()
+    return os.path.join(cache_dir, '%s.cache' % key)
+
+
+def stamp(fname):
+    """
+    Compute the stamp identifying the version of a request file which
+    a cache file was built from.
+
+    :param fname: The name of the request file.
+
+    :returns: A tuple of the modification time and the digest of the
+              contents of the file.
+    """
+
+    return os.stat(fname).st_mtime, digest(fname)
+
+
+def load(cache_dir, fname, file_stamp):
+    """
+    Load the cached parse of a request file.  The cache file is read
+    with a single sequential read.  The cached data is only used if
+    both the modification time and the contents of the request file
+    are unchanged since the cache file was written.
+
+    :param cache_dir: The directory containing the cache files.
+    :param fname: The name of the request file.
+    :param file_stamp: The current stamp of the request file, as
+                       returned by ``stamp()``.
+
+    :returns: The cached data, or ``None`` if there is no usable cache
+              file.
+    """
+
+    try:
+        with open(cache_path(cache_dir, fname), 'rb') as f:
+            cached = marshal.loads(f.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    # Make sure the cache file is current
+    if (not isinstance(cached, tuple) or len(cached) != 3 or
+            cached[:2] != (VERSION, tuple(file_stamp))):
+        return None
+
+    return cached[2]
+
+
+def save(cache_dir, fname, file_stamp, data):
+    """
+    Save the parse of a request file to its cache file.  The cache
+    file is replaced atomically, so that a concurrent run never reads
+    a partially written file.
+
+    :param cache_dir: The directory containing the cache files.
+    :param fname: The name of the request file.
+    :param file_stamp: The stamp of the request file the data was
+                       parsed from, as returned by ``stamp()``.
+    :param data: The data to cache; see
+                 ``request.freeze_sequences()``.
+    """
+
+    path = cache_path(cache_dir, fname)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(marshal.dumps((VERSION, tuple(file_stamp), data)))
+    os.rename(tmp_path, path)
@@ -13,14 +13,26 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import multiprocessing
+import re
 import StringIO
 import sys
 import time
 import urllib
 
+from train import reqcache
+from train import stats
+from train import transport
 from train import util
 
 
+# A '#' preceded by whitespace begins an in-line comment
+_COMMENT_RE = re.compile(r'\s#')
+
+# The first whitespace or ':' distinguishes requests from headers
+_TOKEN_RE = re.compile(r'[\s:]')
+
+
 class RequestParseException(Exception):
     """
     Raised when an exception occurs parsing a request file.
@@ -58,16 +70,48 @@ class Sequence(object):
 
         self.requests.append(req)
 
-    def queue_request(self, queue):
+    def queue_request(self, queue, results=None):
         """
         Places all the requests in the sequence onto the designated
-        queue.
+        queue.  Gaps are converted into absolute deadlines, measured
+        from the start of the sequence, so that time spent placing
+        requests onto the queue does not accumulate into the gaps.
 
         :param queue: A queue object.
+        :param results: An optional queue object.  If provided, a
+                        ``stats.ScheduleLag`` of the schedule lag--the
+                        amount by which each request was placed onto
+                        the queue later than scheduled--will be placed
+                        onto this queue once all requests have been
+                        queued.
         """
 
+        queue = transport.shard(queue, self)
+        lag = stats.ScheduleLag()
+        deadline = util.monotonic()
+
         for req in self.requests:
+            if isinstance(req, Gap):
+                deadline += req.delta
+                continue
+
+            # Wait until the request is due, making sure nothing
+            # buffered is held across the gap
+            delay = deadline - util.monotonic()
+            if delay > 0:
+                transport.flush(queue)
+                time.sleep(delay)
+
+            # Note the time the request was actually placed onto the
+            # queue, which may have waited for the rate limit
+            behind = util.monotonic() - deadline
             req.queue_request(queue)
+            lag.record(behind, util.monotonic())
+
+        transport.flush(queue)
+
+        if results is not None:
+            results.put(lag)
 
 
 class Request(object):
@@ -77,7 +121,7 @@ class Request(object):
     that will generate a WSGI environment dictionary.
     """
 
-    def __init__(self, sequence, method, uri):
+    def __init__(self, sequence, method, uri, headers=None):
         """
         Initialize a ``Request`` object.
 
@@ -85,32 +129,43 @@ class Request(object):
                          is a member.
         :param method: The HTTP method.
         :param uri: The URI to be requested.
+        :param headers: The complete headers of the request, as a
+                        dictionary, if they are already known.  By
+                        default, the request inherits the headers of
+                        the sequence.
         """
 
+        self.sequence_name = sequence.name
         self.method = method.upper()
         self.uri = uri
-        self.headers = util.StackedDict(sequence.headers)
+        if headers is None:
+            headers = util.StackedDict(sequence.headers)
+        self.headers = headers
+        self.key = None
+        self.template = None
 
     def fix(self):
         """
         Fixate the headers on the request.  This converts the headers
-        ``StackedDict`` object into a plain dictionary.
+        ``StackedDict`` object into a plain dictionary, and builds the
+        template from which the WSGI environment is synthesized.
         """
 
         self.headers = self.headers.copy()
+        self.template = self._make_template()
 
-    def synthesize(self):
+    def _make_template(self):
         """
-        Synthesize the WSGI environment dictionary, based on the
-        request.
+        Build the parts of the WSGI environment dictionary which are
+        the same each time the request is synthesized.
 
-        :returns: A dictionary containing the WSGI dictionary.
+        :returns: A dictionary containing the WSGI environment, less
+                  ``wsgi.input``.
         """
 
         path_info = self.uri.split('?', 1)
 
-        environ = {
-            'wsgi.input': StringIO.StringIO(''),
+        template = {
             'wsgi.errors': sys.stderr,
             'wsgi.version': (1, 0),
             'wsgi.multithread': True,
@@ -127,37 +182,63 @@ class Request(object):
             'REMOTE_ADDR': 'localhost',
             'REMOTE_PORT': '80',
             'GATEWAY_INTERFACE': 'CGI/1.1',
+            'train.sequence': self.sequence_name,
         }
 
         # Add the query string
         if len(path_info) > 1:
-            environ['QUERY_STRING'] = path_info[1]
+            template['QUERY_STRING'] = path_info[1]
 
         # Determine the content type
         if 'CONTENT_TYPE' in self.headers:
             ctype = self.headers['CONTENT_TYPE'].partition(';')[0].strip()
-            environ['CONTENT_TYPE'] = ctype
+            template['CONTENT_TYPE'] = ctype
         else:
-            environ['CONTENT_TYPE'] = 'text/plain'
+            template['CONTENT_TYPE'] = 'text/plain'
 
         # Determine the content length
         if 'CONTENT_LENGTH' in self.headers:
-            environ['CONTENT_LENGTH'] = self.headers['CONTENT_LENGTH']
+            template['CONTENT_LENGTH'] = self.headers['CONTENT_LENGTH']
 
         # Add all the headers
         for name, value in self.headers.items():
-            environ['HTTP_' + name] = value
+            template['HTTP_' + name] = value
+
+        return template
+
+    def synthesize(self):
+        """
+        Synthesize the WSGI environment dictionary, based on the
+        request.  Once the request has been fixed, this is a copy of
+        the template built by ``fix()``, with a fresh ``wsgi.input``.
+
+        :returns: A dictionary containing the WSGI dictionary.
+        """
+
+        environ = dict(self.template or self._make_template())
+        environ['wsgi.input'] = StringIO.StringIO('')
 
         return environ
 
     def queue_request(self, queue):
         """
-        Places the request onto the designated queue.
+        Places the request onto the designated queue.  If the request
+        has been assigned a key by ``index_sequences()``, only the key
+        is placed onto the queue; otherwise, the full WSGI environment
+        is.  Either is stamped with the time at which it was queued,
+        from ``util.monotonic()``: the key is extended with the time,
+        and the environment includes it as "train.enqueued".
 
         :param queue: A queue object.
         """
 
-        queue.put(self.synthesize())
+        now = util.monotonic()
+        if self.key:
+            queue.put(self.key + (now,))
+        else:
+            environ = self.synthesize()
+            environ['train.enqueued'] = now
+            queue.put(environ)
 
 
 class Gap(object):
@@ -175,16 +256,6 @@ class Gap(object):
 
         self.delta = delta
 
-    def queue_request(self, queue):
-        """
-        Performs a sleep to simulate a time gap in a sequence of
-        requests.
-
-        :param queue: A queue object.
-        """
-
-        time.sleep(self.delta)
-
 
 class PartialHeader(object):
     """
@@ -242,11 +313,20 @@ class RequestParseState(object):
     Represent the state of parsing a request file.
     """
 
-    def __init__(self):
+    def __init__(self, stream=False):
         """
         Initialize a ``RequestParseState`` object.
+
+        :param stream: If ``True``, requests and gaps are not pushed
+                       onto their sequences.  Instead, each is appended
+                       to the ``ready`` list, along with its sequence,
+                       once it is complete; the caller is expected to
+                       consume and clear the list as parsing proceeds.
         """
 
+        # Completed requests and gaps, when streaming
+        self.ready = [] if stream else None
+
         # Base of the headers tree; this contains globally-set headers
         self._headers = util.StackedDict()
 
@@ -314,8 +394,10 @@ class RequestParseState(object):
         # Set up the new request
         self._request = Request(self._sequence, method, uri)
 
-        # Go ahead and add it to the sequence
-        self._sequence.push(self._request)
+        # Go ahead and add it to the sequence; when streaming, it is
+        # made ready once it's complete
+        if self.ready is None:
+            self._sequence.push(self._request)
 
     def finish_request(self, fname):
         """
@@ -326,6 +408,8 @@ class RequestParseState(object):
 
         # Fixate the request headers
         self._request.fix()
+        if self.ready is not None:
+            self.ready.append((self._sequence, self._request))
 
         # Clear the partial request
         self._request = None
@@ -353,7 +437,10 @@ class RequestParseState(object):
             self.finish_request(fname)
 
         # Push the gap onto the sequence
-        self._sequence.push(Gap(delta))
+        if self.ready is not None:
+            self.ready.append((self._sequence, Gap(delta)))
+        else:
+            self._sequence.push(Gap(delta))
 
     def start_header(self, fname, name, value):
         """
@@ -484,6 +571,108 @@ class RequestParseState(object):
         return self._headers
 
 
+def index_sequences(sequences):
+    """
+    Assign each request in a list of sequences a compact key, which
+    will be placed onto the queue in place of the request's WSGI
+    environment.  The key is a tuple of the index of the sequence and
+    the index of the request within the sequence; the table returned
+    by this function may be used to look up the request.  This is only
+    useful if the table is available to the workers, i.e., if the
+    workers are started after this function is called.
+
+    :param sequences: A list of ``Sequence`` objects.
+
+    :returns: A list, parallel to ``sequences``, of the request lists
+              of each sequence.
+    """
+
+    table = []
+    for seq_id, seq in enumerate(sequences):
+        for req_idx, req in enumerate(seq.requests):
+            if isinstance(req, Request):
+                req.key = (seq_id, req_idx)
+        table.append(seq.requests)
+
+    return table
+
+
+def _parse_line(state, fname, line):
+    """
+    Perform the processing of a single line of a request file.
+
+    :param state: A ``RequestParseState`` object containing the parser
+                  state.
+    :param fname: The name of the request file.
+    :param line: The line to process.
+    """
+
+    # Ignore comment lines
+    if line[:1] == '#':
+        return
+
+    # Now strip out in-line comments; the substring test avoids the
+    # regular expression search for the many lines without a '#'
+    if '#' in line:
+        match = _COMMENT_RE.search(line)
+        if match:
+            line = line[:match.start() + 1]
+
+    # We're going to strip the line, but let's check for leading
+    # space, indicating a header continuation
+    header = line[:1].isspace()
+    line = line.strip()
+
+    # If the line is empty after stripping it, let's skip it
+    if not line:
+        return
+
+    # Now let's see what we've got...
+    if header:
+        # It was a header continuation...
+        state.extend_header(fname, line)
+        return
+    elif line[0] == '[':
+        # We have a sequence marker
+        if line[-1] != ']':
+            raise RequestParseException("Invalid sequence header %r "
+                                        "while reading file %s" %
+                                        (line, fname))
+        state.start_sequence(fname, line[1:-1].strip())
+        return
+    elif line[0] == '+':
+        # We have a message gap
+        try:
+            state.push_gap(fname, float(line[1:]))
+        except ValueError:
+            raise RequestParseException("Invalid gap value %r "
+                                        "while reading file %s" %
+                                        (line[1:], fname))
+        return  # Pragma: nocover
+    elif line[0] == '-':
+        # We have a delete header request
+        state.delete_header(fname, line[1:].strip())
+        return
+    elif line[0] == '!':
+        # We have a reset header request
+        state.reset_header(fname, line[1:].strip())
+        return
+
+    # OK, it's either a request or a header...
+    match = _TOKEN_RE.search(line)
+    if not match:
+        raise RequestParseException("Unable to parse line %r while "
+                                    "reading file %s" % (line, fname))
+
+    idx = match.start()
+    if line[idx] == ':':
+        # We have a header!
+        state.start_header(fname, line[:idx], line[idx + 1:].strip())
+    else:
+        # We have a request!
+        state.start_request(fname, line[:idx], line[idx:].strip())
+
+
 def _parse_file(state, fname):
     """
     Perform the processing of a request file.
@@ -495,87 +684,217 @@ def _parse_file(state, fname):
 
     with open(fname) as f:
         for line in f:
-            # Ignore comment lines
-            if line[:1] == '#':
-                continue
+            _parse_line(state, fname, line)
 
-            # Now strip out in-line comments...
-            for idx, char in enumerate(line):
-                # idx is guaranteed to be > 1 here because we've
-                # handled the case of '#' in column 0 above
-                if char == '#' and line[idx - 1].isspace():
-                    line = line[:idx]
-                    break
-
-            # We're going to strip the line, but let's check for
-            # leading space, indicating a header continuation
-            header = line[:1].isspace()
-            line = line.strip()
-
-            # If the line is empty after stripping it, let's skip it
-            if not line:
-                continue
+    # Finished processing this file
+    state.finish(fname)
 
-            # Now let's see what we've got...
-            if header:
-                # It was a header continuation...
-                state.extend_header(fname, line)
-                continue
-            elif line[0] == '[':
-                # We have a sequence marker
-                if line[-1] != ']':
-                    raise RequestParseException("Invalid sequence header %r "
-                                                "while reading file %s" %
-                                                (line, fname))
-                state.start_sequence(fname, line[1:-1].strip())
-                continue
-            elif line[0] == '+':
-                # We have a message gap
-                try:
-                    state.push_gap(fname, float(line[1:]))
-                except ValueError:
-                    raise RequestParseException("Invalid gap value %r "
-                                                "while reading file %s" %
-                                                (line[1:], fname))
-                continue  # Pragma: nocover
-            elif line[0] == '-':
-                # We have a delete header request
-                state.delete_header(fname, line[1:].strip())
-                continue
-            elif line[0] == '!':
-                # We have a reset header request
-                state.reset_header(fname, line[1:].strip())
-                continue
 
-            # OK, it's either a request or a header...
-            for idx, char in enumerate(line):
-                if char.isspace():
-                    # We have a request!
-                    state.start_request(fname, line[:idx], line[idx:].strip())
-                    break
-                elif char == ':':
-                    # We have a header!
-                    state.start_header(fname, line[:idx],
-                                       line[idx + 1:].strip())
-                    break
-            else:
-                raise RequestParseException("Unable to parse line %r "
-                                            "while reading file %s" %
-                                            (line, fname))
+def iter_file(state, fname):
+    """
+    Process a request file incrementally.  This is a generator; each
+    request and gap is yielded as soon as it is complete, so that
+    the requests may be dispatched while the rest of the file is
+    being read.
+
+    :param state: A ``RequestParseState`` object containing the parser
+                  state; it must have been created with
+                  ``stream=True``.
+    :param fname: The name of the request file.
+
+    :returns: An iterator of tuples of the ``Sequence`` object and the
+              ``Request`` or ``Gap`` object.
+    """
+
+    ready = state.ready
+    with open(fname) as f:
+        for line in f:
+            _parse_line(state, fname, line)
+            if ready:
+                for item in ready:
+                    yield item
+                del ready[:]
 
     # Finished processing this file
     state.finish(fname)
+    for item in ready:
+        yield item
+    del ready[:]
+
+
+def iter_files(fnames):
+    """
+    Process a list of request files incrementally.  The sequences are
+    not retained; only the requests and gaps not yet consumed are
+    held in memory.
+
+    :param fnames: A list of file names to parse.
+
+    :returns: An iterator of tuples of the ``Sequence`` object and the
+              ``Request`` or ``Gap`` object.
+    """
+
+    state = RequestParseState(stream=True)
+
+    for fname in fnames:
+        for item in iter_file(state, fname):
+            yield item
+
+
+def freeze_sequences(sequences):
+    """
+    Convert a list of sequences into plain data, suitable for
+    serializing with ``marshal``.  Requests must have been fixed.
+
+    :param sequences: A list of ``Sequence`` objects.
+
+    :returns: A list of tuples of the name of each sequence and a list
+              of its requests and gaps.  Each request is represented
+              by a tuple of the method, the URI, and the dictionary of
+              headers; each gap is represented by its time delta.
+    """
+
+    data = []
+    for seq in sequences:
+        items = []
+        for req in seq.requests:
+            if isinstance(req, Gap):
+                items.append(req.delta)
+            else:
+                # Header names and values are mostly shared between
+                # requests; interned strings are written only once
+                headers = dict((intern(name), intern(value))
+                               for name, value in req.headers.items())
+                items.append((intern(req.method), req.uri, headers))
+        data.append((seq.name, items))
+
+    return data
+
+
+def thaw_sequences(sequences, data):
+    """
+    Add the requests and gaps described by data produced by
+    ``freeze_sequences()`` to a set of sequences.
+
+    :param sequences: A dictionary mapping sequence names to
+                      ``Sequence`` objects.  Sequences which do not
+                      exist are created and added to it.
+    :param data: The data produced by ``freeze_sequences()``.
+    """
 
+    for name, items in data:
+        if name not in sequences:
+            sequences[name] = Sequence(name, {})
+        seq = sequences[name]
 
-def parse_files(fnames):
+        for item in items:
+            if isinstance(item, tuple):
+                req = Request(seq, item[0], item[1], item[2])
+                req.fix()
+                seq.push(req)
+            else:
+                seq.push(Gap(item))
+
+
+def _parse_cached(fname, cache_dir, rebuild=False):
+    """
+    Parse a request file, using its cached parse if it is current.
+    Otherwise, the file is parsed, and the result is cached.
+
+    :param fname: The name of the request file.
+    :param cache_dir: The directory containing the cache files.
+    :param rebuild: If ``True``, the file is parsed and its cache file
+                    rewritten even if the cache file is current.
+
+    :returns: The parsed requests, as produced by
+              ``freeze_sequences()``.
+    """
+
+    file_stamp = reqcache.stamp(fname)
+    data = None if rebuild else reqcache.load(cache_dir, fname, file_stamp)
+    if data is None:
+        data = _parse_frozen(fname)
+        reqcache.save(cache_dir, fname, file_stamp, data)
+
+    return data
+
+
+def _parse_frozen(fname):
+    """
+    Parse a single request file on its own.  Each file's headers
+    start afresh, so parsing a file with a fresh state yields the
+    same requests as parsing it after other files.
+
+    :param fname: The name of the request file.
+
+    :returns: The parsed requests, as produced by
+              ``freeze_sequences()``.
+    """
+
+    state = RequestParseState()
+    _parse_file(state, fname)
+    return freeze_sequences(state.sequences)
+
+
+def _parse_task(args):
+    """
+    Parse a request file in a pool worker.
+
+    :param args: A tuple of the name of the request file, the cache
+                 directory (or ``None``), and the rebuild flag.
+
+    :returns: The parsed requests, as produced by
+              ``freeze_sequences()``.
+    """
+
+    fname, cache_dir, rebuild = args
+    if cache_dir:
+        return _parse_cached(fname, cache_dir, rebuild)
+    return _parse_frozen(fname)
+
+
+def parse_files(fnames, cache_dir=None, rebuild=False, jobs=1):
     """
     Parses a list of request files.
 
     :param fnames: A list of file names to parse.
+    :param cache_dir: If provided, the name of a directory in which
+                      to cache the parsed requests.  Each file is
+                      only parsed if its cache file is missing or out
+                      of date; see ``reqcache.load()``.
+    :param rebuild: If ``True``, all the files are parsed and their
+                    cache files rewritten.
+    :param jobs: The number of processes to parse the files with.  If
+                 greater than 1, the files are parsed concurrently in
+                 a process pool, and the requests from each file are
+                 then added to the sequences in the order the files
+                 were given, so the result is the same as parsing the
+                 files one after another.
 
     :returns: A list of the sequences that were loaded from the files.
     """
 
+    if jobs > 1 and len(fnames) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(fnames)))
+        try:
+            # map() returns the results in the order of fnames
+            results = pool.map(_parse_task, [(fname, cache_dir, rebuild)
+                                             for fname in fnames])
+        finally:
+            pool.terminate()
+            pool.join()
+    elif cache_dir:
+        results = (_parse_cached(fname, cache_dir, rebuild)
+                   for fname in fnames)
+    else:
+        results = None
+
+    if results is not None:
+        sequences = {}
+        for data in results:
+            thaw_sequences(sequences, data)
+        return sequences.values()
+
     state = RequestParseState()
 
     for fname in fnames:
@@ -19,6 +19,7 @@ import logging
 import logging.config
 import multiprocessing
 import os
+import Queue
 import signal
 import sys
 import time
@@ -26,6 +27,134 @@ import time
 import cli_tools
 
 
+def _to_bool(value):
+    """
+    Convert a configuration value to a boolean.
+
+    :param value: The value to convert.
+
+    :returns: ``True`` if the value is one of "true", "yes", "on", or
+              "1"; ``False`` if it is one of "false", "no", "off", or
+              "0".  The comparison is case-insensitive.  Other values
+              result in a ``ValueError``.
+    """
+
+    value = value.lower()
+    if value in ('true', 'yes', 'on', '1'):
+        return True
+    elif value in ('false', 'no', 'off', '0'):
+        return False
+    raise ValueError("Invalid boolean value %r" % value)
+
+
+def _get_option(train_conf, option, default, conv=str):
+    """
+    Retrieve an option from the "[train]" section of the
+    configuration.
+
+    :param train_conf: A dictionary of the options in the "[train]"
+                       section.
+    :param option: The name of the option to retrieve.
+    :param default: The value to return if the option is not set or
+                    its value cannot be converted.
+    :param conv: A callable to convert the option value.  Defaults to
+                 ``str``.
+
+    :returns: The converted option value.
+    """
+
+    try:
+        return conv(train_conf[option])
+    except (KeyError, ValueError):
+        return default
+
+
+def _largest_ring_item(batch_size, sharded):
+    """
+    Construct the largest item the feeders may place onto a ring
+    transport with indexed requests, so that the ring slots can be
+    sized to hold it.
+
+    :param batch_size: The maximum number of requests in a batch.
+    :param sharded: If ``True``, each request is tagged with the index
+                    of its sequence.
+
+    :returns: The item.
+    """
+
+    # Build distinct tuples, so that pickle cannot share them
+    items = []
+    for i in range(batch_size):
+        item = (2 ** 32 - 1, 2 ** 32 - 1 - i, time.time())
+        if sharded:
+            item = (2 ** 32 - 1, item)
+        items.append(item)
+
+    return items[0] if batch_size <= 1 else items
+
+
+def _get_result(results, procs, servers, exited, timeout=1.0):
+    """
+    Retrieve an item from the results queue.  While waiting for it,
+    the feeders and workers are periodically checked, so that a
+    process which dies before reporting does not leave the run
+    waiting forever.  If one has failed, the remaining processes are
+    terminated and an exception is raised.
+
+    :param results: The results queue.
+    :param procs: A list of the feeder ``multiprocessing.Process``
+                  objects.
+    :param servers: A list of the process IDs of the workers.
+    :param exited: A set of the process IDs of the workers which
+                   have exited and been reaped.  Workers found to
+                   have exited are added to it.
+    :param timeout: The interval, in seconds, at which the processes
+                    are checked.
+
+    :returns: The item.
+    """
+
+    while True:
+        try:
+            return results.get(timeout=timeout)
+        except Queue.Empty:
+            pass
+
+        error = None
+        for proc in procs:
+            if proc.exitcode:
+                error = ("Feeder process %d exited with status %d" %
+                         (proc.pid, proc.exitcode))
+                break
+        for server in servers:
+            if error or server in exited:
+                continue
+            pid, status = os.waitpid(server, os.WNOHANG)
+            if not pid:
+                continue
+            exited.add(server)
+            if os.WIFSIGNALED(status):
+                error = ("Worker process %d was killed by signal %d" %
+                         (server, os.WTERMSIG(status)))
+            elif os.WEXITSTATUS(status):
+                error = ("Worker process %d exited with status %d" %
+                         (server, os.WEXITSTATUS(status)))
+
+        if error:
+            # The remaining feeders would otherwise keep the
+            # interpreter from exiting
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+            for server in servers:
+                if server not in exited:
+                    try:
+                        os.kill(server, signal.SIGTERM)
+                    except OSError:
+                        pass
+            raise Exception(error)
+
+
 @cli_tools.argument("config",
                     action="store",
                     help="Configuration for Train (and Turnstile).")
@@ -43,7 +172,157 @@ import cli_tools
                     action="store",
                     help="Name of a logging configuration.  Default is drawn "
                     "from the configuration file, if one is provided.")
-def train(config, requests=None, workers=1, log_config=None):
+@cli_tools.argument("--schedule", "-s",
+                    action="store",
+                    choices=('process', 'heap'),
+                    help="How the request sequences are fed.  With "
+                    "'process', each sequence is fed by its own process; "
+                    "with 'heap', all sequences are driven from a fixed "
+                    "number of feeder processes.  Default is drawn from the "
+                    "configuration file, or 'process' if none is provided.")
+@cli_tools.argument("--feeders", "-f",
+                    action="store",
+                    type=int,
+                    help="Number of feeder processes to use with the 'heap' "
+                    "schedule.  Default is drawn from the configuration "
+                    "file, or 1 if none is provided.")
+@cli_tools.argument("--rate", "-r",
+                    action="store",
+                    type=float,
+                    help="Target rate, in requests per second, at which to "
+                    "dispatch requests.  Default is drawn from the "
+                    "configuration file; if none is provided, requests are "
+                    "dispatched as fast as possible.")
+@cli_tools.argument("--indexed", "-i",
+                    action="store_const",
+                    const=True,
+                    help="Send only request keys to the workers, rather than "
+                    "full WSGI environments; the workers look the requests "
+                    "up in their copy of the request table.  Default is "
+                    "drawn from the configuration file, or disabled if none "
+                    "is provided.")
+@cli_tools.argument("--batch-size", "-b",
+                    action="store",
+                    type=int,
+                    help="Maximum number of requests to send to the workers "
+                    "in a single batch.  Default is drawn from the "
+                    "configuration file, or 1 (no batching) if none is "
+                    "provided.")
+@cli_tools.argument("--batch-time", "-B",
+                    action="store",
+                    type=int,
+                    help="Maximum time, in microseconds, a request may be "
+                    "held while a batch is filled.  Default is drawn from "
+                    "the configuration file, or 1000 if none is provided.")
+@cli_tools.argument("--sharded", "-S",
+                    action="store_const",
+                    const=True,
+                    help="Give each worker its own queue.  Each sequence is "
+                    "assigned to a worker, so its requests are processed in "
+                    "order; idle workers take over sequences from busy "
+                    "ones.  Default is drawn from the configuration file, or "
+                    "disabled if none is provided.")
+@cli_tools.argument("--app", "-a",
+                    action="store",
+                    choices=('empty', 'static', 'debug'),
+                    help="What the fake application behind Turnstile "
+                    "returns.  With 'empty', the response body is empty; "
+                    "with 'static', it is a fixed-size body (see the "
+                    "'body_size' configuration option); with 'debug', it is "
+                    "the pretty-printed WSGI environment.  Default is drawn "
+                    "from the configuration file, or 'debug' if none is "
+                    "provided.")
+@cli_tools.argument("--service-time", "-t",
+                    action="store",
+                    type=float,
+                    help="Time, in milliseconds, the fake application takes "
+                    "to process a request; see the 'service_dist' "
+                    "configuration option.  Default is drawn from the "
+                    "configuration file; if none is provided, requests are "
+                    "processed immediately.")
+@cli_tools.argument("--report", "-R",
+                    action="store",
+                    help="Name of a file to write a summary of the run to.  "
+                    "The summary is written as CSV if the file name ends "
+                    "with '.csv', and as JSON otherwise.  Default is drawn "
+                    "from the configuration file, if one is provided.")
+@cli_tools.argument("--progress", "-P",
+                    action="store_const",
+                    const=True,
+                    help="Print a line once per second describing the "
+                    "progress of the run: the rate of completed requests, "
+                    "the request counters, the queue depth, and the 99th "
+                    "percentile latency.  Default is drawn from the "
+                    "configuration file, or disabled if none is provided.")
+@cli_tools.argument("--profile", "-p",
+                    action="store",
+                    help="Name of a directory in which to profile the "
+                    "workers.  Each worker runs under cProfile and writes "
+                    "its statistics to this directory when it exits; the "
+                    "statistics are then merged into 'merged.pstats', and a "
+                    "report of the functions taking the most time is written "
+                    "to 'report.txt'.  Default is drawn from the "
+                    "configuration file, if one is provided.")
+@cli_tools.argument("--sample", "-F",
+                    action="store",
+                    type=float,
+                    help="Profile the workers with a sampling profiler, "
+                    "taking this many samples per second of CPU time, "
+                    "rather than with cProfile.  Each worker writes its "
+                    "stacks in the collapsed format used by flame graph "
+                    "tools, and they are merged into 'merged.collapsed'.  "
+                    "Requires --profile.  Default is drawn from the "
+                    "configuration file, if one is provided.")
+@cli_tools.argument("--redis-stats", "-C",
+                    action="store_const",
+                    const=True,
+                    help="Count and time the Redis commands Turnstile issues "
+                    "for each request, and report the number of commands "
+                    "and round trips per request, the use of pipelines, and "
+                    "the latency of each command.  Default is drawn from "
+                    "the configuration file, or disabled if none is "
+                    "provided.")
+@cli_tools.argument("--parse-cache", "-c",
+                    action="store",
+                    help="Name of a directory in which to cache the parsed "
+                    "request files.  A request file is only parsed if its "
+                    "cache file is missing, or if the request file's "
+                    "modification time or contents have changed since the "
+                    "cache file was written.  Default is drawn from the "
+                    "configuration file, if one is provided.")
+@cli_tools.argument("--rebuild-cache", "-X",
+                    action="store_const",
+                    const=True,
+                    help="Parse all the request files and rewrite their "
+                    "cache files, even if they are current, then exit "
+                    "without running the benchmark.  Requires "
+                    "--parse-cache.")
+@cli_tools.argument("--parse-jobs", "-j",
+                    action="store",
+                    type=int,
+                    help="Number of processes with which to parse the "
+                    "request files.  The files are parsed concurrently, and "
+                    "their requests are merged in the order the files were "
+                    "given.  Default is drawn from the configuration file, "
+                    "or 1 if none is provided.")
+@cli_tools.argument("--stream", "-T",
+                    action="store_const",
+                    const=True,
+                    help="Feed the requests while the request files are "
+                    "being read, from a single feeder process, rather than "
+                    "parsing all the files first.  Only a limited number of "
+                    "requests are read ahead (see the 'stream_lookahead' "
+                    "configuration option), so memory use does not grow "
+                    "with the size of the files.  Cannot be combined with "
+                    "--indexed or --sharded, and does not use the parse "
+                    "cache.  Default is drawn from the configuration file, "
+                    "or disabled if none is provided.")
+def train(config, requests=None, workers=1, log_config=None, schedule=None,
+          feeders=None, rate=None, indexed=None, batch_size=None,
+          batch_time=None, sharded=None, app=None, service_time=None,
+          report=None, progress=None, profile=None, sample=None,
+          redis_stats=None, parse_cache=None, rebuild_cache=None,
+          parse_jobs=None, stream=None):
     """
     Run the Train benchmark tool.
 
@@ -51,6 +330,40 @@ def train(config, requests=None, workers=1, log_config=None):
     :param requests: A list of one or more request files to read.
     :param workers: The number of workers to use.
     :param log_config: The name of a logging configuration file.
+    :param schedule: The feeding strategy; either "process" or "heap".
+    :param feeders: The number of feeder processes to use with the
+                    "heap" schedule.
+    :param rate: The target rate, in requests per second.
+    :param indexed: If ``True``, only request keys are placed on the
+                    queue, rather than full WSGI environments.
+    :param batch_size: The maximum number of requests in a batch.
+    :param batch_time: The maximum time, in microseconds, a request
+                       may be held while a batch is filled.
+    :param sharded: If ``True``, each worker is given its own queue.
+    :param app: The fake application mode; one of "empty", "static",
+                or "debug".
+    :param service_time: The time, in milliseconds, the fake
+                         application takes to process a request.
+    :param report: The name of a file to write a summary of the run
+                   to, as CSV or JSON.
+    :param progress: If ``True``, a progress line is printed once
+                     per second during the run.
+    :param profile: The name of a directory in which to profile the
+                    workers.
+    :param sample: The sampling rate, in samples per second, of the
+                   sampling profiler.  If not provided, the workers
+                   are profiled with ``cProfile``.
+    :param redis_stats: If ``True``, the Redis commands issued by
+                        Turnstile are counted and timed.
+    :param parse_cache: The name of a directory in which to cache the
+                        parsed request files.
+    :param rebuild_cache: If ``True``, the cache files are rewritten
+                          even if they are current, and the benchmark
+                          is not run.
+    :param parse_jobs: The number of processes with which to parse
+                       the request files.
+    :param stream: If ``True``, the requests are fed while the request
+                   files are being read.
     """
 
     # If we're using nova_limits, that relies on _ being declared,
@@ -93,7 +406,13 @@ def train(config, requests=None, workers=1, log_config=None):
     # modules; this has to wait until now, because each starts off
     # with a "LOG = logging.getLogger(__name__)", and that logger will
     # not reflect the configuration that was set up above
+    from train import asynclog
+    from train import profiling
+    from train import progress as progress_mod
     from train import request
+    from train import scheduler
+    from train import stats
+    from train import transport
     from train import wsgi
 
     # Determine the number of workers to employ
@@ -118,45 +437,352 @@ def train(config, requests=None, workers=1, log_config=None):
     if not requests:
         raise Exception("No requests to feed through Turnstile")
 
-    # Now, we need the sequences
-    sequences = request.parse_files(requests)
+    # Grab the remaining train options from the configuration
+    try:
+        train_conf = dict(conf.items('train'))
+    except ConfigParser.NoSectionError:
+        train_conf = {}
 
-    # Set up the queue
-    queue = multiprocessing.Queue()
+    # Determine how the sequences will be fed
+    if not schedule:
+        schedule = train_conf.get('schedule', 'process')
+    if schedule not in ('process', 'heap'):
+        raise Exception("Unknown schedule %r" % schedule)
+    if not feeders:
+        feeders = _get_option(train_conf, 'feeders', 1, int)
 
-    # Start the workers
-    servers = wsgi.start_workers(queue, conf.items('turnstile'), workers)
+    # Determine the target rate
+    if not rate:
+        rate = _get_option(train_conf, 'rate', None, float)
 
-    # And now we start feeding in the requests
-    procs = []
-    for seq in sequences:
-        proc = multiprocessing.Process(target=seq.queue_request, args=(queue,))
-        proc.start()
-        procs.append(proc)
+    # Determine whether to send request keys rather than environments
+    if indexed is None:
+        indexed = _get_option(train_conf, 'indexed', False, _to_bool)
 
-    # Wait for all the sequence feeders to shut down, which they'll do
-    # as soon as they've finished submitting all the requests
-    for proc in procs:
-        proc.join()
+    # Determine the transport between the feeders and the workers
+    transport_type = train_conf.get('transport', 'queue')
+    if transport_type not in ('queue', 'ring'):
+        raise Exception("Unknown transport %r" % transport_type)
 
-    # Ask all the servers to exit, nicely
-    for server in servers:
-        queue.put('STOP')
+    # Determine whether each worker gets its own queue
+    if sharded is None:
+        sharded = _get_option(train_conf, 'sharded', False, _to_bool)
 
-    # The sequence processes will not actually exit until all items
-    # fed by them into the queue have been pulled off.  Thus, the
-    # queue should be empty...but let's be sure
-    while not queue.empty():
-        time.sleep(1)
+    # Determine the batching parameters
+    if not batch_size:
+        batch_size = _get_option(train_conf, 'batch_size', 1, int)
+    if not batch_time:
+        batch_time = _get_option(train_conf, 'batch_time', 1000, int)
 
-    # Now let's give the processes a little time to finish doing their
-    # thing...
-    time.sleep(1)
+    # Determine whether to stream the requests from the files
+    if stream is None:
+        stream = _get_option(train_conf, 'stream', False, _to_bool)
+    if stream and indexed:
+        raise Exception("Streaming cannot be combined with indexed requests")
+    if stream and sharded:
+        raise Exception("Streaming cannot be combined with sharded queues")
+    if transport_type == 'ring' and not indexed:
+        # Request environments do not fit in the ring's fixed-size
+        # slots
+        raise Exception("The ring transport requires indexed requests")
 
-    # OK, now make sure *all* the drivers exit
-    for server in servers:
-        try:
-            os.kill(server, signal.SIGTERM)
-        except OSError:
-            # That server's already stopped
-            pass
+    # Determine whether to cache the parsed request files
+    parse_opts = {}
+    if not parse_cache:
+        parse_cache = train_conf.get('parse_cache')
+    if rebuild_cache and not parse_cache:
+        raise Exception("Rebuilding the cache requires a cache directory")
+    if parse_cache:
+        if not os.path.isdir(parse_cache):
+            os.makedirs(parse_cache)
+        parse_opts['cache_dir'] = parse_cache
+        if rebuild_cache:
+            parse_opts['rebuild'] = True
+
+    # Determine how many processes to parse the files with
+    if not parse_jobs:
+        parse_jobs = _get_option(train_conf, 'parse_jobs', 1, int)
+    if parse_jobs > 1:
+        parse_opts['jobs'] = parse_jobs
+
+    # If we're only rebuilding the cache, we're done once the files
+    # have been parsed
+    if rebuild_cache:
+        request.parse_files(requests, **parse_opts)
+        print("Rebuilt the parse cache for %d request files in %s" %
+              (len(requests), parse_cache))
+        return
+
+    # Now, we need the sequences; when streaming, they're read as
+    # the requests are fed
+    if stream:
+        sequences = []
+    else:
+        sequences = request.parse_files(requests, **parse_opts)
+
+    # Options for the servers
+    server_opts = {}
+
+    # Determine how the fake application behaves
+    if not app:
+        app = train_conf.get('app')
+    if app:
+        if app not in wsgi.TrainServer.app_modes:
+            raise Exception("Unknown app mode %r" % app)
+        server_opts['app_mode'] = app
+    if 'body_size' in train_conf:
+        server_opts['body_size'] = _get_option(train_conf, 'body_size', 0,
+                                               int)
+    if 'body_limit' in train_conf:
+        server_opts['body_limit'] = _get_option(train_conf, 'body_limit',
+                                                None, int)
+    if not service_time:
+        service_time = _get_option(train_conf, 'service_time', None, float)
+    if service_time:
+        service_dist = train_conf.get('service_dist', 'fixed')
+        if service_dist not in wsgi.TrainServer.service_dists:
+            raise Exception("Unknown service time distribution %r" %
+                            service_dist)
+        server_opts['service_time'] = service_time / 1000.0
+        server_opts['service_dist'] = service_dist
+
+    # Determine how the workers log the requests
+    if 'log_format' in train_conf:
+        if train_conf['log_format'] not in wsgi.TrainServer.log_formats:
+            raise Exception("Unknown log format %r" %
+                            train_conf['log_format'])
+        server_opts['log_format'] = train_conf['log_format']
+    if 'log_sample' in train_conf:
+        server_opts['log_sample'] = _get_option(train_conf, 'log_sample',
+                                                1.0, float)
+    if server_opts.get('log_format') == 'json':
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(asynclog.JSONFormatter())
+
+    # Count the requests processed in shared memory, for the ticker;
+    # this must be done before the workers are started
+    if progress is None:
+        progress = _get_option(train_conf, 'progress', False, _to_bool)
+    if progress:
+        server_opts['progress'] = progress_mod.Progress(workers)
+
+    # Cap the number of distinct URIs in the report, if desired
+    report_uris = _get_option(train_conf, 'report_uris', None, int)
+    if report_uris is not None:
+        server_opts['report_uris'] = report_uris
+
+    # Instrument Turnstile's Redis client, if desired
+    if redis_stats is None:
+        redis_stats = _get_option(train_conf, 'redis_stats', False, _to_bool)
+    if redis_stats:
+        server_opts['redis_stats'] = True
+
+    # Profile the workers, if desired
+    if not profile:
+        profile = train_conf.get('profile')
+    if not sample:
+        sample = _get_option(train_conf, 'sample_rate', None, float)
+    if sample and not profile:
+        raise Exception("Sampling requires a profile directory")
+    if profile:
+        if not os.path.isdir(profile):
+            os.makedirs(profile)
+        server_opts['profile_dir'] = profile
+        if sample:
+            server_opts['sample_rate'] = sample
+
+    # Index the requests; the table must be built before the workers
+    # are started so that they have a copy of it
+    if indexed:
+        server_opts['table'] = request.index_sequences(sequences)
+
+    # Set up the queue, and a queue for the feeders to report their
+    # results on
+    if transport_type == 'ring':
+        # The slots must hold the largest batch of request keys
+        needed = transport.RingQueue.record_size(
+            _largest_ring_item(batch_size, sharded))
+        slot_size = _get_option(train_conf, 'ring_slot_size',
+                                max(512, needed), int)
+        if slot_size < needed:
+            raise Exception("Ring slots of %d bytes cannot hold a batch of "
+                            "%d requests; at least %d bytes are needed" %
+                            (slot_size, batch_size, needed))
+
+        def make_queue():
+            return transport.RingQueue(
+                _get_option(train_conf, 'ring_slots', 16384, int),
+                slot_size)
+    else:
+        make_queue = multiprocessing.Queue
+    if sharded:
+        # Requests are batched per worker
+        queue = transport.ShardedQueue(
+            [make_queue() for i in range(workers)], sequences,
+            batch_size, batch_time / 1000000.0)
+    else:
+        queue = make_queue()
+    results = multiprocessing.Queue()
+
+    # Hand log records off to a background writer, if desired; this
+    # must be done before the workers are started
+    listener = None
+    if _get_option(train_conf, 'log_async', False, _to_bool):
+        listener = asynclog.install(multiprocessing.Queue())
+
+    try:
+        # The workers report the time taken to process each request on
+        # the results queue once they've been stopped
+        server_opts['results'] = results
+
+        # Start the workers
+        servers = wsgi.start_workers(queue, conf.items('turnstile'), workers,
+                                     **server_opts)
+
+        # Coalesce the requests into batches, if desired
+        feed_queue = queue
+        if batch_size > 1 and not sharded:
+            feed_queue = transport.BatchingQueue(queue, batch_size,
+                                                 batch_time / 1000000.0)
+
+        # Select the feeders; with the heap schedule, a fixed number of
+        # processes drive all the sequences, and when streaming, a single
+        # process drives them all as it reads the files
+        if stream:
+            feeds = [scheduler.StreamScheduler(
+                requests, rate,
+                _get_option(train_conf, 'stream_lookahead', 1000, int))]
+        elif schedule == 'heap':
+            feeds = scheduler.partition(sequences, feeders, rate)
+        else:
+            feeds = sequences
+
+            # The sequences draw on a single budget, so the rate is
+            # not lost as they finish
+            if rate and feeds:
+                feed_queue = scheduler.PacedQueue(
+                    feed_queue, scheduler.SharedTokenBucket(rate))
+
+        # Report the progress of the run while it's going
+        ticker = None
+        if progress:
+            ticker = progress_mod.Ticker(server_opts['progress'], queue)
+            ticker.start()
+
+        # And now we start feeding in the requests
+        start = time.time()
+        procs = []
+        for feed in feeds:
+            proc = multiprocessing.Process(target=feed.queue_request,
+                                           args=(feed_queue, results))
+            proc.start()
+            procs.append(proc)
+
+        # Collect the schedule lag from each feeder; they report it once
+        # they've finished submitting all the requests
+        lag = stats.ScheduleLag()
+        exited = set()
+        for proc in procs:
+            lag.merge(_get_result(results, procs, servers, exited))
+
+        # Wait for all the sequence feeders to shut down
+        for proc in procs:
+            proc.join()
+
+        # Report how close we came to the target rate; this is
+        # measured from the first request placed onto the queue to the
+        # last, so gaps before or after them don't count against it
+        if rate:
+            achieved = lag.rate or 0.0
+            print("Target rate %.1f req/s; achieved %.1f req/s from first "
+                  "to last dispatch (%.1f%% short)" %
+                  (rate, achieved, max(0.0, 100.0 * (rate - achieved) / rate)))
+        print("Schedule lag: %s" % lag.summary())
+
+        # Ask all the servers to exit, nicely
+        for server in servers:
+            queue.put('STOP')
+
+        # Collect the report from each worker, which sends it once it
+        # has processed all the requests ahead of the STOP
+        summary = stats.Report(report_uris)
+        for server in servers:
+            summary.merge(_get_result(results, procs, servers, exited))
+        elapsed = time.time() - start
+        if ticker is not None:
+            ticker.stop()
+        latency = summary.total.latency
+        print("Request latency: %s" % latency.summary())
+        for phase in stats.PHASES:
+            histogram = summary.phases[phase]
+            if histogram.count:
+                print("  Time in %s: %s" % (phase, histogram.summary()))
+        print("Throughput: %d requests in %.3fs (%.1f req/s)" %
+              (latency.count, elapsed,
+               latency.count / elapsed if elapsed > 0 else 0.0))
+        if summary.outcomes.count:
+            for line in summary.outcomes.summary():
+                print(line)
+        if summary.commands.requests:
+            for line in summary.commands.summary():
+                print(line)
+
+        # Write out the report
+        if not report:
+            report = train_conf.get('report')
+        if report:
+            with open(report, 'w') as f:
+                if report.endswith('.csv'):
+                    summary.write_csv(f, elapsed)
+                else:
+                    summary.write_json(f, elapsed)
+
+        # Merge the workers' profiles; each writes its statistics once
+        # it has stopped, so wait for them to exit first
+        if profile:
+            for server in servers:
+                if server not in exited:
+                    os.waitpid(server, 0)
+            if sample:
+                paths = [profiling.worker_path(profile, i, 'collapsed')
+                         for i in range(len(servers))]
+                report_file = os.path.join(profile, 'merged.collapsed')
+                profiling.merge_collapsed(paths, report_file)
+            else:
+                paths = [profiling.worker_path(profile, i)
+                         for i in range(len(servers))]
+                report_file = os.path.join(profile, 'report.txt')
+                with open(report_file, 'w') as f:
+                    profiling.merge(
+                        paths, f, train_conf.get('profile_sort', 'cumulative'),
+                        _get_option(train_conf, 'profile_limit', 40, int),
+                        os.path.join(profile, 'merged.pstats'))
+            print("Profile report: %s" % report_file)
+
+            # The workers have all exited, and must not be signaled
+            servers = []
+
+        # The sequence processes will not actually exit until all items
+        # fed by them into the queue have been pulled off.  Thus, the
+        # queue should be empty...but let's be sure
+        while not queue.empty():
+            time.sleep(1)
+
+        # Now let's give the processes a little time to finish doing their
+        # thing...
+        time.sleep(1)
+
+        # OK, now make sure *all* the drivers exit
+        for server in servers:
+            if server in exited:
+                # Already reaped; the process ID may have been reused
+                continue
+            try:
+                os.kill(server, signal.SIGTERM)
+            except OSError:
+                # That server's already stopped
+                pass
+    finally:
+        # Write out any remaining log records, even if the run failed
+        if listener:
+            listener.stop()
@@ -0,0 +1,473 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import heapq
+import itertools
+import multiprocessing
+import time
+
+from train import request
+from train import stats
+from train import transport
+from train import util
+
+
+class TokenBucket(object):
+    """
+    A token bucket, used to pace the dispatch of requests to a target
+    rate.  Tokens accumulate at the configured rate, up to the burst
+    size; each dispatch consumes a token, sleeping until one is
+    available if necessary.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Initialize a ``TokenBucket`` object.
+
+        :param rate: The target rate, in tokens per second.
+        :param burst: The maximum number of tokens which may
+                      accumulate.  Defaults to 10 milliseconds' worth
+                      of tokens, but no fewer than 1; this absorbs the
+                      jitter inherent in ``time.sleep()``.
+        """
+
+        self.rate = float(rate)
+        self.burst = burst or max(1.0, self.rate / 100.0)
+        self.tokens = 1.0
+        self.last = None
+
+    def consume(self, before_sleep=None):
+        """
+        Consume a token from the bucket, sleeping until one is
+        available if necessary.
+
+        :param before_sleep: An optional callable, which will be
+                             called if it is necessary to sleep.
+        """
+
+        # Refill the bucket
+        now = util.monotonic()
+        if self.last is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        # Wait for a token to become available
+        if self.tokens < 1.0:
+            delay = (1.0 - self.tokens) / self.rate
+            if before_sleep:
+                before_sleep()
+            time.sleep(delay)
+            self.last += delay
+            self.tokens = 1.0
+
+        self.tokens -= 1.0
+
+
+class SharedTokenBucket(object):
+    """
+    A token bucket whose state is kept in shared memory, so that
+    several feeder processes draw on a single budget; when some of
+    them finish, the others may use the whole rate.  The bucket must
+    be created before the processes which use it are forked.  A
+    process which must wait for a token reserves it before sleeping,
+    so the lock is never held across the sleep.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Initialize a ``SharedTokenBucket`` object.
+
+        :param rate: The target rate, in tokens per second.
+        :param burst: The maximum number of tokens which may
+                      accumulate.  Defaults to 10 milliseconds' worth
+                      of tokens, but no fewer than 1.
+        """
+
+        self.rate = float(rate)
+        self.burst = burst or max(1.0, self.rate / 100.0)
+        self._tokens = multiprocessing.RawValue('d', 1.0)
+        self._last = multiprocessing.RawValue('d', util.monotonic())
+        self._lock = multiprocessing.Lock()
+
+    def consume(self, before_sleep=None):
+        """
+        Consume a token from the bucket, sleeping until one is
+        available if necessary.
+
+        :param before_sleep: An optional callable, which will be
+                             called if it is necessary to sleep.
+        """
+
+        with self._lock:
+            # Refill the bucket and take a token; if none is
+            # available, the balance goes negative, reserving the
+            # next token to become available
+            now = util.monotonic()
+            tokens = min(self.burst, self._tokens.value +
+                         (now - self._last.value) * self.rate) - 1.0
+            self._tokens.value = tokens
+            self._last.value = now
+
+        # Wait for the reserved token
+        if tokens < 0.0:
+            if before_sleep:
+                before_sleep()
+            time.sleep(-tokens / self.rate)
+
+
+class PacedQueue(object):
+    """
+    Wraps a queue object, pacing the ``put()`` calls using a
+    ``TokenBucket``.
+    """
+
+    def __init__(self, queue, bucket):
+        """
+        Initialize a ``PacedQueue`` object.
+
+        :param queue: The queue object to wrap.
+        :param bucket: A ``TokenBucket`` object.
+        """
+
+        self.queue = queue
+        self.bucket = bucket
+
+    def put(self, item):
+        """
+        Place an item onto the queue, once a token is available.
+
+        :param item: The item to place onto the queue.
+        """
+
+        self.bucket.consume(self.flush)
+        self.queue.put(item)
+
+    def flush(self):
+        """
+        Flush any items buffered by the wrapped queue.
+        """
+
+        transport.flush(self.queue)
+
+    def shard(self, sequence):
+        """
+        Select the queue object a sequence should place its requests
+        on.  The returned queue object shares this queue's
+        ``TokenBucket``.
+
+        :param sequence: The ``request.Sequence`` object.
+
+        :returns: A ``PacedQueue`` object.
+        """
+
+        return PacedQueue(transport.shard(self.queue, sequence), self.bucket)
+
+
+class Scheduler(object):
+    """
+    Drive several sequences from a single loop.  Rather than
+    dedicating a process to each sequence, the ``Scheduler`` keeps a
+    heap of sequence cursors keyed by the time at which each sequence
+    next becomes ready.  A sequence is walked, placing its requests
+    onto the queue, until it reaches a ``Gap``; the sequence is then
+    pushed back onto the heap with a new deadline.  Deadlines are
+    absolute, measured from the start of the run, so that time spent
+    placing requests onto the queue does not accumulate into the
+    gaps.  If a target rate is given, the requests are paced using a
+    ``TokenBucket``, and the sequences take turns placing their
+    requests onto the queue.
+    """
+
+    def __init__(self, sequences, rate=None, bucket=None):
+        """
+        Initialize a ``Scheduler`` object.
+
+        :param sequences: A list of the ``Sequence`` objects to drive.
+        :param rate: The target rate for this scheduler, in requests
+                     per second.  If not given, requests are placed
+                     onto the queue as fast as possible.
+        :param bucket: The token bucket to pace the requests with,
+                       such as a ``SharedTokenBucket`` shared with
+                       other feeders.  By default, a ``TokenBucket``
+                       for the target rate is used.
+        """
+
+        self.sequences = sequences
+        self.rate = rate
+        self.bucket = bucket
+
+    def queue_request(self, queue, results=None):
+        """
+        Places all the requests in all the sequences onto the
+        designated queue, honoring the gaps within each sequence.
+
+        :param queue: A queue object.
+        :param results: An optional queue object.  If provided, a
+                        ``stats.ScheduleLag`` of the schedule lag--the
+                        amount by which each request was placed onto
+                        the queue later than scheduled--will be placed
+                        onto this queue once all requests have been
+                        queued.
+        """
+
+        # Pace the requests, if desired
+        if self.rate:
+            queue = PacedQueue(queue, self.bucket or TokenBucket(self.rate))
+
+        # Every sequence is ready to go immediately.  Each heap entry
+        # contains the time at which the sequence is ready, a counter
+        # which breaks ties in first-come, first-served order (and
+        # ensures that ties never fall through to comparing the
+        # rest of the entry), the deadline of the sequence's next
+        # request, the sequence cursor, and the queue object for the
+        # sequence.
+        lag = stats.ScheduleLag()
+        now = util.monotonic()
+        counter = itertools.count()
+        heap = [(now, next(counter), now, iter(seq.requests),
+                 transport.shard(queue, seq))
+                for seq in self.sequences]
+        heapq.heapify(heap)
+
+        while heap:
+            ready, _order, deadline, cursor, seq_queue = heapq.heappop(heap)
+
+            # Wait until the sequence is ready, making sure nothing
+            # buffered is held across the gap
+            delay = ready - util.monotonic()
+            if delay > 0:
+                transport.flush(queue)
+                time.sleep(delay)
+
+            # Walk the sequence until we hit a gap or the end
+            for req in cursor:
+                if isinstance(req, request.Gap):
+                    # Reschedule the sequence after the gap
+                    deadline += req.delta
+                    heapq.heappush(heap, (deadline, next(counter),
+                                          deadline, cursor, seq_queue))
+                    break
+
+                # Note the time the request was actually placed onto
+                # the queue, which may have waited for the rate limit
+                behind = util.monotonic() - deadline
+                req.queue_request(seq_queue)
+                lag.record(behind, util.monotonic())
+
+                # When pacing, spread the dispatches across all the
+                # ready sequences
+                if self.rate:
+                    heapq.heappush(heap, (util.monotonic(), next(counter),
+                                          deadline, cursor, seq_queue))
+                    break
+
+        transport.flush(queue)
+
+        if results is not None:
+            results.put(lag)
+
+
+class _StreamCursor(object):
+    """
+    The state of a sequence driven by a ``StreamScheduler``: the
+    deadline of its next request, its requests and gaps which have
+    been parsed but not yet dispatched, its queue object, and how
+    late the sequence was seen.
+    """
+
+    def __init__(self, deadline, queue, late=0.0):
+        """
+        Initialize a ``_StreamCursor`` object.
+
+        :param deadline: The deadline of the sequence's first request.
+        :param queue: The queue object for the sequence.
+        :param late: The time by which the sequence was seen after
+                     the start of the run.  It is added to the
+                     schedule lag of the sequence's first request.
+        """
+
+        self.deadline = deadline
+        self.queue = queue
+        self.late = late
+        self.pending = collections.deque()
+
+        # True while the cursor is on the heap
+        self.scheduled = False
+
+
+class StreamScheduler(object):
+    """
+    Drive the sequences in a list of request files while the files
+    are being parsed.  Like the ``Scheduler``, it keeps a heap of
+    sequences keyed by the time at which each next becomes ready,
+    with each sequence starting at the beginning of the run; but the
+    requests are read from the files incrementally, using
+    ``request.iter_files()``, and only up to ``lookahead`` requests
+    and gaps are held in memory at a time.  Dispatch begins as soon
+    as the first requests are read, and memory use does not grow with
+    the length of the files.
+
+    The price is that a sequence is only seen once the parser reaches
+    it: if its requests lie more than ``lookahead`` items beyond
+    requests which are not yet due, it starts late.  Its gaps are
+    measured from when it was first seen, so they are preserved, and
+    the delay shows up in the schedule lag of its first request.  The
+    requests are always sent as full WSGI environments.
+    """
+
+    def __init__(self, fnames, rate=None, lookahead=1000):
+        """
+        Initialize a ``StreamScheduler`` object.
+
+        :param fnames: A list of the names of the request files.
+        :param rate: The target rate for this scheduler, in requests
+                     per second.  If not given, requests are placed
+                     onto the queue as fast as possible.
+        :param lookahead: The maximum number of requests and gaps
+                          read ahead of dispatch.
+        """
+
+        self.fnames = fnames
+        self.rate = rate
+        self.lookahead = lookahead
+
+    def queue_request(self, queue, results=None):
+        """
+        Places all the requests in the request files onto the
+        designated queue, honoring the gaps within each sequence.
+
+        :param queue: A queue object.
+        :param results: An optional queue object.  If provided, a
+                        ``stats.ScheduleLag`` of the schedule lag--the
+                        amount by which each request was placed onto
+                        the queue later than scheduled--will be placed
+                        onto this queue once all requests have been
+                        queued.
+        """
+
+        # Pace the requests, if desired
+        if self.rate:
+            queue = PacedQueue(queue, TokenBucket(self.rate))
+
+        # The heap contains the time at which each sequence is ready,
+        # a counter to break ties, and the sequence's cursor
+        lag = stats.ScheduleLag()
+        start = util.monotonic()
+        counter = itertools.count()
+        heap = []
+        cursors = {}
+        items = request.iter_files(self.fnames)
+        buffered = 0
+
+        while True:
+            # Read ahead, making newly seen sequences ready
+            while items is not None and buffered < self.lookahead:
+                try:
+                    seq, item = next(items)
+                except StopIteration:
+                    items = None
+                    break
+
+                cursor = cursors.get(seq.name)
+                if cursor is None:
+                    # The sequence starts when it is first seen, so
+                    # that its gaps are not collapsed if it is seen
+                    # late
+                    now = util.monotonic()
+                    cursor = _StreamCursor(now, transport.shard(queue, seq),
+                                           now - start)
+                    cursors[seq.name] = cursor
+                cursor.pending.append(item)
+                buffered += 1
+
+                if not cursor.scheduled:
+                    cursor.scheduled = True
+                    heapq.heappush(heap, (max(cursor.deadline,
+                                              util.monotonic()),
+                                          next(counter), cursor))
+
+            if not heap:
+                break
+            ready, _order, cursor = heapq.heappop(heap)
+
+            # Wait until the sequence is ready, making sure nothing
+            # buffered is held across the gap
+            delay = ready - util.monotonic()
+            if delay > 0:
+                transport.flush(queue)
+                time.sleep(delay)
+
+            # Walk the sequence until we hit a gap or run out of
+            # parsed requests
+            pending = cursor.pending
+            while pending:
+                req = pending.popleft()
+                buffered -= 1
+
+                if isinstance(req, request.Gap):
+                    # Reschedule the sequence after the gap
+                    cursor.deadline += req.delta
+                    heapq.heappush(heap, (cursor.deadline, next(counter),
+                                          cursor))
+                    break
+
+                # Note the time the request was actually placed onto
+                # the queue, which may have waited for the rate limit
+                behind = util.monotonic() - cursor.deadline + cursor.late
+                cursor.late = 0.0
+                req.queue_request(cursor.queue)
+                lag.record(behind, util.monotonic())
+
+                # When pacing, spread the dispatches across all the
+                # ready sequences
+                if self.rate:
+                    heapq.heappush(heap, (util.monotonic(), next(counter),
+                                          cursor))
+                    break
+            else:
+                # The sequence will be rescheduled when more of it is
+                # read
+                cursor.scheduled = False
+
+        transport.flush(queue)
+
+        if results is not None:
+            results.put(lag)
+
+
+def partition(sequences, feeders, rate=None):
+    """
+    Split a list of sequences among a number of feeders.
+
+    :param sequences: A list of the ``Sequence`` objects to split.
+    :param feeders: The number of feeders to split the sequences
+                    among.
+    :param rate: The total target rate, in requests per second.  The
+                 feeders share a single ``SharedTokenBucket``, so the
+                 whole rate remains available to the feeders still
+                 running once others have finished.
+
+    :returns: A list of ``Scheduler`` objects.  There will be no more
+              than ``feeders`` elements in the list, and no
+              ``Scheduler`` will be empty.
+    """
+
+    sequences = list(sequences)
+    feeders = min(feeders, len(sequences))
+    bucket = SharedTokenBucket(rate) if rate and feeders else None
+    return [Scheduler(sequences[i::feeders], rate, bucket)
+            for i in range(feeders)]
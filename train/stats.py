@@ -0,0 +1,883 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import csv
+import json
+
+
+# The latency percentiles included in reports
+PERCENTILES = (50, 90, 99, 99.9)
+
+# The phases into which the time taken by each request is broken
+# down; see ``TrainServer._record()``
+PHASES = ('queue', 'filter_pre', 'app', 'filter_post')
+
+
+class Histogram(object):
+    """
+    A log-bucketed histogram of durations.  Values are recorded with
+    microsecond resolution into buckets whose width grows with the
+    magnitude of the value, so that every bucket has roughly the same
+    relative precision; this is the scheme used by HDR histograms.
+    The number of buckets is bounded by the range of the values, not
+    by the number of values recorded, so the memory used is constant.
+    """
+
+    # Values are recorded in integral units of this many seconds
+    resolution = 1e-6
+
+    def __init__(self, precision=5):
+        """
+        Initialize a ``Histogram`` object.
+
+        :param precision: The number of significant bits to keep for
+                          each value.  Each power of 2 is split into
+                          ``2 ** (precision - 1)`` buckets; the default
+                          of 5 gives a relative error of about 3%.
+        """
+
+        self.precision = precision
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        """
+        Compute the index of the bucket for a value.  Indexes start
+        at 0 and increase with the value, without gaps, so bucket
+        counts may also be kept in an array, as in shared memory.
+
+        :param value: The value, as an integer number of units of
+                      ``resolution`` seconds.
+
+        :returns: The bucket index.
+        """
+
+        # Small values get a bucket apiece
+        if value < (1 << self.precision):
+            return value
+
+        # Larger values share buckets, keeping the leading bits; the
+        # bit length is computed from bin(), as int.bit_length() is
+        # not available on Python 2.6
+        shift = len(bin(value)) - 2 - self.precision
+        return (shift << (self.precision - 1)) + (value >> shift)
+
+    def bucket_value(self, index):
+        """
+        Compute the representative value of a bucket.  This is the
+        midpoint of the range of values covered by the bucket.
+
+        :param index: The bucket index.
+
+        :returns: The value, as an integer number of units of
+                  ``resolution`` seconds.
+        """
+
+        if index < (1 << self.precision):
+            return index
+
+        shift = (index >> (self.precision - 1)) - 1
+        mantissa = index - (shift << (self.precision - 1))
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value):
+        """
+        Record a value.
+
+        :param value: The value to record, in seconds.  Negative values
+                      are recorded as 0.
+        """
+
+        value = max(value, 0.0)
+        idx = self.bucket_index(int(value / self.resolution))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Merge another histogram into this one.  The two histograms
+        must have the same precision.
+
+        :param other: The ``Histogram`` to merge.
+
+        :returns: This ``Histogram``.
+        """
+
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge histograms with different "
+                             "precisions")
+
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+        return self
+
+    def percentile(self, pct):
+        """
+        Compute a percentile.
+
+        :param pct: The desired percentile, from 0 to 100.
+
+        :returns: The value at the percentile, in seconds, or ``None``
+                  if no values have been recorded.  The value is
+                  clamped to the range of the recorded values.
+        """
+
+        if not self.count:
+            return None
+        elif pct <= 0:
+            return self.min
+        elif pct >= 100:
+            return self.max
+
+        # Figure out how many values we need to see
+        target = max(1, int(round(self.count * pct / 100.0)))
+
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= target:
+                value = self.bucket_value(idx) * self.resolution
+                return min(max(value, self.min), self.max)
+
+        return self.max  # Pragma: nocover
+
+    @property
+    def mean(self):
+        """
+        Retrieve the mean of the recorded values, in seconds, or
+        ``None`` if no values have been recorded.
+        """
+
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def summary(self, pcts=(50, 90, 99, 99.9)):
+        """
+        Summarize the histogram in a human-readable form.
+
+        :param pcts: A sequence of the percentiles to include.
+
+        :returns: A string describing the count, the selected
+                  percentiles, and the maximum value, with the
+                  durations expressed in milliseconds.
+        """
+
+        if not self.count:
+            return "count=0"
+
+        parts = ["count=%d" % self.count]
+        for pct in pcts:
+            parts.append("p%s=%.3fms" % (pct, self.percentile(pct) * 1000))
+        parts.append("max=%.3fms" % (self.max * 1000))
+
+        return ' '.join(parts)
+
+
+class ScheduleLag(Histogram):
+    """
+    A histogram of the schedule lag of the requests placed onto the
+    queue by a feeder.  It also tracks when the first and last of the
+    requests were placed onto the queue, so that the rate achieved
+    while dispatching may be computed without counting the time
+    before the first request or after the last.
+    """
+
+    def __init__(self, precision=5):
+        """
+        Initialize a ``ScheduleLag`` object.
+
+        :param precision: The number of significant bits to keep for
+                          each value.
+        """
+
+        super(ScheduleLag, self).__init__(precision)
+        self.first = None
+        self.last = None
+
+    def record(self, value, when=None):
+        """
+        Record a value.
+
+        :param value: The schedule lag of the request, in seconds.
+        :param when: The time at which the request was placed onto
+                     the queue, as returned by ``util.monotonic()``.
+        """
+
+        super(ScheduleLag, self).record(value)
+
+        if when is not None:
+            if self.first is None or when < self.first:
+                self.first = when
+            if self.last is None or when > self.last:
+                self.last = when
+
+    def merge(self, other):
+        """
+        Merge another schedule lag histogram into this one.
+
+        :param other: The ``ScheduleLag`` to merge.
+
+        :returns: This ``ScheduleLag``.
+        """
+
+        super(ScheduleLag, self).merge(other)
+
+        if other.first is not None and (self.first is None or
+                                        other.first < self.first):
+            self.first = other.first
+        if other.last is not None and (self.last is None or
+                                       other.last > self.last):
+            self.last = other.last
+
+        return self
+
+    @property
+    def span(self):
+        """
+        Retrieve the time from the first request being placed onto the
+        queue to the last, in seconds, or ``None`` if no times have
+        been recorded.
+        """
+
+        if self.first is None:
+            return None
+        return self.last - self.first
+
+    @property
+    def rate(self):
+        """
+        Retrieve the rate at which requests were placed onto the queue
+        between the first and the last, in requests per second, or
+        ``None`` if it cannot be computed.
+        """
+
+        if not self.span:
+            return None
+        return (self.count - 1) / self.span
+
+
+def _summarize(histogram, scale=1):
+    """
+    Summarize a histogram as a dictionary.
+
+    :param histogram: The ``Histogram`` to summarize.
+    :param scale: A factor to convert the values by; e.g., 1000 to
+                  express them in milliseconds.
+
+    :returns: A dictionary of the mean, the ``PERCENTILES``, and the
+              maximum value, or an empty dictionary if no values have
+              been recorded.
+    """
+
+    if not histogram.count:
+        return {}
+
+    result = {
+        'mean': histogram.mean * scale,
+        'max': histogram.max * scale,
+    }
+    for pct in PERCENTILES:
+        result['p%s' % pct] = histogram.percentile(pct) * scale
+
+    return result
+
+
+class Breakdown(object):
+    """
+    Accounts for a group of requests: a histogram of the time taken to
+    process them, and a count of the responses with each status code.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``Breakdown`` object.
+        """
+
+        self.latency = Histogram()
+        self.statuses = {}
+
+    @property
+    def count(self):
+        """
+        Retrieve the number of requests recorded.
+        """
+
+        return self.latency.count
+
+    def record(self, duration, status):
+        """
+        Record a request.
+
+        :param duration: The time taken to process the request, in
+                         seconds.
+        :param status: The status code of the response, such as
+                       "200", or "error" if the request raised an
+                       exception.
+        """
+
+        self.latency.record(duration)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        """
+        Merge another breakdown into this one.
+
+        :param other: The ``Breakdown`` to merge.
+
+        :returns: This ``Breakdown``.
+        """
+
+        self.latency.merge(other.latency)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+        return self
+
+    def to_dict(self, elapsed):
+        """
+        Summarize the breakdown as a dictionary.
+
+        :param elapsed: The duration of the run, in seconds, used to
+                        compute the throughput.
+
+        :returns: A dictionary with the keys "count", "throughput" (in
+                  requests per second), "statuses", and "latency_ms"
+                  (a dictionary of the mean, the percentiles, and the
+                  maximum, in milliseconds).
+        """
+
+        return {
+            'count': self.count,
+            'throughput': self.count / elapsed if elapsed > 0 else 0.0,
+            'statuses': dict(self.statuses),
+            'latency_ms': _summarize(self.latency, 1000),
+        }
+
+
+class Outcomes(object):
+    """
+    Accounts for the decisions Turnstile made: how many requests were
+    passed through to the application, and how many were limited,
+    broken down by sequence and by the limit responsible, along with a
+    histogram of the "Retry-After" delays returned.
+    """
+
+    def __init__(self):
+        """
+        Initialize an ``Outcomes`` object.
+        """
+
+        self.passed = 0
+        self.limited = 0
+        self.sequences = {}
+        self.limits = {}
+        self.delays = Histogram()
+
+    @property
+    def count(self):
+        """
+        Retrieve the number of requests recorded.
+        """
+
+        return self.passed + self.limited
+
+    def record(self, sequence, limit=None, delay=None):
+        """
+        Record the outcome of a request.
+
+        :param sequence: The name of the sequence the request belongs
+                         to.
+        :param limit: The name of the limit which caused the request
+                      to be limited, or ``None`` if the request was
+                      passed through.
+        :param delay: The delay, in seconds, the limited request was
+                      told to wait, or ``None`` if it is not known.
+        """
+
+        counts = self.sequences.setdefault(sequence,
+                                           dict(passed=0, limited=0))
+        if limit is None:
+            self.passed += 1
+            counts['passed'] += 1
+            return
+
+        self.limited += 1
+        counts['limited'] += 1
+        self.limits[limit] = self.limits.get(limit, 0) + 1
+        if delay is not None:
+            self.delays.record(delay)
+
+    def merge(self, other):
+        """
+        Merge other outcomes into these.
+
+        :param other: The ``Outcomes`` to merge.
+
+        :returns: This ``Outcomes``.
+        """
+
+        self.passed += other.passed
+        self.limited += other.limited
+        for sequence, counts in other.sequences.items():
+            mine = self.sequences.setdefault(sequence,
+                                             dict(passed=0, limited=0))
+            for key, count in counts.items():
+                mine[key] += count
+        for limit, count in other.limits.items():
+            self.limits[limit] = self.limits.get(limit, 0) + count
+        self.delays.merge(other.delays)
+
+        return self
+
+    def to_dict(self):
+        """
+        Summarize the outcomes as a dictionary.
+
+        :returns: A dictionary with the keys "passed", "limited",
+                  "sequences" (mapping each sequence name to its
+                  "passed" and "limited" counts), "limits" (mapping
+                  each limit name to its count), and "delays_s" (a
+                  dictionary of the mean, the percentiles, and the
+                  maximum of the delays, in seconds).
+        """
+
+        return {
+            'passed': self.passed,
+            'limited': self.limited,
+            'sequences': dict((k, dict(v))
+                              for k, v in self.sequences.items()),
+            'limits': dict(self.limits),
+            'delays_s': _summarize(self.delays),
+        }
+
+    def summary(self):
+        """
+        Summarize the outcomes in a human-readable form.
+
+        :returns: A list of lines giving the numbers of requests
+                  passed and limited, the delays, and the numbers of
+                  requests limited by each limit and in each
+                  sequence.
+        """
+
+        lines = ["Rate limiting: %d passed, %d limited (%.1f%%)" %
+                 (self.passed, self.limited,
+                  100.0 * self.limited / self.count if self.count else 0.0)]
+        if self.delays.count:
+            lines.append("Retry-After: count=%d mean=%.1fs p50=%.1fs "
+                         "p99=%.1fs max=%.1fs" %
+                         (self.delays.count, self.delays.mean,
+                          self.delays.percentile(50),
+                          self.delays.percentile(99), self.delays.max))
+        for limit in sorted(self.limits):
+            lines.append("  Limited by %s: %d" % (limit, self.limits[limit]))
+        for sequence in sorted(self.sequences):
+            counts = self.sequences[sequence]
+            if counts['limited']:
+                lines.append("  Sequence %s: %d passed, %d limited" %
+                             (sequence, counts['passed'], counts['limited']))
+
+        return lines
+
+
+class Commands(object):
+    """
+    Accounts for the Redis commands Turnstile issued while processing
+    requests: a histogram of the latency of each command, the use of
+    pipelines, and the distributions of the numbers of commands and
+    of round trips per request.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``Commands`` object.
+        """
+
+        self.commands = {}
+        self.pipelines = Histogram()
+        self.pipelined = 0
+        self.per_request = {}
+        self.round_trips = {}
+
+        # Counts for the request currently being processed
+        self._commands = 0
+        self._round_trips = 0
+
+    @property
+    def requests(self):
+        """
+        Retrieve the number of requests recorded.
+        """
+
+        return sum(self.per_request.values())
+
+    def record(self, command, duration):
+        """
+        Record a command sent on its own.
+
+        :param command: The name of the command, such as "GET".
+        :param duration: The time taken by the round trip, in
+                         seconds.
+        """
+
+        if command not in self.commands:
+            self.commands[command] = Histogram()
+        self.commands[command].record(duration)
+
+        self._commands += 1
+        self._round_trips += 1
+
+    def record_pipeline(self, count, duration):
+        """
+        Record the execution of a pipeline.
+
+        :param count: The number of commands in the pipeline.
+        :param duration: The time taken by the round trip, in
+                         seconds.
+        """
+
+        self.pipelines.record(duration)
+        self.pipelined += count
+
+        self._commands += count
+        self._round_trips += 1
+
+    def finish_request(self):
+        """
+        Record the numbers of commands and round trips made since the
+        last call, as those of a single request.
+        """
+
+        for counts, value in ((self.per_request, self._commands),
+                              (self.round_trips, self._round_trips)):
+            counts[value] = counts.get(value, 0) + 1
+
+        self._commands = 0
+        self._round_trips = 0
+
+    def merge(self, other):
+        """
+        Merge other command accounts into these.
+
+        :param other: The ``Commands`` to merge.
+
+        :returns: This ``Commands``.
+        """
+
+        for command, histogram in other.commands.items():
+            if command not in self.commands:
+                self.commands[command] = Histogram()
+            self.commands[command].merge(histogram)
+        self.pipelines.merge(other.pipelines)
+        self.pipelined += other.pipelined
+        for counts, other_counts in ((self.per_request, other.per_request),
+                                     (self.round_trips, other.round_trips)):
+            for value, count in other_counts.items():
+                counts[value] = counts.get(value, 0) + count
+
+        return self
+
+    def _mean(self, counts):
+        """
+        Compute the mean of a distribution of per-request counts.
+
+        :param counts: A dictionary mapping each value to the number
+                       of requests with that value.
+
+        :returns: The mean value, or 0.0 if no requests have been
+                  recorded.
+        """
+
+        requests = sum(counts.values())
+        if not requests:
+            return 0.0
+        return float(sum(v * c for v, c in counts.items())) / requests
+
+    def to_dict(self):
+        """
+        Summarize the command accounts as a dictionary.
+
+        :returns: A dictionary with the keys "requests",
+                  "commands_per_request" and
+                  "round_trips_per_request" (each with the "mean"
+                  and the "counts" of requests by value), "pipelines"
+                  (with the "count" of pipelines, the number of
+                  "commands" they carried, and their "latency_ms"),
+                  and "commands" (mapping each command name to its
+                  "count" and "latency_ms").
+        """
+
+        return {
+            'requests': self.requests,
+            'commands_per_request': {
+                'mean': self._mean(self.per_request),
+                'counts': dict(self.per_request),
+            },
+            'round_trips_per_request': {
+                'mean': self._mean(self.round_trips),
+                'counts': dict(self.round_trips),
+            },
+            'pipelines': {
+                'count': self.pipelines.count,
+                'commands': self.pipelined,
+                'latency_ms': _summarize(self.pipelines, 1000),
+            },
+            'commands': dict((k, {
+                'count': v.count,
+                'latency_ms': _summarize(v, 1000),
+            }) for k, v in self.commands.items()),
+        }
+
+    def summary(self):
+        """
+        Summarize the command accounts in a human-readable form.
+
+        :returns: A list of lines giving the numbers of commands and
+                  round trips per request, the use of pipelines, and
+                  the latency of each command, most frequent first.
+        """
+
+        lines = ["Redis: %.2f commands and %.2f round trips per request "
+                 "(%d requests)" %
+                 (self._mean(self.per_request), self._mean(self.round_trips),
+                  self.requests)]
+        if self.pipelines.count:
+            lines.append("  Pipelines: %d carrying %d commands; %s" %
+                         (self.pipelines.count, self.pipelined,
+                          self.pipelines.summary()))
+        for command in sorted(self.commands,
+                              key=lambda k: (-self.commands[k].count, k)):
+            lines.append("  %s: %s" %
+                         (command, self.commands[command].summary()))
+
+        return lines
+
+
+class Report(object):
+    """
+    Accounts for all the requests processed during a run, in total,
+    by sequence, and by method and URI, along with the outcomes of
+    the rate limiting.  The memory used grows with the number of
+    distinct sequences, URIs, and limits, not with the number of
+    requests.  As the URIs may embed identifiers, the number of them
+    accounted for separately is capped; once the cap is reached, the
+    requests for any further URIs are accounted for together under
+    ``uri_overflow``.
+    """
+
+    # The columns of the CSV report
+    csv_columns = (['group', 'name', 'count', 'throughput', 'mean'] +
+                   ['p%s' % pct for pct in PERCENTILES] +
+                   ['max', 'statuses'])
+
+    # The default cap on the number of distinct URIs
+    max_uris = 1000
+
+    # The key the requests for URIs beyond the cap are accounted under
+    uri_overflow = '(other)'
+
+    def __init__(self, max_uris=None):
+        """
+        Initialize a ``Report`` object.
+
+        :param max_uris: The maximum number of distinct URIs to
+                         account for separately.  If 0, there is no
+                         limit.  Defaults to the ``max_uris`` class
+                         attribute.
+        """
+
+        if max_uris is not None:
+            self.max_uris = max_uris
+
+        self.total = Breakdown()
+        self.sequences = {}
+        self.uris = {}
+        self.outcomes = Outcomes()
+        self.phases = dict((phase, Histogram()) for phase in PHASES)
+        self.commands = Commands()
+
+    def record(self, sequence, uri, duration, status):
+        """
+        Record a request.
+
+        :param sequence: The name of the sequence the request belongs
+                         to.
+        :param uri: The method and URI of the request, such as "GET
+                    /path".
+        :param duration: The time taken to process the request, in
+                         seconds.
+        :param status: The status code of the response, such as
+                       "200", or "error" if the request raised an
+                       exception.
+        """
+
+        self.total.record(duration, status)
+        for group, key in ((self.sequences, sequence),
+                           (self.uris, self._uri_key(uri))):
+            if key not in group:
+                group[key] = Breakdown()
+            group[key].record(duration, status)
+
+    def _uri_key(self, uri):
+        """
+        Determine the key to account for a URI under.
+
+        :param uri: The method and URI of the request.
+
+        :returns: The URI, or ``uri_overflow`` if the URI is not
+                  already accounted for and the cap has been reached.
+        """
+
+        if not self.max_uris or uri in self.uris:
+            return uri
+
+        # The overflow bucket doesn't count against the cap
+        count = len(self.uris)
+        if self.uri_overflow in self.uris:
+            count -= 1
+        if count >= self.max_uris:
+            return self.uri_overflow
+        return uri
+
+    def record_phase(self, phase, duration):
+        """
+        Record the time a request spent in one phase of its
+        processing.
+
+        :param phase: The name of the phase; one of ``PHASES``.
+        :param duration: The time spent in the phase, in seconds.
+        """
+
+        self.phases[phase].record(duration)
+
+    def merge(self, other):
+        """
+        Merge another report into this one.
+
+        :param other: The ``Report`` to merge.
+
+        :returns: This ``Report``.
+        """
+
+        self.total.merge(other.total)
+        for key, breakdown in other.sequences.items():
+            if key not in self.sequences:
+                self.sequences[key] = Breakdown()
+            self.sequences[key].merge(breakdown)
+
+        # The cap applies to the merged URIs, too; the busiest URIs
+        # are kept, so the result doesn't depend on the dict order
+        for uri in sorted(other.uris,
+                          key=lambda k: (-other.uris[k].count, k)):
+            key = self._uri_key(uri)
+            if key not in self.uris:
+                self.uris[key] = Breakdown()
+            self.uris[key].merge(other.uris[uri])
+        self.outcomes.merge(other.outcomes)
+        for phase, histogram in other.phases.items():
+            self.phases[phase].merge(histogram)
+        self.commands.merge(other.commands)
+
+        return self
+
+    def to_dict(self, elapsed):
+        """
+        Summarize the report as a dictionary.
+
+        :param elapsed: The duration of the run, in seconds.
+
+        :returns: A dictionary with the keys "elapsed", "total",
+                  "sequences", "uris", "outcomes", "phases_ms", and
+                  "redis".
+                  The "sequences" and "uris" map each sequence name
+                  or URI to its summary; see ``Breakdown.to_dict()``.
+                  For "outcomes", see ``Outcomes.to_dict()``.  The
+                  "phases_ms" map each of the ``PHASES`` to the
+                  mean, the percentiles, and the maximum of the time
+                  spent in it, in milliseconds.  For "redis", see
+                  ``Commands.to_dict()``.
+        """
+
+        return {
+            'elapsed': elapsed,
+            'total': self.total.to_dict(elapsed),
+            'sequences': dict((k, v.to_dict(elapsed))
+                              for k, v in self.sequences.items()),
+            'uris': dict((k, v.to_dict(elapsed))
+                         for k, v in self.uris.items()),
+            'outcomes': self.outcomes.to_dict(),
+            'phases_ms': dict((k, _summarize(v, 1000))
+                              for k, v in self.phases.items()),
+            'redis': self.commands.to_dict(),
+        }
+
+    def write_json(self, fobj, elapsed):
+        """
+        Write the report as a JSON document.
+
+        :param fobj: A file object to write the report to.
+        :param elapsed: The duration of the run, in seconds.
+        """
+
+        json.dump(self.to_dict(elapsed), fobj, indent=2, sort_keys=True)
+        fobj.write('\n')
+
+    def write_csv(self, fobj, elapsed):
+        """
+        Write the report as CSV, with one row for the total, followed
+        by one row for each sequence and each URI.  Latencies are in
+        milliseconds, and the status code counts are written as
+        "status:count" pairs, separated by spaces.
+
+        :param fobj: A file object to write the report to.
+        :param elapsed: The duration of the run, in seconds.
+        """
+
+        writer = csv.writer(fobj)
+        writer.writerow(self.csv_columns)
+
+        rows = [('total', '', self.total)]
+        rows += [('sequence', k, self.sequences[k])
+                 for k in sorted(self.sequences)]
+        rows += [('uri', k, self.uris[k]) for k in sorted(self.uris)]
+        for group, name, breakdown in rows:
+            data = breakdown.to_dict(elapsed)
+            latency = data['latency_ms']
+            writer.writerow(
+                [group, name, data['count'], '%.1f' % data['throughput']] +
+                ['%.3f' % latency[col] if col in latency else ''
+                 for col in self.csv_columns[4:-1]] +
+                [' '.join('%s:%d' % (status, data['statuses'][status])
+                          for status in sorted(data['statuses']))])
@@ -0,0 +1,538 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import cPickle
+import mmap
+import multiprocessing
+import struct
+
+from train import util
+
+
+def flush(queue):
+    """
+    Flush any items buffered by a queue object.  Feeders call this
+    before sleeping, so that buffered requests are not held across a
+    gap.  Queue objects which do not buffer need not implement
+    ``flush()``.
+
+    :param queue: A queue object.
+    """
+
+    flusher = getattr(queue, 'flush', None)
+    if flusher:
+        flusher()
+
+
+def shard(queue, sequence):
+    """
+    Select the queue object a sequence should place its requests on.
+    Feeders call this for each sequence they drive.  Queue objects
+    which do not route requests by sequence need not implement
+    ``shard()``.
+
+    :param queue: A queue object.
+    :param sequence: The ``request.Sequence`` object.
+
+    :returns: A queue object.
+    """
+
+    sharder = getattr(queue, 'shard', None)
+    if sharder:
+        return sharder(sequence)
+    return queue
+
+
+def worker(queue, idx):
+    """
+    Select the queue object a worker should retrieve its requests
+    from.  Queue objects which are shared by all the workers need not
+    implement ``worker()``.
+
+    :param queue: A queue object.
+    :param idx: The index of the worker.
+
+    :returns: A queue object.
+    """
+
+    selector = getattr(queue, 'worker', None)
+    if selector:
+        return selector(idx)
+    return queue
+
+
+def depth(queue):
+    """
+    Determine the approximate number of items on a queue object.
+    Batches placed by ``BatchingQueue`` count as single items.
+
+    :param queue: A queue object.
+
+    :returns: The number of items, or ``None`` if the queue object
+              cannot report it.
+    """
+
+    try:
+        return queue.qsize()
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+class BatchingQueue(object):
+    """
+    Wraps a queue object, coalescing the items placed on it into
+    lists.  A batch is placed onto the wrapped queue once it contains
+    ``size`` items, once ``delay`` seconds have elapsed since its first
+    item was added, or when ``flush()`` is called.  Workers drain a
+    whole batch with a single ``get()``, so each batch costs only one
+    lock acquisition, pipe write, and wakeup.
+    """
+
+    def __init__(self, queue, size, delay=0.001):
+        """
+        Initialize a ``BatchingQueue`` object.
+
+        :param queue: The queue object to wrap.
+        :param size: The maximum number of items in a batch.
+        :param delay: The maximum time, in seconds, an item may be
+                      held in a batch while further items are added.
+        """
+
+        self.queue = queue
+        self.size = size
+        self.delay = delay
+        self.batch = []
+        self.started = None
+
+    def put(self, item):
+        """
+        Add an item to the batch, placing the batch onto the wrapped
+        queue if it is full or old enough.
+
+        :param item: The item to add.
+        """
+
+        if not self.batch:
+            self.started = util.monotonic()
+        self.batch.append(item)
+
+        if (len(self.batch) >= self.size or
+                util.monotonic() - self.started >= self.delay):
+            self.flush()
+
+    def flush(self):
+        """
+        Place any pending batch onto the wrapped queue.
+        """
+
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+
+
+class RingQueue(object):
+    """
+    A queue implemented as a ring buffer of fixed-size records in
+    shared memory.  Unlike ``multiprocessing.Queue``, there is no
+    feeder thread or pipe; a producer copies its record directly into
+    a free slot, and a consumer copies it directly out.  Producers and
+    consumers each serialize on their own lock, and wait on semaphores
+    (which are futex-based on Linux) for free slots or for records.
+    The queue must be created before the processes which use it are
+    forked.  Items are delivered in the order in which they are
+    placed onto the queue.
+
+    Request keys--tuples of two non-negative integers, optionally
+    followed by the time the request was queued--are stored in a
+    compact binary form; all other items are pickled.  An item
+    which does not fit in a slot results in a ``ValueError``.
+    """
+
+    # Each record starts with a type tag and the length of the data
+    _header = struct.Struct('!BI')
+    _key = struct.Struct('!II')
+    _stamped_key = struct.Struct('!IId')
+
+    # Record type tags
+    _PICKLE = 0
+    _KEY = 1
+    _STAMPED_KEY = 2
+
+    def __init__(self, slots=16384, slot_size=512):
+        """
+        Initialize a ``RingQueue`` object.
+
+        :param slots: The number of slots in the ring.  Producers
+                      block when all slots are full.
+        :param slot_size: The size of each slot, in bytes.
+        """
+
+        self.slots = slots
+        self.slot_size = slot_size
+
+        self._buf = mmap.mmap(-1, slots * slot_size)
+        self._head = multiprocessing.RawValue('L', 0)
+        self._tail = multiprocessing.RawValue('L', 0)
+        self._put_lock = multiprocessing.Lock()
+        self._get_lock = multiprocessing.Lock()
+        self._items = multiprocessing.Semaphore(0)
+        self._free = multiprocessing.Semaphore(slots)
+
+    @classmethod
+    def _encode(cls, item):
+        """
+        Encode an item as a record.
+
+        :param item: The item to encode.
+
+        :returns: A tuple of the type tag and the encoded data.
+        """
+
+        if (isinstance(item, tuple) and len(item) in (2, 3) and
+                all(isinstance(i, (int, long)) and 0 <= i < 2 ** 32
+                    for i in item[:2])):
+            if len(item) == 2:
+                return cls._KEY, cls._key.pack(*item)
+            elif isinstance(item[2], float):
+                return cls._STAMPED_KEY, cls._stamped_key.pack(*item)
+
+        return cls._PICKLE, cPickle.dumps(item, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def record_size(cls, item):
+        """
+        Determine the size of the record an item is encoded as.  An
+        item fits in a slot of at least this size.
+
+        :param item: The item.
+
+        :returns: The size of the record, in bytes.
+        """
+
+        _tag, data = cls._encode(item)
+        return cls._header.size + len(data)
+
+    def put(self, item):
+        """
+        Place an item onto the queue, waiting for a free slot if
+        necessary.
+
+        :param item: The item to place onto the queue.
+        """
+
+        tag, data = self._encode(item)
+        if self._header.size + len(data) > self.slot_size:
+            raise ValueError("Item of %d bytes is too large for a %d-byte "
+                             "ring slot" % (len(data), self.slot_size))
+
+        self._free.acquire()
+        with self._put_lock:
+            idx = self._tail.value
+            self._tail.value = (idx + 1) % self.slots
+
+            offset = idx * self.slot_size
+            self._header.pack_into(self._buf, offset, tag, len(data))
+            offset += self._header.size
+            self._buf[offset:offset + len(data)] = data
+        self._items.release()
+
+    def get(self):
+        """
+        Retrieve an item from the queue, waiting for one if
+        necessary.
+
+        :returns: The item.
+        """
+
+        self._items.acquire()
+        with self._get_lock:
+            idx = self._head.value
+            self._head.value = (idx + 1) % self.slots
+
+            offset = idx * self.slot_size
+            tag, length = self._header.unpack_from(self._buf, offset)
+            offset += self._header.size
+            data = self._buf[offset:offset + length]
+        self._free.release()
+
+        if tag == self._KEY:
+            return self._key.unpack(data)
+        elif tag == self._STAMPED_KEY:
+            return self._stamped_key.unpack(data)
+        return cPickle.loads(data)
+
+    def empty(self):
+        """
+        Determine whether the queue is empty.  As with
+        ``multiprocessing.Queue``, the result is unreliable if other
+        processes are using the queue.
+
+        :returns: ``True`` if the queue is empty, ``False`` otherwise.
+        """
+
+        return self._items.get_value() == 0
+
+    def qsize(self):
+        """
+        Determine the approximate number of items on the queue.
+
+        :returns: The number of items.
+        """
+
+        return self._items.get_value()
+
+
+class ShardedQueue(object):
+    """
+    Gives each worker its own queue, so that the workers do not
+    contend on a single queue.  Each sequence is assigned a home
+    worker, and all its requests are placed onto that worker's queue,
+    so requests from a sequence are processed in order.
+
+    Workers flag themselves as idle when their queue runs dry.  When a
+    sequence has no requests pending--every request placed onto a
+    queue has been processed--its feeder may move it to an idle
+    worker; this lets idle workers steal whole sequences from busy
+    ones without reordering any sequence's requests.  To track
+    whether requests are pending, each sequence has a count of the
+    requests dispatched, written only by the feeder driving the
+    sequence, and a count of the requests completed, written only by
+    the worker the sequence is assigned to.  Neither count needs a
+    lock.
+
+    The ``ShardedQueue`` must be created before the feeders and
+    workers are forked.  Feeders use the object returned by
+    ``shard()`` for each sequence, and workers use the object
+    returned by ``worker()``.
+    """
+
+    def __init__(self, queues, sequences, batch_size=1, batch_time=0.001):
+        """
+        Initialize a ``ShardedQueue`` object.
+
+        :param queues: A list of queue objects, one for each worker.
+        :param sequences: A list of the ``request.Sequence`` objects
+                          which will be fed.  Sequences are assigned
+                          home workers round-robin, in order.
+        :param batch_size: The maximum number of requests in a batch.
+                           If greater than 1, requests are placed onto
+                           each worker's queue through a
+                           ``BatchingQueue``.
+        :param batch_time: The maximum time, in seconds, a request may
+                           be held while a batch is filled.
+        """
+
+        self.queues = queues
+        self._seq_ids = dict((seq.name, i) for i, seq in enumerate(sequences))
+
+        # The queues the feeders place requests onto
+        if batch_size > 1:
+            self._outputs = [BatchingQueue(q, batch_size, batch_time)
+                             for q in queues]
+        else:
+            self._outputs = list(queues)
+
+        # Shared state
+        count = len(sequences)
+        self._home = multiprocessing.RawArray(
+            'i', [i % len(queues) for i in range(count)])
+        self._dispatched = multiprocessing.RawArray('L', count)
+        self._completed = multiprocessing.RawArray('L', count)
+        self._idle = multiprocessing.RawArray('b', len(queues))
+
+        # Used by put() to distribute items not tied to a sequence
+        self._next = 0
+
+    def shard(self, sequence):
+        """
+        Retrieve the queue object a sequence should place its requests
+        on.
+
+        :param sequence: The ``request.Sequence`` object.
+
+        :returns: A ``SequenceShard`` object.
+        """
+
+        return SequenceShard(self, self._seq_ids[sequence.name])
+
+    def worker(self, idx):
+        """
+        Retrieve the queue object a worker should retrieve its
+        requests from.
+
+        :param idx: The index of the worker.
+
+        :returns: A ``WorkerShard`` object.
+        """
+
+        return WorkerShard(self, idx)
+
+    def dispatch(self, seq_id, item):
+        """
+        Place a request from a sequence onto the queue of the
+        sequence's home worker.  If the sequence has no requests
+        pending and its home worker is busy, the sequence is first
+        moved to an idle worker, if there is one.
+
+        :param seq_id: The index of the sequence.
+        :param item: The request to place onto the queue.
+        """
+
+        home = self._home[seq_id]
+        if (self._dispatched[seq_id] == self._completed[seq_id] and
+                not self._idle[home]):
+            for idx, idle in enumerate(self._idle):
+                if idle:
+                    # Claim the worker, so other sequences don't all
+                    # pile onto it
+                    self._idle[idx] = 0
+                    self._home[seq_id] = home = idx
+                    break
+
+        self._dispatched[seq_id] += 1
+        self._outputs[home].put((seq_id, item))
+
+    def complete(self, seq_id):
+        """
+        Record that a request from a sequence has been processed.
+
+        :param seq_id: The index of the sequence.
+        """
+
+        self._completed[seq_id] += 1
+
+    def put(self, item):
+        """
+        Place an item which is not part of a sequence, such as
+        ``'STOP'``, onto the workers' queues.  Successive items are
+        placed onto successive workers' queues.
+
+        :param item: The item to place onto the queue.
+        """
+
+        self.queues[self._next].put(item)
+        self._next = (self._next + 1) % len(self.queues)
+
+    def flush(self):
+        """
+        Place any pending batches onto the workers' queues.
+        """
+
+        for output in self._outputs:
+            flush(output)
+
+    def empty(self):
+        """
+        Determine whether all the workers' queues are empty.
+
+        :returns: ``True`` if the queues are empty, ``False``
+                  otherwise.
+        """
+
+        return all(q.empty() for q in self.queues)
+
+    def qsize(self):
+        """
+        Determine the approximate number of items on all the workers'
+        queues.
+
+        :returns: The number of items.
+        """
+
+        return sum(q.qsize() for q in self.queues)
+
+
+class SequenceShard(object):
+    """
+    The queue object a feeder uses to place the requests of one
+    sequence onto a ``ShardedQueue``.
+    """
+
+    def __init__(self, sharded, seq_id):
+        """
+        Initialize a ``SequenceShard`` object.
+
+        :param sharded: The ``ShardedQueue``.
+        :param seq_id: The index of the sequence.
+        """
+
+        self.sharded = sharded
+        self.seq_id = seq_id
+
+    def put(self, item):
+        """
+        Place a request onto the queue.
+
+        :param item: The request to place onto the queue.
+        """
+
+        self.sharded.dispatch(self.seq_id, item)
+
+    def flush(self):
+        """
+        Place any pending batches onto the workers' queues.
+        """
+
+        self.sharded.flush()
+
+
+class WorkerShard(object):
+    """
+    The queue object a worker uses to retrieve its requests from a
+    ``ShardedQueue``.  A request is taken to have been processed once
+    the worker asks for the next one.
+    """
+
+    def __init__(self, sharded, idx):
+        """
+        Initialize a ``WorkerShard`` object.
+
+        :param sharded: The ``ShardedQueue``.
+        :param idx: The index of the worker.
+        """
+
+        self.sharded = sharded
+        self.idx = idx
+        self.queue = sharded.queues[idx]
+        self.pending = []
+
+    def get(self):
+        """
+        Retrieve an item from the worker's queue, waiting for one if
+        necessary.  The worker is flagged as idle while it waits.
+
+        :returns: The item; this is a request, a list of requests, or
+                  an item placed onto the queue with
+                  ``ShardedQueue.put()``.
+        """
+
+        # The requests from the last get() have been processed
+        for seq_id in self.pending:
+            self.sharded.complete(seq_id)
+        self.pending = []
+
+        if self.queue.empty():
+            self.sharded._idle[self.idx] = 1
+        item = self.queue.get()
+        self.sharded._idle[self.idx] = 0
+
+        if isinstance(item, list):
+            self.pending = [seq_id for seq_id, _req in item]
+            return [req for _seq_id, req in item]
+        elif isinstance(item, tuple):
+            seq_id, item = item
+            self.pending = [seq_id]
+
+        return item
@@ -15,8 +15,11 @@
 
 import collections
 import logging
+import multiprocessing.util
 import os
 import signal
+import sys
+import time
 
 
 LOG = logging.getLogger(__name__)
@@ -26,6 +29,65 @@ LOG = logging.getLogger(__name__)
 _unpassed = object()
 
 
+def _get_monotonic():
+    """
+    Select an implementation for ``monotonic()``.  Python 2 has no
+    ``time.monotonic()``, so on Linux we call ``clock_gettime()``
+    directly; failing that, we fall back to ``time.time()``.
+
+    :returns: A callable returning the value of the clock, in
+              seconds.
+    """
+
+    # Use the native implementation if there is one
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    if sys.platform.startswith('linux'):
+        try:
+            import ctypes
+            import ctypes.util
+
+            class timespec(ctypes.Structure):
+                _fields_ = [
+                    ('tv_sec', ctypes.c_long),
+                    ('tv_nsec', ctypes.c_long),
+                ]
+
+            librt = ctypes.CDLL(ctypes.util.find_library('rt'),
+                                use_errno=True)
+            clock_gettime = librt.clock_gettime
+            clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        except (ImportError, OSError, AttributeError):
+            return time.time
+
+        def monotonic():
+            ts = timespec()
+            if clock_gettime(1, ctypes.byref(ts)):  # CLOCK_MONOTONIC
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+
+        return monotonic
+
+    return time.time
+
+
+_monotonic = _get_monotonic()
+
+
+def monotonic():
+    """
+    Retrieve the value of a monotonic clock.  The clock is shared by
+    all processes on the system, so values obtained from different
+    processes may be compared.
+
+    :returns: The value of the clock, in fractional seconds.
+    """
+
+    return _monotonic()
+
+
 class StackedDict(collections.MutableMapping):
     """
     Represent a dictionary "stacked" on top of another dictionary;
@@ -193,6 +255,21 @@ class SignalExit(SystemExit):
         self.signo = signo
 
 
+def _close_log_handlers():
+    """
+    Flush and close the handlers of the root logger, as
+    ``logging.shutdown()`` does when a process exits normally.  Errors
+    are ignored, since the process is about to exit anyway.
+    """
+
+    for handler in logging.getLogger().handlers:
+        try:
+            handler.flush()
+            handler.close()
+        except (IOError, ValueError):
+            pass
+
+
 class Launcher(object):
     """
     A class that assists in launching a server.
@@ -257,8 +334,14 @@ class Launcher(object):
             # Return the child's PID
             return pid
 
-        # OK, this code executes in the child; let's start by
-        # installing the signal handlers
+        # OK, this code executes in the child.  Objects such as
+        # multiprocessing queues must reset state inherited from the
+        # parent, such as their feeder threads, which do not survive
+        # the fork; multiprocessing.Process does this, but a raw fork
+        # must do it itself
+        multiprocessing.util._run_after_forkers()
+
+        # Now install the signal handlers
         self._install_handler(self._handle_signal)
 
         # Need our process ID
@@ -278,5 +361,9 @@ class Launcher(object):
             LOG.exception("%s: Unhandled exception" % pid)
             status = 2
 
+        # os._exit() skips the usual cleanup, so make sure the log
+        # records have been written
+        _close_log_handlers()
+
         # Let's exit safely
         os._exit(status)
@@ -13,12 +13,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import logging
 import os
 import pprint
+import random
+import time
 
+from turnstile import config
 from turnstile import middleware
 
+from train import instrument
+from train import memredis
+from train import profiling
+from train import stats
+from train import transport
 from train import util
 
 
@@ -31,17 +40,31 @@ class Response(object):
     be in the ``status`` attribute, the headers will be normalized
     (upper-case, with dashes converted to underscores) and represented
     as a dictionary in the ``headers`` attribute, and the response
-    body will be stored in the ``body`` attribute.
+    body will be stored in the ``body`` attribute.  The length of the
+    body is stored in the ``body_length`` attribute.
+
+    The headers are only normalized when the ``headers`` attribute is
+    first accessed; a single header may be retrieved with ``header()``
+    without normalizing the rest.  If a body limit is given, only that
+    many bytes of the body are kept; the remainder is counted, but
+    discarded.
     """
 
-    def __init__(self):
+    def __init__(self, body_limit=None):
         """
         Initialize a ``Response`` object.
+
+        :param body_limit: The maximum number of bytes of the body to
+                           keep.  If ``None``, the whole body is kept.
         """
 
         self.status = None
-        self.headers = {}
-        self.body = ''
+        self.body_limit = body_limit
+        self.body_length = 0
+        self._raw_headers = []
+        self._headers = None
+        self._chunks = []
+        self._kept = 0
 
     def __call__(self, application, environ):
         """
@@ -54,9 +77,92 @@ class Response(object):
 
         # Call the application and consume its response
         result = application(environ, self.start_response)
-        for data in result:
-            if data:
-                self.body += str(data)
+        try:
+            for data in result:
+                if data:
+                    self._append(str(data))
+        finally:
+            # The WSGI specification requires that we call close()
+            if hasattr(result, 'close'):
+                result.close()
+
+    def _append(self, data):
+        """
+        Append data to the body, keeping no more than the body limit.
+
+        :param data: The data to append.
+        """
+
+        self.body_length += len(data)
+
+        if self.body_limit is not None:
+            if self._kept >= self.body_limit:
+                return
+            data = data[:self.body_limit - self._kept]
+
+        self._chunks.append(data)
+        self._kept += len(data)
+
+    @property
+    def headers(self):
+        """
+        Retrieve the normalized response headers, as a dictionary.
+        """
+
+        if self._headers is None:
+            self._headers = dict((k.upper().replace('-', '_'), v)
+                                 for k, v in self._raw_headers)
+        return self._headers
+
+    def header(self, name):
+        """
+        Retrieve a single response header, without normalizing all
+        the headers.
+
+        :param name: The normalized name of the header (upper-case,
+                     with dashes converted to underscores).
+
+        :returns: The value of the header, or ``None`` if it was not
+                  set.  If it was set more than once, the last value
+                  is returned, as with ``headers``.
+        """
+
+        if self._headers is not None:
+            return self._headers.get(name)
+
+        value = None
+        for key, val in self._raw_headers:
+            if (len(key) == len(name) and
+                    key.upper().replace('-', '_') == name):
+                value = val
+        return value
+
+    @property
+    def body(self):
+        """
+        Retrieve the response body, or as much of it as was kept.
+        """
+
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    @body.setter
+    def body(self, value):
+        """
+        Replace the response body.
+        """
+
+        self._chunks = [value]
+        self._kept = self.body_length = len(value)
+
+    @property
+    def truncated(self):
+        """
+        Determine whether any of the response body was discarded.
+        """
+
+        return self.body_length > self._kept
 
     def start_response(self, status, response_headers, exc_info=None):
         """
@@ -76,8 +182,8 @@ class Response(object):
         """
 
         self.status = status
-        self.headers.update((k.upper().replace('-', '_'), v)
-                            for k, v in response_headers)
+        self._raw_headers.extend(response_headers)
+        self._headers = None
         return self.write
 
     def write(self, data):
@@ -90,7 +196,7 @@ class Response(object):
         """
 
         if data:
-            self.body += str(data)
+            self._append(str(data))
 
 
 class TrainServer(object):
@@ -99,18 +205,92 @@ class TrainServer(object):
     Turnstile filter.  Since the filter expects to be called with
     another WSGI callable, this class also implements a fake
     application which returns "200 OK" with an "X-Train-Server" header
-    (value "completed").  The body of the fake response will be the
-    pretty-printed WSGI environment dictionary.
+    (value "completed").  Depending on the application mode, the body
+    of the fake response will be empty, a fixed-size static body, or
+    the pretty-printed WSGI environment dictionary.
     """
 
-    def __init__(self, filter):
+    # The supported fake application modes
+    app_modes = ('empty', 'static', 'debug')
+
+    # The supported service time distributions
+    service_dists = ('fixed', 'exponential')
+
+    # The supported log formats
+    log_formats = ('text', 'json')
+
+    def __init__(self, filter, table=None, app_mode='debug', body_size=0,
+                 service_time=None, service_dist='fixed', body_limit=None,
+                 log_sample=1.0, log_format='text', results=None,
+                 progress=None, report_uris=None):
         """
         Initialize the ``TrainServer`` object.
 
         :param filter: The Turnstile filter callable.
+        :param table: The request table returned by
+                      ``request.index_sequences()``.  This is used to
+                      look up requests which are placed on the queue
+                      by key.
+        :param app_mode: The fake application mode.  With "empty",
+                         the response body is empty; with "static",
+                         it is ``body_size`` bytes long; and with
+                         "debug", it is the pretty-printed WSGI
+                         environment.
+        :param body_size: The size of the response body, in bytes,
+                          for the "static" fake application mode.
+        :param service_time: The time, in seconds, the fake
+                             application takes to process a request.
+                             This models the upstream application
+                             behind the filter.
+        :param service_dist: The distribution of the service time;
+                             either "fixed", or "exponential" with a
+                             mean of ``service_time``.
+        :param body_limit: The maximum number of bytes of each
+                           response body to keep for logging.  If
+                           ``None``, the whole body is kept.
+        :param log_sample: The fraction of requests to log, from 0 to
+                           1.  Exceptions are always logged.
+        :param log_format: The format of the request log.  With
+                           "text", the request and the response are
+                           logged in full; with "json", a single
+                           compact record summarizing the request and
+                           response is logged, formatted by
+                           ``asynclog.JSONFormatter``.
+        :param results: An optional ``multiprocessing.Queue``.  If
+                        provided, a ``stats.Report`` of the requests
+                        processed will be placed onto this queue when
+                        the server is stopped, and the queue closed.
+        :param progress: An optional ``progress.Progress`` object.  If
+                         provided, each worker counts the requests it
+                         processes in its slot, as passed to
+                         ``start()``.
+        :param report_uris: The maximum number of distinct URIs to
+                            account for separately in the report; see
+                            ``stats.Report``.
         """
 
+        if app_mode not in self.app_modes:
+            raise ValueError("Unknown app mode %r" % app_mode)
+        if service_dist not in self.service_dists:
+            raise ValueError("Unknown service time distribution %r" %
+                             service_dist)
+        if log_format not in self.log_formats:
+            raise ValueError("Unknown log format %r" % log_format)
+
         self.application = filter(self.fake_app)
+        self.table = table
+        self.app_mode = app_mode
+        self.body = 'x' * body_size
+        self.service_time = service_time
+        self.service_dist = service_dist
+        self.body_limit = body_limit
+        self.log_sample = log_sample
+        self.log_format = log_format
+        self.results = results
+        self.progress = progress
+        self.report = stats.Report(report_uris)
+        self.slot = None
+        self.redis_stats = False
 
     def __call__(self, environ):
         """
@@ -123,7 +303,7 @@ class TrainServer(object):
         :returns: A ``Response`` instance.
         """
 
-        response = Response()
+        response = Response(self.body_limit)
         response(self.application, environ)
         return response
 
@@ -133,91 +313,347 @@ class TrainServer(object):
         the next application in the pipeline to function properly;
         this method acts as that fake application.  It returns a "200
         OK" response, with the "X-Train-Server" header set to
-        "completed".  The input environment will be pretty-printed and
-        returned as the body of the response.
+        "completed", after the configured service time.  The body of
+        the response depends on the application mode.
 
         :param environ: The request environment.
         :param start_response: A callable for starting the response.
 
-        :returns: A list of one element: the pretty-printed request
-                  environment.
+        :returns: A list of the elements of the response body.
         """
 
+        environ['train.app_entry'] = util.monotonic()
+
+        # Model the upstream application's service time
+        if self.service_time:
+            if self.service_dist == 'exponential':
+                time.sleep(random.expovariate(1.0 / self.service_time))
+            else:
+                time.sleep(self.service_time)
+
         start_response('200 OK', [('x-train-server', 'completed')])
-        return [pprint.pformat(environ)]
 
-    def start(self, queue):
+        if self.app_mode == 'debug':
+            body = [pprint.pformat(environ)]
+        elif self.app_mode == 'static':
+            body = [self.body]
+        else:
+            body = []
+
+        environ['train.app_exit'] = util.monotonic()
+        return body
+
+    def start(self, queue, slot=None):
         """
         Read requests from the queue, process them, and log the
         results.
 
-        :param queue: A queue object, implementing ``get()``.
+        :param queue: A queue object, implementing ``get()``.  Items
+                      on the queue may be WSGI environments, request
+                      keys, or lists of these (as placed onto the
+                      queue by ``transport.BatchingQueue``).
+        :param slot: An optional ``progress.WorkerSlot`` object, in
+                     which to count the requests processed.
         """
 
         # Get our PID for logging purposes
         pid = os.getpid()
+        self.slot = slot
 
         while True:
-            environ = queue.get()
+            item = queue.get()
+
+            # Drain a whole batch at a time
+            batch = item if isinstance(item, list) else [item]
+            for environ in batch:
+                # See if we've been commanded to stop
+                if environ == 'STOP':
+                    if self.results is not None:
+                        # put() hands the report to a background
+                        # thread; make sure it has been written
+                        # before the process exits
+                        self.results.put(self.report)
+                        self.results.close()
+                        self.results.join_thread()
+                    return
+
+                if slot is not None:
+                    slot.dispatched()
+                self._process(pid, environ)
+
+    def _process(self, pid, environ):
+        """
+        Process a single request from the queue and log the results.
 
-            # See if we've been commanded to stop
-            if environ == 'STOP':
-                return
+        :param pid: The process ID, for logging purposes.
+        :param environ: The WSGI environment of the request, or its
+                        key.
+        """
 
-            # Log the request
+        # Look up requests sent by key
+        if isinstance(environ, tuple):
+            seq_id, req_idx = environ[:2]
+            key = environ
+            environ = self.table[seq_id][req_idx].synthesize()
+            if len(key) > 2:
+                environ['train.enqueued'] = key[2]
+
+        # Only log a sample of the requests
+        sampled = (self.log_sample >= 1.0 or
+                   random.random() < self.log_sample)
+        text = sampled and self.log_format == 'text'
+
+        # Log the request
+        if text:
             LOG.info("%d: Processing request:\n%s" %
                      (pid, pprint.pformat(environ)))
 
+        try:
+            # Process the request
+            start = util.monotonic()
             try:
-                # Process the request
                 response = self(environ)
-
-                # Log the response
+            except Exception:
+                self._record(environ, start, 'error')
+                raise
+            self._record(environ, start, response.status,
+                         self._classify(environ, response))
+
+            # Log the response
+            if text:
+                body = response.body
+                if response.truncated:
+                    body += "\n[%d bytes total]" % response.body_length
                 LOG.info("%d: Response code %r; headers %s; body:\n%s" %
                          (pid, response.status,
-                          pprint.pformat(response.headers), response.body))
-            except Exception:
-                # Well, that didn't work out so well, did it?
-                LOG.exception("%d: Exception while processing request" %
-                              pid)
+                          pprint.pformat(response.headers), body))
+            elif sampled:
+                LOG.info("Processed request", extra={'train': {
+                    'method': environ.get('REQUEST_METHOD'),
+                    'path': environ.get('PATH_INFO'),
+                    'status': response.status,
+                    'body_length': response.body_length,
+                }})
+        except Exception:
+            # Well, that didn't work out so well, did it?
+            LOG.exception("%d: Exception while processing request" % pid)
+
+    def _classify(self, environ, response):
+        """
+        Determine whether Turnstile passed a request through to the
+        fake application, and record the outcome in the report.
+        Requests which did not reach the application are counted as
+        limited, along with the limit Turnstile selected (that with
+        the longest delay) and the "Retry-After" value returned.
+
+        :param environ: The WSGI environment of the request, as
+                        updated by Turnstile.
+        :param response: The ``Response`` object.
+
+        :returns: ``True`` if the request was limited, ``False``
+                  otherwise.
+        """
+
+        sequence = environ.get('train.sequence')
+        if response.header('X_TRAIN_SERVER') == 'completed':
+            self.report.outcomes.record(sequence)
+            return False
+
+        # Select the limit the way Turnstile does
+        limit = 'unknown'
+        if environ.get('turnstile.delay'):
+            limit = _limit_name(sorted(environ['turnstile.delay'],
+                                       key=lambda x: x[0])[-1][1])
+
+        try:
+            delay = float(response.header('RETRY_AFTER'))
+        except (TypeError, ValueError):
+            delay = None
+
+        self.report.outcomes.record(sequence, limit, delay)
+        return True
+
+    def _record(self, environ, start, status, limited=False):
+        """
+        Record a processed request in the report, and count it in the
+        worker's progress slot.  The time taken is also broken down
+        into phases, using the times stamped into the environment:
+        the time spent waiting to be processed since the request was
+        queued ("queue"), the time spent in Turnstile before the fake
+        application was called ("filter_pre"), the time spent in the
+        fake application ("app"), and the time spent in Turnstile
+        afterwards ("filter_post").  For requests which never reach
+        the fake application, all the time spent in Turnstile counts
+        as "filter_pre".
+
+        :param environ: The WSGI environment of the request.
+        :param start: The value of ``util.monotonic()`` when the
+                      request started processing.
+        :param status: The status of the response, such as "200 OK",
+                       or "error" if the request raised an exception.
+        :param limited: ``True`` if the request was rate-limited;
+                        see ``_classify()``.
+        """
+
+        end = util.monotonic()
+        duration = end - start
+        uri = '%s %s' % (environ.get('REQUEST_METHOD'),
+                         environ.get('RAW_PATH_INFO',
+                                     environ.get('PATH_INFO')))
+        report = self.report
+        report.record(environ.get('train.sequence'), uri, duration,
+                      str(status).partition(' ')[0])
+        if self.slot is not None:
+            self.slot.record(duration, status == 'error', limited)
+        if self.redis_stats:
+            report.commands.finish_request()
+
+        # Break down the time taken
+        if 'train.enqueued' in environ:
+            report.record_phase('queue', start - environ['train.enqueued'])
+        if 'train.app_entry' in environ:
+            app_exit = environ.get('train.app_exit', end)
+            report.record_phase('filter_pre',
+                                environ['train.app_entry'] - start)
+            report.record_phase('app', app_exit - environ['train.app_entry'])
+            report.record_phase('filter_post', end - app_exit)
+        else:
+            report.record_phase('filter_pre', duration)
 
     @classmethod
-    def from_confitems(cls, items):
+    def from_confitems(cls, items, redis_stats=False, **kwargs):
         """
         Construct a ``TrainServer`` object from the configuration
         items.
 
         :param items: A list of ``(key, value)`` tuples describing the
                       configuration to feed to the Turnstile middleware.
+        :param redis_stats: If ``True``, the Turnstile middleware is
+                            given an instrumented Redis client, so
+                            that the commands issued for each request
+                            are counted and timed in the report.  The
+                            control daemon keeps its own client, which
+                            is not instrumented.
+
+        Additional keyword arguments are passed to the ``TrainServer``
+        constructor.
+
+        If the "train.fake_redis" item is true, Turnstile's Redis
+        configuration is replaced with a ``memredis.FakeRedis`` server
+        on a Unix socket, started here so that the workers forked
+        afterward share it; it is stopped when this process exits or
+        is terminated.
+        As the fake server starts out empty, the limits are loaded
+        into it from the XML file named by the "train.fake_redis_limits"
+        item, if given.
 
         :returns: An instance of ``TrainServer``.
         """
 
         local_conf = dict(items)
+        fake_redis = local_conf.pop('train.fake_redis', 'false')
+        limits_file = local_conf.pop('train.fake_redis_limits', None)
+        if config.Config.to_bool(fake_redis):
+            fake = memredis.FakeRedis()
+            fake.start()
+            atexit.register(fake.stop)
+            fake.stop_on_signal()
+
+            # Point Turnstile, including its control daemon, at the
+            # fake server
+            for key in local_conf.keys():
+                if key.startswith(('redis.', 'control.redis.')):
+                    del local_conf[key]
+            local_conf['redis.unix_socket_path'] = fake.path
+
+            if limits_file:
+                memredis.load_limits(config.Config(conf_dict=local_conf),
+                                     limits_file)
+
         filter = middleware.turnstile_filter({}, **local_conf)
-        return cls(filter)
+        server = cls(filter, **kwargs)
+
+        if redis_stats:
+            # Turnstile's control daemon shares the middleware's
+            # client, and uses it from its own green threads, as when
+            # reloading the limits; give the middleware a client of
+            # its own, so that only the commands issued while
+            # processing requests are counted
+            application = server.application
+            application._db = instrument.instrument_redis(
+                application.conf.get_database(), server.report.commands)
+            server.redis_stats = True
+
+        return server
+
+
+def _limit_name(limit):
+    """
+    Describe a Turnstile limit, for reporting.
+
+    :param limit: A ``turnstile.limits.Limit`` object.
+
+    :returns: A string such as "GET /servers (10/minute)".
+    """
+
+    return '%s %s (%s/%s)' % (','.join(limit.verbs) or '*', limit.uri,
+                              limit.value, limit.unit)
 
 
-def start_workers(queue, items, workers=1):
+def start_workers(queue, items, workers=1, profile_dir=None,
+                  sample_rate=None, **kwargs):
     """
     Start the train workers.  Each worker pops requests off the queue,
     passes them through Turnstile, and logs the result.
 
-    :param queue: A queue object, implementing ``get()``.
+    :param queue: A queue object, implementing ``get()``.  If the
+                  queue object implements ``worker()``, each worker
+                  retrieves its requests from the queue object it
+                  returns.
     :param items: A list of ``(key, value)`` tuples describing the
                   configuration to feed to the Turnstile middleware.
     :param workers: The number of workers to create.
+    :param profile_dir: If provided, each worker is run under
+                        ``cProfile``, and writes its statistics to a
+                        file in this directory when it exits; see
+                        ``profiling.worker_path()``.
+    :param sample_rate: If provided along with ``profile_dir``, each
+                        worker is run under the sampling profiler
+                        instead, taking this many samples per second
+                        of CPU time, and writes its stacks in
+                        collapsed format.
+
+    Additional keyword arguments are passed to the ``TrainServer``
+    constructor.
 
     :returns: A list of process IDs of the workers.
     """
 
     # Generate the server object
-    train_server = TrainServer.from_confitems(items)
-    launcher = util.Launcher(train_server.start, queue)
+    train_server = TrainServer.from_confitems(items, **kwargs)
 
     servers = []
     for worker in range(workers):
-        # Launch the server
+        # Give the worker its own progress slot
+        start_kwargs = {}
+        if train_server.progress is not None:
+            start_kwargs['slot'] = train_server.progress.slot(worker)
+
+        # Profile the server, if desired
+        start = train_server.start
+        if profile_dir and sample_rate:
+            start = profiling.Sampler(
+                start, profiling.worker_path(profile_dir, worker,
+                                             'collapsed'),
+                1.0 / sample_rate)
+        elif profile_dir:
+            start = profiling.Profiler(
+                start, profiling.worker_path(profile_dir, worker))
+
+        # Launch the server on its queue
+        launcher = util.Launcher(start,
+                                 transport.worker(queue, worker),
+                                 **start_kwargs)
         servers.append(launcher.start())
 
     return servers